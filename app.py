@@ -6,15 +6,22 @@ import csv
 import traceback
 import logging
 import runpy
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, session, make_response
+from flask import Flask, Response, render_template, request, jsonify, send_file, redirect, url_for, session, make_response
 import json
 import re
 from werkzeug.security import check_password_hash
 import bcrypt
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import func
-from trading_app import run_analysis, smart_combine_indicators, fetch_ohlcv, get_report_translation  # твой модуль анализа
+from trading_app import run_analysis, smart_combine_indicators, fetch_ohlcv, get_report_translation, ReportFeatureTable, start_kline_stream, parse_stream_subscriptions, scan_markets, top_symbols_by_volume, SCAN_MAX_SYMBOLS, store_report, render_report, STRATEGY_INPUT_MAP, TRADING_TYPE_INPUT_MAP, MONTE_CARLO_MAX_SIMULATIONS  # твой модуль анализа
+from core.job_queue import JobQueue, JOB_QUEUED, JOB_DONE, JOB_FAILED, FINISHED_STATUSES
+from core.artifact_store import ArtifactStore
+from core.frame_export import EXPORT_FORMATS, frame_to_bytes, read_frame, write_export, write_xlsx
+from core.indicator_cache import IndicatorCache
 import requests
 import smtplib
 from email.mime.text import MIMEText
@@ -568,6 +575,206 @@ def demo_page():
             return f"<html><body><h1>Demo Mode Error</h1><p>Error: {str(e)}</p><p>Details: {str(e2)}</p></body></html>", 500
 
 
+# === Таблица признаков завершенных отчетов для ML-прогноза ===
+ML_FEATURE_TABLE = ReportFeatureTable(max_rows=int(os.getenv("ML_FEATURE_TABLE_MAX_ROWS", "1000")))
+_ml_feature_table_lock = threading.Lock()
+
+
+def get_ml_feature_table():
+    """
+    Возвращает кэшированную таблицу признаков последних завершенных отчетов.
+    Каждый вызов читает из БД только пары (id, success) окна ML_FEATURE_TABLE_MAX_ROWS
+    последних завершенных отчетов; полные строки догружаются лишь для новых отчетов
+    (в том числе старых, завершенных позже новых) и отчетов с изменившимся результатом.
+    Возвращается неизменяемый снимок таблицы: синхронизация из других запросов его не трогает.
+    """
+    with _ml_feature_table_lock:
+        table = ML_FEATURE_TABLE
+        resolved = db.session.query(ReportV2.id, ReportV2.success).filter(
+            ReportV2.success.isnot(None)
+        ).order_by(ReportV2.id.desc()).limit(table.max_rows).all()
+
+        def load(ids):
+            rows = []
+            # Частями: у старых SQLite лимит 999 параметров в запросе
+            for start in range(0, len(ids), 500):
+                rows.extend(db.session.query(
+                    ReportV2.id, ReportV2.strategy, ReportV2.trading_type, ReportV2.direction, ReportV2.trend,
+                    ReportV2.rr_long, ReportV2.rr_short, ReportV2.confirmation, ReportV2.success,
+                ).filter(ReportV2.id.in_(ids[start:start + 500])).all())
+            return rows
+
+        added, removed = table.sync(resolved, load)
+        if added or removed:
+            logger.info(f"📊 ML: в таблице признаков +{added} / -{removed} отчетов (всего {len(table)})")
+        return table.snapshot()
+
+
+# === Потоковые свечи: KLINE_STREAM_SUBSCRIPTIONS="BTC/USDT:1h,ETH/USDT:5m" ===
+# (поток запускается в каждом процессе; с gunicorn --preload потоки не переживут fork).
+# Процесс пула отрисовки графиков (spawn) при "python app.py" импортирует этот модуль
+# как __mp_main__ - поток ему не нужен
+if os.getenv("KLINE_STREAM_SUBSCRIPTIONS") and __name__ != "__mp_main__":
+    start_kline_stream(parse_stream_subscriptions(os.getenv("KLINE_STREAM_SUBSCRIPTIONS")))
+
+
+# === Очередь фоновых задач анализа ===
+ANALYSIS_JOBS = JobQueue.from_env(os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "analysis_jobs.db"))
+JOB_STREAM_TIMEOUT = float(os.getenv("JOB_STREAM_TIMEOUT", "300"))
+
+# === Файлы анализа (график, ZIP) отдаются ссылками /api/artifacts/<id> вместо base64 в JSON ===
+ARTIFACT_STORE = ArtifactStore.from_env(os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "artifacts"))
+
+# Кадр индикаторов анализа сохраняется в хранилище компактным файлом (.frame), выгрузки
+# собираются из него при первом скачивании. Недавние кадры держатся и в памяти процесса,
+# чтобы не читать файл заново. FRAME_CACHE_ENTRIES / FRAME_CACHE_MAX_MB ограничивают память
+FRAME_CACHE = IndicatorCache(
+    max_entries=int(os.getenv("FRAME_CACHE_ENTRIES", "32")),
+    max_bytes=int(float(os.getenv("FRAME_CACHE_MAX_MB", "128")) * 1024 * 1024),
+    ttl_seconds=ARTIFACT_STORE.ttl_seconds if ARTIFACT_STORE is not None else 0,
+)
+
+
+def _artifact_ref(data, extension, owner=None):
+    """
+    {"id", "url"} сохраненного файла или None, если хранилище отключено или запись не удалась.
+    owner (как у _job_owner) записывается владельцем: /api/artifacts отдает файл только ему.
+    """
+    if ARTIFACT_STORE is None or not data:
+        return None
+    try:
+        artifact_id = ARTIFACT_STORE.put(data, extension, owner=owner)
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось сохранить файл анализа: {e}")
+        return None
+    # Путь без url_for: анализ может выполняться в фоновой задаче вне контекста запроса
+    return {"id": artifact_id, "url": f"/api/artifacts/{artifact_id}"}
+
+
+def _write_report_zip(fileobj, report_text, chart_png=None, write_data=None):
+    """ZIP отчета: report.txt, chart.png и data.xlsx (write_data(fileobj) пишет xlsx в архив потоком)."""
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("report.txt", report_text)
+        if chart_png:
+            z.writestr("chart.png", chart_png)
+        if write_data is not None:
+            with z.open("data.xlsx", "w") as data_file:
+                write_data(data_file)
+
+
+def _frame_ref(frame, owner=None):
+    """
+    {"id", "url"} кадра индикаторов, сохраненного в хранилище (parquet или npz, без pickle),
+    или None (хранилище отключено, запись не удалась). Кадр остается и в FRAME_CACHE.
+    """
+    if ARTIFACT_STORE is None or frame is None:
+        return None
+    try:
+        ref = _artifact_ref(frame_to_bytes(frame), "frame", owner)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось сохранить кадр индикаторов: {e}")
+        return None
+    if ref:
+        FRAME_CACHE.put(ref["id"], frame)
+    return ref
+
+
+def _frame_export_id(frame_id, fmt):
+    """
+    Выгрузка кадра индикаторов: собирается один раз (из кадра в памяти или из файла кадра
+    в хранилище), дальше отдается из хранилища. Кадра нет ни там, ни там - FileNotFoundError.
+    """
+    def build(fileobj):
+        frame = FRAME_CACHE.get(frame_id)
+        if frame is None:
+            frame_path = ARTIFACT_STORE.path(frame_id)
+            if frame_path is None:
+                raise FileNotFoundError(frame_id)
+            frame = read_frame(frame_path)
+            FRAME_CACHE.put(frame_id, frame)
+        write_export(frame, fmt, fileobj)
+
+    return ARTIFACT_STORE.get_or_build(frame_id, fmt, build)
+
+
+def _report_zip_id(bundle_id):
+    """ZIP отчета по описанию комплекта {"report", "chart", "frame"} - собирается при первом скачивании."""
+    bundle_path = ARTIFACT_STORE.path(bundle_id)
+    if bundle_path is None:
+        raise FileNotFoundError(bundle_id)
+    with open(bundle_path, "r", encoding="utf-8") as f:
+        bundle = json.load(f)
+    paths = {key: ARTIFACT_STORE.path(bundle[key]) if bundle.get(key) else None for key in ("report", "chart")}
+    if paths["report"] is None or (bundle.get("chart") and paths["chart"] is None):
+        raise FileNotFoundError(bundle_id)
+    data_path = ARTIFACT_STORE.path(_frame_export_id(bundle["frame"], "xlsx")) if bundle.get("frame") else None
+
+    def build(fileobj):
+        with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as z:
+            z.write(paths["report"], "report.txt")
+            if paths["chart"]:
+                z.write(paths["chart"], "chart.png")
+            if data_path:
+                z.write(data_path, "data.xlsx")
+
+    return ARTIFACT_STORE.get_or_build(bundle_id, "zip", build)
+
+
+def _job_owner():
+    """Владелец задачи: пользователь, а в demo режиме - токен текущей сессии."""
+    if session.get("user_id"):
+        return f"user:{session['user_id']}"
+    token = session.get("job_owner")
+    if not token:
+        token = uuid.uuid4().hex
+        session["job_owner"] = token
+    return f"demo:{token}"
+
+
+def _analysis_job(data, user_id, demo_mode, owner):
+    """Выполняет анализ в потоке очереди (вне контекста запроса)."""
+    with app.app_context():
+        payload, status = _execute_analysis(data, user_id, demo_mode, owner)
+    if status != 200:
+        raise RuntimeError(payload.get("error") or f"HTTP {status}")
+    return payload
+
+
+def _job_response(job):
+    """JSON-представление задачи для клиента."""
+    response = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+    if job["status"] == JOB_FAILED:
+        response["error"] = job.get("error")
+    if "result" in job and job["status"] == JOB_DONE:
+        response["result"] = job["result"]
+    return response
+
+
+def _submit_job(kind, func, *args, **kwargs):
+    job_id = ANALYSIS_JOBS.submit(_job_owner(), kind, func, *args, **kwargs)
+    if job_id is None:
+        logger.warning(f"⚠️ Очередь анализа переполнена ({ANALYSIS_JOBS.pending} задач)")
+        return jsonify({"error": "Analysis queue is full, try again later"}), 503
+    logger.info(f"🧾 Задача {kind} поставлена в очередь: {job_id}")
+    return jsonify({
+        "job_id": job_id,
+        "status": JOB_QUEUED,
+        "status_url": url_for("analysis_job_status", job_id=job_id),
+        "events_url": url_for("analysis_job_events", job_id=job_id),
+    }), 202
+
+
+def _submit_analysis_job(data):
+    return _submit_job("analyze", _analysis_job, data, session.get("user_id"), bool(session.get("demo_mode")),
+                       _job_owner())
+
+
 # === API: Анализ ===
 @app.route("/api/analyze", methods=["POST"])
 def run_analysis_route():
@@ -577,8 +784,130 @@ def run_analysis_route():
         return jsonify({"error": get_translation("error_unauthorized", language)}), 401
 
     data = request.json or {}
-    user_id = session.get("user_id")  # Может быть None в demo режиме
+    # "async": true - вернуть id задачи сразу, результат получить через /api/analyze/jobs/<id>
+    if data.get("async"):
+        return _submit_analysis_job(data)
+
+    payload, status = _execute_analysis(data, session.get("user_id"), bool(session.get("demo_mode")), _job_owner())
+    return jsonify(payload), status
+
+
+# === API: Фоновые задачи анализа ===
+@app.route("/api/analyze/jobs", methods=["POST"])
+def submit_analysis_job():
+    if not session.get("user_id") and not session.get("demo_mode"):
+        language = request.args.get('language') or (request.json.get('language') if request.json else None) or 'ru'
+        return jsonify({"error": get_translation("error_unauthorized", language)}), 401
+    return _submit_analysis_job(request.json or {})
+
+
+@app.route("/api/analyze/jobs/<job_id>", methods=["GET"])
+def analysis_job_status(job_id):
+    job = ANALYSIS_JOBS.get(job_id, owner=_job_owner())
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(_job_response(job))
+
+
+@app.route("/api/analyze/jobs/<job_id>/events", methods=["GET"])
+def analysis_job_events(job_id):
+    """Server-Sent Events: событие status при каждой смене статуса и result по завершении."""
+    owner = _job_owner()
+    if ANALYSIS_JOBS.get(job_id, owner=owner, include_result=False) is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def generate():
+        last_status = None
+        last_sent = time.monotonic()
+        deadline = last_sent + JOB_STREAM_TIMEOUT
+        while True:
+            job = ANALYSIS_JOBS.get(job_id, owner=owner, include_result=False)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            if job["status"] in FINISHED_STATUSES:
+                job = ANALYSIS_JOBS.get(job_id, owner=owner) or job
+                yield f"event: result\ndata: {json.dumps(_job_response(job))}\n\n"
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                last_sent = time.monotonic()
+                yield f"event: status\ndata: {json.dumps(_job_response(job))}\n\n"
+            elif time.monotonic() - last_sent > 15:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            if time.monotonic() > deadline:
+                yield f"event: timeout\ndata: {json.dumps(_job_response(job))}\n\n"
+                return
+            time.sleep(0.5)
+
+    return Response(generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# === API: Сканер рынков ===
+def _scan_params(data):
+    """
+    Параметры scan_markets из JSON запроса.
+    Рынки: "symbols" (список или строка через запятую) или "top" - N самых ликвидных пар.
+    """
+    symbols = data.get("symbols")
+    if isinstance(symbols, str):
+        symbols = [s for s in symbols.split(",") if s.strip()]
+    if not symbols and data.get("top"):
+        symbols = top_symbols_by_volume(min(int(data["top"]), SCAN_MAX_SYMBOLS), quote=data.get("quote") or "USDT")
+    timeframe = data.get("timeframe")
+    if timeframe in ("auto", ""):
+        timeframe = None
+    strategy_input = data.get("strategy", "balanced")
+    trading_type_input = data.get("trading_type", "daytrading")
+    return {
+        "symbols": list(symbols or []),
+        "strategy": STRATEGY_INPUT_MAP.get(strategy_input, strategy_input),
+        "trading_type": TRADING_TYPE_INPUT_MAP.get(trading_type_input, trading_type_input),
+        "timeframe": timeframe,
+        "confirmation": data.get("confirmation") or "ALL",
+        "min_reliability": float(data.get("min_reliability", 0) or 0),
+    }
+
+
+@app.route("/api/scan", methods=["POST"])
+def scan_route():
+    """Скан списка рынков: таблица сигналов по убыванию рейтинга надежности и R:R."""
+    data = request.json or {}
+    if not session.get("user_id") and not session.get("demo_mode"):
+        return jsonify({"error": get_translation("error_unauthorized", data.get("language") or "ru")}), 401
 
+    try:
+        params = _scan_params(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid scan parameters: {e}"}), 400
+    except Exception as e:
+        logger.error(f"❌ Не удалось получить список рынков для скана: {e}")
+        return jsonify({"error": "Failed to load market list"}), 502
+    if not params["symbols"]:
+        return jsonify({"error": "Pass 'symbols' or 'top'"}), 400
+
+    if data.get("async"):
+        return _submit_job("scan", scan_markets, **params)
+
+    try:
+        result = scan_markets(**params)
+    except Exception as e:
+        logger.error(f"❌ Ошибка скана рынков: {e}")
+        return jsonify({"error": str(e)}), 500
+    logger.info(f"🔎 Скан {result['scanned']} рынков за {result['elapsed']} сек, сигналов: {len(result['results'])}")
+    return jsonify(result)
+
+
+def _execute_analysis(data, user_id, demo_mode=False, owner=None):
+    """
+    Выполняет анализ по параметрам запроса.
+    Общая часть синхронного /api/analyze и фоновых задач очереди.
+    owner (_job_owner) - владелец файлов анализа в хранилище.
+
+    Возвращает:
+    - (payload, http_status)
+    """
     try:
         # Получаем параметры трейлинга
         enable_trailing = bool(data.get("enable_trailing", False))
@@ -589,34 +918,11 @@ def run_analysis_route():
         if timeframe == "auto" or timeframe == "" or timeframe is None:
             timeframe = None  # Используется дефолтный таймфрейм для типа торговли
         
-        # Маппинг значений из формы в русские названия
-        strategy_map = {
-            "conservative": "Консервативная",
-            "balanced": "Сбалансированная",
-            "aggressive": "Агрессивная",
-            "Консервативная": "Консервативная",
-            "Сбалансированная": "Сбалансированная",
-            "Агрессивная": "Агрессивная"
-        }
-        
-        trading_type_map = {
-            "scalping": "Скальпинг",
-            "daytrading": "Дейтрейдинг",
-            "swing": "Свинг",
-            "medium_term": "Среднесрочная",
-            "long_term": "Долгосрочная",
-            "Скальпинг": "Скальпинг",
-            "Дейтрейдинг": "Дейтрейдинг",
-            "Свинг": "Свинг",
-            "Среднесрочная": "Среднесрочная",
-            "Долгосрочная": "Долгосрочная"
-        }
-        
         strategy_input = data.get("strategy", "balanced")
         trading_type_input = data.get("trading_type", "daytrading")
         
-        strategy = strategy_map.get(strategy_input, strategy_input)
-        trading_type = trading_type_map.get(trading_type_input, trading_type_input)
+        strategy = STRATEGY_INPUT_MAP.get(strategy_input, strategy_input)
+        trading_type = TRADING_TYPE_INPUT_MAP.get(trading_type_input, trading_type_input)
         
         # ✅ Получаем спред биржи из настроек пользователя
         user = User.query.get(user_id)
@@ -626,12 +932,17 @@ def run_analysis_route():
         language = data.get("language", "ru")
         if language not in ["ru", "en", "uk"]:
             language = "ru"
+        chart_format = "json" if data.get("chart_format") == "json" else "png"
+        # Монте-Карло по сделкам бэктеста только по запросу: true или количество симуляций
+        monte_carlo = data.get("monte_carlo")
+        if monte_carlo is not True:
+            monte_carlo = min(max(int(monte_carlo or 0), 0), MONTE_CARLO_MAX_SIMULATIONS)
         
         (
-            reports_by_language,  # ✅ Словарь с отчетами на всех языках
-            report_markdown_raw,  # Сырой markdown (для совместимости)
+            reports_by_language,  # ✅ Отчет на запрошенном языке {language: text}
+            report_markdown_raw,  # Сырой markdown с ключами - сохраняется в хранилище отчетов
             chart_bytes,
-            excel_bytes,
+            indicator_frame,  # Кадр индикаторов: xlsx/csv/parquet собираются при скачивании
             symbol,
             rr_long,
             rr_short,
@@ -661,16 +972,25 @@ def run_analysis_route():
             bool(data.get("enable_backtest", False)),
             data.get("backtest_days"),  # может быть None или int
             bool(data.get("enable_ml", False)),
-            ReportV2.query.filter(ReportV2.success.isnot(None)).limit(1000).all() if bool(data.get("enable_ml", False)) else None,
+            get_ml_feature_table() if bool(data.get("enable_ml", False)) else None,
             enable_trailing=enable_trailing,
             trailing_percent=trailing_percent,
             spread=exchange_spread,  # ✅ Передаем спред биржи
-            language=language  # ✅ Передаем язык
+            language=language,  # ✅ Передаем язык
+            walk_forward=min(max(int(data.get("walk_forward") or 0), 0), 12),  # Окна walk-forward бэктеста (0 - выкл.)
+            chart_format=chart_format,
+            monte_carlo=monte_carlo,
         )
+        # chart_format="json": вместо PNG - ряды и уровни графика для отрисовки на клиенте
+        chart_series = None
+        if isinstance(chart_bytes, dict):
+            chart_series, chart_bytes = chart_bytes, None
 
         # ✅ ИСПРАВЛЕНИЕ: Определяем report_text для использования в коде
         current_lang = language if language in ["ru", "en", "uk"] else "ru"
-        report_text = reports_by_language.get(current_lang, reports_by_language["ru"])
+        report_text = reports_by_language[current_lang]
+        # Другие языки отрисовываются по report_id через /api/translate_report
+        report_id = store_report(report_markdown_raw, rendered={current_lang: report_text})
 
         # ✅ ГИБРИДНЫЙ ПОДХОД: Расчет profit_loss с использованием динамического риска (как в backtest)
         # Используем ту же логику, что и в backtest_strategy для согласованности
@@ -786,7 +1106,7 @@ def run_analysis_route():
             return value
         
         # ✅ В demo режиме не сохраняем отчеты в БД
-        if session.get("demo_mode"):
+        if demo_mode:
             logger.info("💡 Demo режим: отчет не сохранен в БД")
         else:
             # ✅ current_lang уже определен выше (строка 570)
@@ -799,7 +1119,7 @@ def run_analysis_route():
                 capital=float(data.get("capital", 0)),
                 risk=float(data.get("risk", 0)),
                 confirmation=str(data.get("confirmation", "")),
-                report_text=reports_by_language.get(current_lang, reports_by_language["ru"]),  # Сохраняем отчет на текущем языке
+                report_text=report_text,  # Сохраняем отчет на текущем языке
                 rr_long=convert_numpy(rr_long),
                 rr_short=convert_numpy(rr_short),
                 trend=trend,
@@ -885,7 +1205,7 @@ def run_analysis_route():
 
         # === Уведомления ===
         # ✅ В demo режиме не отправляем уведомления
-        if session.get("demo_mode"):
+        if demo_mode:
             logger.info("💡 Demo режим: уведомления не отправляются")
         else:
             user = User.query.get(user_id)
@@ -946,15 +1266,38 @@ def run_analysis_route():
                 elif reliability_rating < alert_min_reliability:
                     logger.info(f"⚠️ Уведомления не отправлены: reliability_rating ({reliability_rating}) < alert_min_reliability ({alert_min_reliability})")
 
-        chart_base64 = base64.b64encode(chart_bytes.getvalue()).decode() if chart_bytes else None
-        zip_buf = io.BytesIO()
-        with zipfile.ZipFile(zip_buf, "w") as z:
-            z.writestr("report.txt", report_text)
-            if chart_bytes:
-                z.writestr("chart.png", chart_bytes.getvalue())
-            if excel_bytes:
-                z.writestr("data.xlsx", excel_bytes.getvalue())
-        zip_base64 = base64.b64encode(zip_buf.getvalue()).decode()
+        # График, текст отчета и кадр индикаторов - файлами в хранилище, в ответе только ссылки.
+        # ZIP и выгрузки данных (xlsx/csv/parquet) собираются при первом скачивании:
+        # /api/artifacts/<комплект>/zip и /api/artifacts/<кадр>/<формат>
+        chart_png = chart_bytes.getvalue() if chart_bytes else None
+        chart_ref = _artifact_ref(chart_png, "png", owner)
+        frame_ref = _frame_ref(indicator_frame, owner)
+        report_ref = _artifact_ref(report_text.encode("utf-8"), "txt", owner)
+        data_refs = None
+        zip_ref = None
+        if frame_ref:
+            data_refs = {"id": frame_ref["id"], **{fmt: f"{frame_ref['url']}/{fmt}" for fmt in EXPORT_FORMATS}}
+        if report_ref and frame_ref and (chart_ref or not chart_png):
+            bundle = json.dumps({
+                "report": report_ref["id"],
+                "chart": chart_ref["id"] if chart_ref else None,
+                "frame": frame_ref["id"],
+            }, sort_keys=True)
+            bundle_ref = _artifact_ref(bundle.encode("utf-8"), "json", owner)
+            if bundle_ref:
+                zip_ref = {"id": bundle_ref["id"], "url": f"{bundle_ref['url']}/zip"}
+
+        # inline_artifacts=true (десктоп-приложение сохраняет ZIP из base64) или
+        # отключенное хранилище - прежний формат с base64 в JSON, ZIP собирается сразу
+        inline_artifacts = bool(data.get("inline_artifacts")) or zip_ref is None
+        chart_base64 = None
+        zip_base64 = None
+        if inline_artifacts:
+            zip_buf = io.BytesIO()
+            _write_report_zip(zip_buf, report_text, chart_png,
+                              (lambda f: write_xlsx(indicator_frame, f)) if indicator_frame is not None else None)
+            chart_base64 = base64.b64encode(chart_png).decode() if chart_png else None
+            zip_base64 = base64.b64encode(zip_buf.getvalue()).decode()
 
         # Вспомогательная функция для безопасной конвертации в float для JSON
         def safe_float(value):
@@ -986,12 +1329,14 @@ def run_analysis_route():
         
         # ✅ current_lang уже определен выше (строка 570)
         
-        return jsonify({
-            "report_text": reports_by_language.get(current_lang, reports_by_language["ru"]),  # Текущий язык
-            "reports_by_language": reports_by_language,  # ✅ ВСЕ три версии отчета
-            "report_markdown_raw": report_markdown_raw,  # Для совместимости
-            "chart_base64": chart_base64,
-            "zip_base64": zip_base64,
+        payload = {
+            "report_text": report_text,  # Текущий язык
+            "reports_by_language": reports_by_language,  # Только текущий язык, остальные - по report_id
+            "report_id": report_id,
+            "artifacts": {"chart": chart_ref, "zip": zip_ref, "data": data_refs},
+            "chart_url": chart_ref["url"] if chart_ref else None,
+            "chart_series": chart_series,
+            "zip_url": zip_ref["url"] if zip_ref else None,
             "symbol": symbol,
             "entry_price": safe_float(entry_price),
             "stop_loss": safe_float(stop_loss),
@@ -1000,29 +1345,104 @@ def run_analysis_route():
             "enable_trailing": enable_trailing,
             "trailing_percent": trailing_percent,
             "psychological_levels": psychological_levels  # ✅ Добавляем психологические уровни
-        })
+        }
+        if report_id is None:
+            # Хранилище отчетов отключено - клиент переводит сам markdown с ключами
+            payload["report_markdown_raw"] = report_markdown_raw
+        if inline_artifacts:
+            payload["chart_base64"] = chart_base64
+            payload["zip_base64"] = zip_base64
+        return payload, 200
     except Exception as e:
         traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
+
+
+# === API: Файлы анализа по ссылке ===
+def _send_artifact(artifact_id, download_name=None):
+    """
+    Отдает файл из хранилища потоком. Содержимое по id не меняется,
+    поэтому ETag = id, а ответ можно кэшировать до конца TTL.
+    """
+    path = ARTIFACT_STORE.path(artifact_id) if ARTIFACT_STORE is not None else None
+    if path is None:
+        return jsonify({"error": "Artifact not found"}), 404
+    response = send_file(
+        path,
+        mimetype=ArtifactStore.content_type(artifact_id),
+        as_attachment=bool(download_name),
+        download_name=download_name or artifact_id,
+        conditional=True,
+        etag=artifact_id,
+        max_age=int(ARTIFACT_STORE.ttl_seconds),
+    )
+    # Файл отдается только владельцу анализа: общим кэшам (прокси, CDN) его не отдаем
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route("/api/artifacts/<artifact_id>", methods=["GET"])
+def download_artifact(artifact_id):
+    """Файл анализа по id (только владельцу). ?download=<имя> - отдать как вложение с этим именем."""
+    if ARTIFACT_STORE is None or not ARTIFACT_STORE.is_owner(artifact_id, _job_owner()):
+        return jsonify({"error": "Artifact not found"}), 404
+    return _send_artifact(artifact_id, request.args.get("download"))
+
+
+@app.route("/api/artifacts/<artifact_id>/<fmt>", methods=["GET"])
+def export_artifact(artifact_id, fmt):
+    """
+    Файл, который собирается по запросу из сохраненного:
+    - кадр индикаторов (.frame) -> xlsx / csv / parquet
+    - комплект отчета (.json) -> zip (report.txt, chart.png, data.xlsx)
+    Владелец проверяется по исходному файлу. ?download=<имя> переопределяет имя вложения.
+    """
+    if ARTIFACT_STORE is None or not ARTIFACT_STORE.is_owner(artifact_id, _job_owner()):
+        return jsonify({"error": "Artifact not found"}), 404
+    kind = artifact_id.rsplit(".", 1)[-1]
+    try:
+        if kind == "frame" and fmt in EXPORT_FORMATS:
+            result_id = _frame_export_id(artifact_id, fmt)
+            default_name = f"data.{fmt}"
+        elif kind == "json" and fmt == "zip":
+            result_id = _report_zip_id(artifact_id)
+            default_name = "analysis_report.zip"
+        else:
+            return jsonify({"error": "Unsupported export"}), 404
+    except FileNotFoundError:
+        return jsonify({"error": "Artifact not found"}), 404
+    except ImportError as e:
+        # parquet без pyarrow/fastparquet
+        return jsonify({"error": f"Export format unavailable: {e}"}), 501
+    return _send_artifact(result_id, request.args.get("download") or default_name)
 
 
 # === API: Перевод markdown отчета ===
 @app.route("/api/translate_report", methods=["POST"])
 def translate_report():
-    """Переводит markdown отчет с ключами {{key}} на указанный язык"""
+    """Переводит отчет на указанный язык: по report_id из /api/analyze или markdown с ключами {{key}}"""
     if not request.json:
         return jsonify({"error": "JSON required"}), 400
     
+    report_id = request.json.get("report_id")
     markdown = request.json.get("markdown")
     language = request.json.get("language", "ru")
     
-    if not markdown:
-        return jsonify({"error": "markdown required"}), 400
+    if not report_id and not markdown:
+        return jsonify({"error": "report_id or markdown required"}), 400
     
     if language not in ["ru", "en", "uk"]:
         language = "ru"
     
     try:
+        if report_id:
+            translated = render_report(str(report_id), language)
+            if translated is None:
+                return jsonify({"error": "report not found", "report_id": report_id}), 404
+            return jsonify({"translated": translated, "report_id": report_id, "language": language})
+
         from trading_app import translate_markdown
         translated = translate_markdown(markdown, language)
         return jsonify({"translated": translated})
@@ -2585,6 +3005,11 @@ def cleanup_connections():
     try:
         # Отключаем предупреждения urllib3
         urllib3.disable_warnings()
+        # Не принимаем новые фоновые задачи анализа
+        try:
+            ANALYSIS_JOBS.shutdown(wait=False)
+        except:
+            pass
         # Закрываем соединение с БД
         try:
             db.session.close()
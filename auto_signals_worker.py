@@ -4,14 +4,20 @@
 """
 import os
 import sys
+import time
+import queue
+import signal
+import argparse
+import threading
 from datetime import datetime, timedelta
 import logging
 
 # Добавляем путь к проекту
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db, User
-from trading_app import run_analysis
+from app import app, db, User, cleanup_connections
+from core.candle_store import next_candle_close
+from trading_app import run_analysis, market_params, prepare_market_frame, start_kline_stream, STRATEGY_INPUT_MAP, TRADING_TYPE_INPUT_MAP
 from app import send_email_notification, send_telegram_notification, format_alert_message
 
 logging.basicConfig(
@@ -57,65 +63,314 @@ TRADING_TYPE_INTERVALS = {
     "Долгосрочная": 1440  # 1 день
 }
 
-def check_auto_signals():
-    """Проверяет всех пользователей с включенными автоматическими сигналами."""
+# Параметры планировщика (переопределяются аргументами командной строки)
+AUTO_SIGNALS_WORKERS = int(os.getenv("AUTO_SIGNALS_WORKERS", "4"))  # Одновременно анализируемых пользователей
+AUTO_SIGNALS_USER_TIMEOUT = float(os.getenv("AUTO_SIGNALS_USER_TIMEOUT", "120"))  # Дедлайн на одного пользователя (сек)
+AUTO_SIGNALS_TICK_BUDGET = float(os.getenv("AUTO_SIGNALS_TICK_BUDGET", "270"))  # Лимит тика (меньше интервала cron 5 мин)
+AUTO_SIGNALS_CLOSE_DELAY = float(os.getenv("AUTO_SIGNALS_CLOSE_DELAY", "5"))  # Пауза после закрытия свечи, пока биржа ее опубликует (сек)
+AUTO_SIGNALS_REFRESH = float(os.getenv("AUTO_SIGNALS_REFRESH", "300"))  # Как часто демон перечитывает таймфреймы пользователей (сек)
+
+
+def _check_interval_minutes(user):
+    """Интервал проверки пользователя в минутах (по типу торговли)."""
+    return TRADING_TYPE_INTERVALS.get(
+        user.auto_signal_trading_type,
+        user.auto_signal_check_interval or 60
+    )
+
+
+def _next_due_at(user):
+    """Момент, когда пользователь должен быть проверен (никогда не проверявшиеся - первыми)."""
+    if not user.auto_signal_last_check:
+        return datetime.min
+    return user.auto_signal_last_check + timedelta(minutes=_check_interval_minutes(user))
+
+
+def process_user(user_id, cancelled=None, market_df=None):
+    """
+    Проверяет одного пользователя в отдельном контексте приложения (своя сессия БД).
+
+    Параметры:
+    - user_id: id пользователя
+    - cancelled: threading.Event - выставляется планировщиком, если пользователь не уложился в дедлайн;
+      тогда результат опоздавшего анализа не отправляется и не сохраняется
+    - market_df: общий кадр рынка с индикаторами (None - анализ загрузит рынок сам)
+
+    Возвращает:
+    - "signal", "ok", "error", "timeout" или "skipped"
+    """
+    with app.app_context():
+        try:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return "skipped"
+
+            # Выполняем анализ
+            result = run_analysis_for_user(user, market_df=market_df)
+
+            if cancelled is not None and cancelled.is_set():
+                logger.warning(f"Анализ пользователя {user_id} завершился после дедлайна, результат отброшен")
+                db.session.rollback()
+                return "timeout"
+
+            signal_found = bool(result and result.get("signal_found"))
+            if signal_found:
+                # Отправляем уведомления
+                send_signal_notifications(user, result)
+
+                # Обновляем информацию о последнем сигнале
+                user.auto_signal_last_signal_price = result.get("entry_price")
+                user.auto_signal_last_signal_direction = result.get("direction")
+
+            # Обновляем время последней проверки
+            user.auto_signal_last_check = datetime.utcnow()
+            db.session.commit()
+            return "signal" if signal_found else "ok"
+
+        except Exception as e:
+            logger.error(f"Ошибка при проверке сигналов для пользователя {user_id}: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            db.session.rollback()
+            return "error"
+
+
+def prepare_market(market):
+    """Загружает рынок (symbol, timeframe, history_days) один раз для всех его пользователей."""
+    symbol, timeframe, history_days = market
+    try:
+        df = prepare_market_frame(symbol, timeframe, history_days)
+        if df is None:
+            logger.warning(f"Нет данных по рынку {symbol} {timeframe}, пользователи загрузят его сами")
+        return df
+    except Exception as e:
+        logger.error(f"Ошибка загрузки рынка {symbol} {timeframe}: {e}")
+        return None
+
+
+# Потоки задач, брошенных по таймауту: (label, key) -> поток. Пока поток жив, задача
+# с тем же ключом не запускается заново - зависший вызов биржи не плодит потоки каждый тик
+_ABANDONED = {}
+_abandoned_lock = threading.Lock()
+
+
+def abandoned_threads():
+    """Количество брошенных по таймауту потоков, которые еще выполняются (завершившиеся забываются)."""
+    with _abandoned_lock:
+        for slot, thread in list(_ABANDONED.items()):
+            if not thread.is_alive():
+                del _ABANDONED[slot]
+        return len(_ABANDONED)
+
+
+def _still_running(label, key):
+    """True, если брошенный по таймауту поток этой задачи еще выполняется."""
+    with _abandoned_lock:
+        thread = _ABANDONED.get((label, key))
+        if thread is not None and not thread.is_alive():
+            del _ABANDONED[(label, key)]
+            thread = None
+        return thread is not None
+
+
+def _run_task_thread(key, func, cancelled, results):
+    try:
+        value = func(key, cancelled)
+    except Exception as e:
+        logger.error(f"Ошибка задачи {key}: {e}")
+        value = "error"
+    results.put((key, value))
+
+
+def run_bounded(keys, func, max_workers, timeout, deadline_at, label="task"):
+    """
+    Выполняет func(key, cancelled) для ключей в заданном порядке.
+
+    Каждая задача выполняется в своем daemon-потоке, одновременно не более max_workers.
+    Задача, превысившая timeout, помечается как "timeout" и перестает занимать слот,
+    поэтому одна медленная задача не задерживает остальные; "зависший" поток не мешает
+    завершению процесса. Пока брошенный поток ключа еще выполняется, задача этого ключа
+    не запускается и помечается как "busy" (в том числе на следующих тиках).
+    После deadline_at (time.monotonic) новые задачи не запускаются и помечаются как "deferred".
+
+    Возвращает:
+    - dict {key: результат func, "timeout", "busy" или "deferred"}
+    """
+    pending = list(keys)
+    pending.reverse()  # pop() с конца - сохраняем порядок
+    running = {}  # key -> (started_at, cancelled)
+    outcomes = {}
+    results = queue.Queue()
+
+    while pending or running:
+        now = time.monotonic()
+
+        # Запускаем задачи, пока есть свободные слоты и не исчерпан бюджет тика
+        while pending and len(running) < max_workers:
+            if now >= deadline_at:
+                for key in pending:
+                    outcomes[key] = "deferred"
+                pending = []
+                break
+            key = pending.pop()
+            if _still_running(label, key):
+                outcomes[key] = "busy"
+                logger.warning(f"⏳ {label} {key}: предыдущий поток еще выполняется, пропускаем")
+                continue
+            cancelled = threading.Event()
+            thread = threading.Thread(
+                target=_run_task_thread, args=(key, func, cancelled, results),
+                name=f"auto-signals-{label}", daemon=True,
+            )
+            running[key] = (now, cancelled, thread)
+            thread.start()
+
+        if not running:
+            break
+
+        # Ждем ближайшего завершения, но не дольше ближайшего дедлайна
+        nearest_deadline = min(started + timeout for started, _, _ in running.values())
+        try:
+            key, value = results.get(timeout=max(0.0, nearest_deadline - time.monotonic()))
+            if key in running:
+                running.pop(key)
+                outcomes[key] = value
+        except queue.Empty:
+            pass
+
+        now = time.monotonic()
+        for key, (started, cancelled, thread) in list(running.items()):
+            if now - started >= timeout:
+                cancelled.set()
+                running.pop(key)
+                outcomes[key] = "timeout"
+                with _abandoned_lock:
+                    _ABANDONED[(label, key)] = thread
+                logger.warning(f"⏱️ {label} {key} не уложился в {timeout:.0f} сек, пропускаем "
+                               f"(брошенных потоков: {abandoned_threads()})")
+
+    return outcomes
+
+
+def run_due_users(user_markets, max_workers=None, user_timeout=None, tick_budget=None, tick_started=None):
+    """
+    Проверяет пользователей, загружая каждый рынок один раз.
+
+    Параметры:
+    - user_markets: список (user_id, market) в порядке срочности, market = (symbol, timeframe, history_days)
+
+    Сначала параллельно готовятся кадры всех различных рынков, затем параллельно
+    анализируются пользователи - каждый со своей стратегией, риском, капиталом и
+    подтверждениями на копии общего кадра.
+
+    Возвращает:
+    - dict {user_id: статус}
+    """
+    max_workers = max(1, int(max_workers or AUTO_SIGNALS_WORKERS))
+    user_timeout = float(user_timeout or AUTO_SIGNALS_USER_TIMEOUT)
+    tick_budget = float(tick_budget or AUTO_SIGNALS_TICK_BUDGET)
+    deadline_at = (tick_started or time.monotonic()) + tick_budget
+
+    markets = list(dict.fromkeys(market for _, market in user_markets))
+    frames = run_bounded(markets, lambda market, cancelled: prepare_market(market),
+                         max_workers, user_timeout, deadline_at, label="market")
+    logger.info(f"Рынков к загрузке: {len(markets)} для {len(user_markets)} пользователей")
+
+    statuses = {}
+    runnable = {}
+    for user_id, market in user_markets:
+        frame = frames.get(market)
+        if isinstance(frame, str):
+            # Рынок не загрузился по таймауту или бюджету тика - пользователь ждет следующего тика
+            statuses[user_id] = frame if frame in ("timeout", "busy", "deferred") else "error"
+        else:
+            runnable[user_id] = frame
+
+    statuses.update(run_bounded(
+        list(runnable),
+        lambda user_id, cancelled: process_user(user_id, cancelled, market_df=runnable[user_id]),
+        max_workers, user_timeout, deadline_at, label="user",
+    ))
+    return statuses
+
+
+def check_auto_signals(max_workers=None, user_timeout=None, tick_budget=None, timeframes=None):
+    """
+    Проверяет всех пользователей с включенными автоматическими сигналами.
+
+    Параметры:
+    - timeframes: множество таймфреймов, свеча которых только что закрылась (режим демона) -
+      проверяются только пользователи этих таймфреймов, без учета интервала проверки.
+      None - режим cron: проверяются пользователи, у которых истек интервал
+
+    Возвращает:
+    - dict со сводкой тика (длительность, количество пользователей по статусам)
+    """
+    tick_started = time.monotonic()
+    summary = {"users": 0, "due": 0, "markets": 0, "signal": 0, "ok": 0, "error": 0, "timeout": 0, "busy": 0, "deferred": 0, "skipped": 0}
+
     with app.app_context():
         try:
             # Получаем всех пользователей с включенными автоматическими сигналами
             users = User.query.filter_by(auto_signals_enabled=True).all()
-            
+
             if not users:
                 logger.info("Нет пользователей с включенными автоматическими сигналами")
-                return
-            
+                return summary
+
             logger.info(f"Проверка автоматических сигналов для {len(users)} пользователей")
-            
-            for user in users:
-                try:
-                    # Проверяем, нужно ли выполнять проверку для этого пользователя
-                    if not should_check_user(user):
-                        continue
-                    
-                    # Выполняем анализ
-                    result = run_analysis_for_user(user)
-                    
-                    if result and result.get("signal_found"):
-                        # Отправляем уведомления
-                        send_signal_notifications(user, result)
-                        
-                        # Обновляем информацию о последнем сигнале
-                        user.auto_signal_last_signal_price = result.get("entry_price")
-                        user.auto_signal_last_signal_direction = result.get("direction")
-                    
-                    # Обновляем время последней проверки
-                    user.auto_signal_last_check = datetime.utcnow()
-                    db.session.commit()
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка при проверке сигналов для пользователя {user.id}: {e}")
-                    import traceback
-                    logger.error(traceback.format_exc())
-                    db.session.rollback()
-                    continue
-                    
+            summary["users"] = len(users)
+
+            # Только пользователи, которым пора, - самые "просроченные" первыми
+            if timeframes is None:
+                due_users = [u for u in users if should_check_user(u)]
+            else:
+                due_users = [u for u in users if is_configured(u) and user_market(u)[1] in timeframes]
+            due_users.sort(key=_next_due_at)
+            user_markets = [(u.id, user_market(u)) for u in due_users]
         except Exception as e:
             logger.error(f"Критическая ошибка в check_auto_signals: {e}")
             import traceback
             logger.error(traceback.format_exc())
+            return summary
+        finally:
+            db.session.remove()
 
-def should_check_user(user):
-    """Проверяет, нужно ли выполнять проверку для пользователя."""
+    summary["due"] = len(user_markets)
+    summary["markets"] = len(set(market for _, market in user_markets))
+    if user_markets:
+        statuses = run_due_users(user_markets, max_workers, user_timeout, tick_budget, tick_started)
+        for status in statuses.values():
+            summary[status] = summary.get(status, 0) + 1
+
+    summary["abandoned_threads"] = abandoned_threads()
+    summary["duration_sec"] = round(time.monotonic() - tick_started, 2)
+    logger.info(
+        f"📊 Тик завершен за {summary['duration_sec']:.1f} сек: пользователей {summary['users']}, "
+        f"к проверке {summary['due']} (рынков {summary['markets']}), сигналов {summary['signal']}, "
+        f"без сигнала {summary['ok']}, ошибок {summary['error']}, по таймауту {summary['timeout']}, "
+        f"отложено {summary['deferred']}, заняты брошенным потоком {summary['busy']} "
+        f"(брошенных потоков: {summary['abandoned_threads']})"
+    )
+    return summary
+
+def is_configured(user):
+    """Пользователь выбрал символ и тип торговли."""
     if not user.auto_signal_symbol or not user.auto_signal_trading_type:
         logger.warning(f"Пользователь {user.id} не настроил символ или тип торговли")
         return False
+    return True
+
+
+def should_check_user(user):
+    """Проверяет, нужно ли выполнять проверку для пользователя."""
+    if not is_configured(user):
+        return False
     
     # Проверяем интервал
     if user.auto_signal_last_check:
         # Определяем интервал на основе типа торговли
-        interval_minutes = TRADING_TYPE_INTERVALS.get(
-            user.auto_signal_trading_type, 
-            user.auto_signal_check_interval or 60
-        )
+        interval_minutes = _check_interval_minutes(user)
         
         time_since_last_check = datetime.utcnow() - user.auto_signal_last_check
         if time_since_last_check.total_seconds() < interval_minutes * 60:
@@ -124,35 +379,22 @@ def should_check_user(user):
     
     return True
 
-def run_analysis_for_user(user):
+def _user_trading_type(user):
+    return TRADING_TYPE_INPUT_MAP.get(user.auto_signal_trading_type, user.auto_signal_trading_type or "Дейтрейдинг")
+
+
+def user_market(user):
+    """Ключ рынка пользователя: (symbol, timeframe, history_days) - как его загрузит run_analysis."""
+    timeframe, history_days = market_params(_user_trading_type(user))
+    return user.auto_signal_symbol, timeframe, history_days
+
+
+def run_analysis_for_user(user, market_df=None):
     """Выполняет анализ для пользователя с его настройками."""
     try:
         user_lang = _normalize_lang(getattr(user, 'language', None))
-        # Маппинг стратегий
-        strategy_map = {
-            "conservative": "Консервативная",
-            "balanced": "Сбалансированная",
-            "aggressive": "Агрессивная",
-            "Консервативная": "Консервативная",
-            "Сбалансированная": "Сбалансированная",
-            "Агрессивная": "Агрессивная"
-        }
-        strategy = strategy_map.get(user.auto_signal_strategy, user.auto_signal_strategy or "Сбалансированная")
-        
-        # Маппинг типов торговли
-        trading_type_map = {
-            "scalping": "Скальпинг",
-            "daytrading": "Дейтрейдинг",
-            "swing": "Свинг",
-            "medium_term": "Среднесрочная",
-            "long_term": "Долгосрочная",
-            "Скальпинг": "Скальпинг",
-            "Дейтрейдинг": "Дейтрейдинг",
-            "Свинг": "Свинг",
-            "Среднесрочная": "Среднесрочная",
-            "Долгосрочная": "Долгосрочная"
-        }
-        trading_type = trading_type_map.get(user.auto_signal_trading_type, user.auto_signal_trading_type or "Дейтрейдинг")
+        strategy = STRATEGY_INPUT_MAP.get(user.auto_signal_strategy, user.auto_signal_strategy or "Сбалансированная")
+        trading_type = _user_trading_type(user)
         
         logger.info(f"Выполнение анализа для пользователя {user.id}: {user.auto_signal_symbol}, {trading_type}, {strategy}")
 
@@ -163,7 +405,7 @@ def run_analysis_for_user(user):
             reports_by_language,
             _,
             chart_bytes,
-            excel_bytes,
+            _indicator_frame,
             symbol,
             rr_long,
             rr_short,
@@ -197,7 +439,9 @@ def run_analysis_for_user(user):
             enable_trailing=False,
             trailing_percent=0.5,
             spread=getattr(user, 'exchange_spread', 0.0),
-            language=user_lang
+            language=user_lang,
+            market_df=market_df,
+            chart_format="json",  # График воркеру не нужен: спецификация вместо отрисовки PNG
         )
 
         current_lang = user_lang if user_lang in ["ru", "en", "uk"] else "ru"
@@ -291,10 +535,114 @@ def send_signal_notifications(user, result):
         import traceback
         logger.error(traceback.format_exc())
 
+def active_markets():
+    """Рынки (symbol, timeframe, history_days) всех пользователей с включенными автосигналами."""
+    with app.app_context():
+        try:
+            users = User.query.filter_by(auto_signals_enabled=True).all()
+            return {
+                user_market(u) for u in users
+                if u.auto_signal_symbol and u.auto_signal_trading_type
+            }
+        finally:
+            db.session.remove()
+
+
+def run_daemon(max_workers=None, user_timeout=None, tick_budget=None, close_delay=None, stop_event=None, stream=False):
+    """
+    Резидентный режим: процесс, контекст приложения, клиент биржи и кэши остаются "теплыми".
+    stream=True - рынки пользователей подписываются на WebSocket-поток свечей,
+    и анализ берет историю из локального хранилища без REST-запросов.
+
+    Демон спит до ближайшего закрытия свечи среди таймфреймов пользователей (+ close_delay)
+    и проверяет только пользователей, чей таймфрейм только что закрылся. Если тик затянулся
+    и закрытие пропущено, проверка выполняется сразу (один раз). Остановка - SIGTERM/SIGINT
+    или stop_event.set().
+    """
+    close_delay = AUTO_SIGNALS_CLOSE_DELAY if close_delay is None else float(close_delay)
+    stop_event = stop_event or threading.Event()
+    last_checked = {}  # timeframe -> момент последней проверки (мс)
+
+    logger.info("🚀 Демон автоматических сигналов запущен")
+    while not stop_event.is_set():
+        try:
+            markets = active_markets()
+        except Exception as e:
+            logger.error(f"Ошибка чтения пользователей: {e}")
+            markets = set()
+        timeframes = {timeframe for _, timeframe, _ in markets}
+        if stream and markets:
+            start_kline_stream(sorted({(symbol, timeframe) for symbol, timeframe, _ in markets}))
+
+        now_ms = time.time() * 1000
+        closes = {}
+        for tf in timeframes:
+            close_ms = next_candle_close(tf, last_checked.get(tf, now_ms))
+            if close_ms is not None:
+                closes[tf] = close_ms
+        if not closes:
+            stop_event.wait(AUTO_SIGNALS_REFRESH)
+            continue
+
+        wake_ms = min(closes.values())
+        delay = max(0.0, (wake_ms - now_ms) / 1000 + close_delay)
+        if delay > AUTO_SIGNALS_REFRESH:
+            # Пользователи могли сменить настройки - перечитываем их, не дожидаясь далекого закрытия
+            stop_event.wait(AUTO_SIGNALS_REFRESH)
+            continue
+
+        # Все уже пропущенные закрытия проверяем одним тиком
+        closed = {tf for tf, close_ms in closes.items() if close_ms <= max(wake_ms, now_ms)}
+        logger.info(f"⏳ Закрытие свечей {', '.join(sorted(closed))} через {delay:.0f} сек")
+        if stop_event.wait(delay):
+            break
+
+        tick_ms = time.time() * 1000
+        check_auto_signals(max_workers, user_timeout, tick_budget, timeframes=closed)
+        for tf in closed:
+            last_checked[tf] = tick_ms
+
+    logger.info("🛑 Демон автоматических сигналов остановлен")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка автоматических сигналов")
+    parser.add_argument("--workers", type=int, default=AUTO_SIGNALS_WORKERS,
+                        help="Сколько пользователей анализировать одновременно")
+    parser.add_argument("--user-timeout", type=float, default=AUTO_SIGNALS_USER_TIMEOUT,
+                        help="Дедлайн анализа одного пользователя, сек")
+    parser.add_argument("--tick-budget", type=float, default=AUTO_SIGNALS_TICK_BUDGET,
+                        help="После скольких секунд не запускать новых пользователей")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Работать постоянно, проверяя пользователей на закрытии свечей их таймфрейма")
+    parser.add_argument("--close-delay", type=float, default=AUTO_SIGNALS_CLOSE_DELAY,
+                        help="Пауза после закрытия свечи перед проверкой, сек (режим демона)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Получать свечи рынков пользователей по WebSocket (режим демона, нужен websocket-client)")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.daemon:
+        stop = threading.Event()
+
+        def _stop(signum, frame):
+            logger.info("🛑 Получен сигнал завершения, останавливаю демон...")
+            stop.set()
+
+        # Вместо обработчиков app.py (exit) - даем текущему тику корректно завершиться
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+        try:
+            run_daemon(args.workers, args.user_timeout, args.tick_budget, args.close_delay, stop, stream=args.stream)
+        finally:
+            cleanup_connections()
+        sys.exit(0)
+
     # Запуск проверки
     logger.info("🚀 Запуск проверки автоматических сигналов...")
-    check_auto_signals()
+    check_auto_signals(args.workers, args.user_timeout, args.tick_budget)
     logger.info("✅ Проверка завершена")
 
 
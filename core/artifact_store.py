@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Хранилище файлов анализа (график, ZIP отчета) на локальном диске.
+
+Файл адресуется хэшем содержимого: id = первые 32 символа SHA-256 + расширение,
+поэтому повторный одинаковый файл не пишется заново, а id можно отдавать
+клиенту как ссылку (/api/artifacts/<id>) и использовать как ETag.
+Файлы живут ARTIFACT_TTL секунд с последней записи; старые удаляются
+попутно при записи, не чаще раза в cleanup_interval секунд.
+
+Один и тот же файл может принадлежать нескольким владельцам (одинаковый
+график у двух пользователей), поэтому владельцы записываются пустыми
+файлами-метками рядом с файлом (<id>.<хэш владельца>.owner) с тем же TTL.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+_ARTIFACT_ID_RE = re.compile(r"^[0-9a-f]{32}\.[a-z0-9]{1,8}$")
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "zip": "application/zip",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "json": "application/json",
+    "txt": "text/plain; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class ArtifactStore:
+    """
+    Контентно-адресуемое файловое хранилище с TTL.
+
+    Параметры:
+    - root: каталог хранилища
+    - ttl_seconds: время жизни файла с последней записи
+    - cleanup_interval: как часто (не чаще) удалять просроченные файлы при записи
+    """
+
+    def __init__(self, root, ttl_seconds=3600, cleanup_interval=300):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.cleanup_interval = cleanup_interval
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        self.writes = 0
+        self.reused = 0
+        self.removed = 0
+
+    @classmethod
+    def from_env(cls, default_root):
+        """
+        Создает хранилище по переменным окружения.
+
+        ARTIFACT_STORE=0 отключает хранилище (возвращается None),
+        ARTIFACT_STORE_PATH переопределяет каталог, ARTIFACT_TTL - время жизни файлов (сек).
+        """
+        if os.getenv("ARTIFACT_STORE", "1").strip().lower() in ("0", "false", "no", "off"):
+            return None
+        try:
+            return cls(
+                os.getenv("ARTIFACT_STORE_PATH") or default_root,
+                ttl_seconds=float(os.getenv("ARTIFACT_TTL", "3600")),
+            )
+        except Exception as e:
+            print(f"⚠️ Хранилище файлов анализа недоступно: {e}")
+            return None
+
+    @staticmethod
+    def is_valid_id(artifact_id):
+        return bool(artifact_id) and _ARTIFACT_ID_RE.match(artifact_id) is not None
+
+    @staticmethod
+    def content_type(artifact_id):
+        return CONTENT_TYPES.get(artifact_id.rsplit(".", 1)[-1], "application/octet-stream")
+
+    def _path(self, artifact_id):
+        # Подкаталог по первым двум символам, чтобы не держать тысячи файлов в одном каталоге
+        return os.path.join(self.root, artifact_id[:2], artifact_id)
+
+    def _owner_path(self, artifact_id, owner):
+        owner_hash = hashlib.sha256(str(owner).encode("utf-8")).hexdigest()[:16]
+        return f"{self._path(artifact_id)}.{owner_hash}.owner"
+
+    def grant(self, artifact_id, owner):
+        """Записывает (или продлевает) владельца файла."""
+        path = self._owner_path(artifact_id, owner)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a"):
+            os.utime(path, None)
+
+    def is_owner(self, artifact_id, owner):
+        """True, если владелец записан для этого файла и запись не просрочена."""
+        if not self.is_valid_id(artifact_id) or owner is None:
+            return False
+        try:
+            mtime = os.path.getmtime(self._owner_path(artifact_id, owner))
+        except OSError:
+            return False
+        return self.ttl_seconds <= 0 or time.time() - mtime <= self.ttl_seconds
+
+    def put(self, data, extension, owner=None):
+        """
+        Сохраняет байты и возвращает id файла.
+
+        Параметры:
+        - data: bytes (или BytesIO)
+        - extension: расширение без точки ("png", "zip", ...) - по нему выбирается Content-Type
+        - owner: владелец файла (см. is_owner); None - без записи владельца
+        """
+        if hasattr(data, "getvalue"):
+            data = data.getvalue()
+        artifact_id = f"{hashlib.sha256(data).hexdigest()[:32]}.{extension.lower().lstrip('.')}"
+        path = self._path(artifact_id)
+        if os.path.exists(path):
+            # Тот же файл уже есть - продлеваем ему жизнь
+            os.utime(path, None)
+            self.reused += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.writes += 1
+        if owner is not None:
+            self.grant(artifact_id, owner)
+        self._maybe_cleanup()
+        return artifact_id
+
+    def get_or_build(self, source_id, extension, build):
+        """
+        Производный файл (экспорт, архив), который собирается только по запросу.
+
+        id производного файла - хэш источника + новое расширение: сборка - чистая
+        функция источника, поэтому пока файл жив, повторный запрос его не пересобирает.
+
+        Параметры:
+        - source_id: id исходного файла в хранилище
+        - extension: расширение результата
+        - build: build(fileobj) - пишет результат прямо в файл (без буфера в памяти)
+
+        Возвращает:
+        - id производного файла
+        """
+        artifact_id = f"{source_id.split('.', 1)[0]}.{extension.lower().lstrip('.')}"
+        path = self.path(artifact_id)
+        if path is not None:
+            os.utime(path, None)
+            self.reused += 1
+            return artifact_id
+        path = self._path(artifact_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                build(f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.writes += 1
+        self._maybe_cleanup()
+        return artifact_id
+
+    def path(self, artifact_id):
+        """Путь к файлу или None, если id некорректен, файла нет или он просрочен."""
+        if not self.is_valid_id(artifact_id):
+            return None
+        path = self._path(artifact_id)
+        try:
+            if self.ttl_seconds > 0 and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                return None
+        except OSError:
+            return None
+        return path
+
+    def _maybe_cleanup(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_cleanup < self.cleanup_interval:
+                return
+            self._last_cleanup = now
+        self.cleanup(now)
+
+    def cleanup(self, now=None):
+        """Удаляет просроченные файлы (и брошенные временные). Возвращает количество удаленных."""
+        if self.ttl_seconds <= 0:
+            return 0
+        now = time.time() if now is None else now
+        removed = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    if now - os.path.getmtime(path) > self.ttl_seconds:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        self.removed += removed
+        return removed
+
+    def stats(self):
+        """Счетчики записей, повторов и удалений."""
+        return {"writes": self.writes, "reused": self.reused, "removed": self.removed}
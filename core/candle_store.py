@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальное хранилище свечей OHLCV (SQLite).
+
+Свечи хранятся по ключу (биржа, символ, таймфрейм). Для каждого ключа
+в хранилище лежит один непрерывный диапазон баров, поэтому при повторном
+запросе с биржи нужно докачать только недостающий "хвост" (и, при
+необходимости, "голову" истории). Диапазоны, где биржа подтвердила отсутствие
+свечей (пауза торгов, техобслуживание), запоминаются и повторно не запрашиваются.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+_TIMEFRAME_UNITS_MS = {
+    "s": 1000,
+    "m": 60 * 1000,
+    "h": 60 * 60 * 1000,
+    "d": 24 * 60 * 60 * 1000,
+    "w": 7 * 24 * 60 * 60 * 1000,
+    "M": 30 * 24 * 60 * 60 * 1000,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS candles (
+    exchange TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    open REAL,
+    high REAL,
+    low REAL,
+    close REAL,
+    volume REAL,
+    PRIMARY KEY (exchange, symbol, timeframe, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS candle_ranges (
+    exchange TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    covered_from INTEGER NOT NULL,
+    PRIMARY KEY (exchange, symbol, timeframe)
+);
+CREATE TABLE IF NOT EXISTS candle_gaps (
+    exchange TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL,
+    PRIMARY KEY (exchange, symbol, timeframe, start_ts)
+) WITHOUT ROWID;
+"""
+
+
+def timeframe_to_ms(timeframe):
+    """
+    Длительность таймфрейма в миллисекундах.
+
+    Параметры:
+    - timeframe: строка в формате ccxt ("1m", "5m", "1h", "4h", "1d", "1w", "1M")
+
+    Возвращает:
+    - Длительность (int) или None, если формат не распознан
+    """
+    try:
+        amount = int(timeframe[:-1])
+        unit_ms = _TIMEFRAME_UNITS_MS[timeframe[-1]]
+        return amount * unit_ms
+    except Exception:
+        return None
+
+
+# Недельные свечи Binance открываются в понедельник 00:00 UTC, а эпоха Unix - четверг
+WEEK_OPEN_OFFSET_MS = 4 * _TIMEFRAME_UNITS_MS["d"]
+
+
+def next_candle_close(timeframe, now_ms):
+    """
+    Ближайшее закрытие свечи таймфрейма строго после now_ms.
+
+    Параметры:
+    - timeframe: строка в формате ccxt
+    - now_ms: текущее время (мс, UTC)
+
+    Возвращает:
+    - Время закрытия (мс) или None, если формат не распознан
+    """
+    try:
+        amount = int(timeframe[:-1])
+        unit = timeframe[-1]
+        if unit == "M":
+            # Календарные месяцы, выровненные от января 1970
+            dt = datetime.fromtimestamp(now_ms / 1000, tz=timezone.utc)
+            months = dt.year * 12 + dt.month - 1
+            year, month = divmod((months // amount + 1) * amount, 12)
+            return int(datetime(year, month + 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+        tf_ms = amount * _TIMEFRAME_UNITS_MS[unit]
+        offset = WEEK_OPEN_OFFSET_MS if unit == "w" else 0
+        return offset + ((int(now_ms) - offset) // tf_ms + 1) * tf_ms
+    except Exception:
+        return None
+
+
+def exchange_id_of(client):
+    """Идентификатор биржи для ключа хранилища (ccxt: client.id)."""
+    return str(getattr(client, "id", None) or type(client).__name__).lower()
+
+
+class CandleStore:
+    """
+    SQLite-хранилище свечей.
+
+    Клиент биржи подключаемый: достаточно объекта с атрибутом `id` и
+    методом загрузки диапазона (см. sync), поэтому в офлайн-проверках
+    вместо ccxt можно передать заглушку.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    @classmethod
+    def from_env(cls, default_path):
+        """
+        Создает хранилище по переменным окружения.
+
+        CANDLE_STORE=0 отключает хранилище (возвращается None),
+        CANDLE_STORE_PATH переопределяет путь к файлу базы.
+        """
+        if os.getenv("CANDLE_STORE", "1").strip().lower() in ("0", "false", "no", "off"):
+            return None
+        try:
+            return cls(os.getenv("CANDLE_STORE_PATH") or default_path)
+        except Exception as e:
+            print(f"⚠️ Хранилище свечей недоступно: {e}")
+            return None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(_SCHEMA)
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def bounds(self, exchange_id, symbol, timeframe):
+        """Возвращает (первый ts, последний ts) сохраненного диапазона или (None, None)."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT MIN(ts), MAX(ts) FROM candles WHERE exchange=? AND symbol=? AND timeframe=?",
+                (exchange_id, symbol, timeframe),
+            ).fetchone()
+            return (row[0], row[1]) if row else (None, None)
+        finally:
+            conn.close()
+
+    def covered_from(self, exchange_id, symbol, timeframe):
+        """
+        Начало проверенного диапазона: раньше этого момента биржа уже опрошена.
+        Нужно для недавно залистингованных монет, у которых истории меньше запрошенной.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT covered_from FROM candle_ranges WHERE exchange=? AND symbol=? AND timeframe=?",
+                (exchange_id, symbol, timeframe),
+            ).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def _set_covered_from(self, exchange_id, symbol, timeframe, since_ms):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO candle_ranges (exchange, symbol, timeframe, covered_from) "
+                "VALUES (?, ?, ?, ?)",
+                (exchange_id, symbol, timeframe, int(since_ms)),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def mark_empty(self, exchange_id, symbol, timeframe, start_ms, end_ms):
+        """
+        Запоминает, что биржа вернула пустой диапазон: свечей с ts в [start_ms, end_ms] нет.
+        Пересекающиеся и смежные пустые диапазоны сливаются в один.
+        """
+        if end_ms < start_ms:
+            return
+        key = (exchange_id, symbol, timeframe)
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT MIN(start_ts), MAX(end_ts) FROM candle_gaps "
+                "WHERE exchange=? AND symbol=? AND timeframe=? AND start_ts<=? AND end_ts>=?",
+                key + (int(end_ms) + 1, int(start_ms) - 1),
+            ).fetchone()
+            if row and row[0] is not None:
+                start_ms, end_ms = min(start_ms, row[0]), max(end_ms, row[1])
+            conn.execute(
+                "DELETE FROM candle_gaps WHERE exchange=? AND symbol=? AND timeframe=? AND start_ts<=? AND end_ts>=?",
+                key + (int(end_ms) + 1, int(start_ms) - 1),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO candle_gaps (exchange, symbol, timeframe, start_ts, end_ts) VALUES (?, ?, ?, ?, ?)",
+                key + (int(start_ms), int(end_ms)),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def empty_until(self, exchange_id, symbol, timeframe, ts):
+        """
+        Конец известного пустого диапазона, содержащего ts.
+
+        Возвращает:
+        - Последний ts пустого диапазона или None, если про ts ничего не известно
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT MAX(end_ts) FROM candle_gaps "
+                "WHERE exchange=? AND symbol=? AND timeframe=? AND start_ts<=? AND end_ts>=?",
+                (exchange_id, symbol, timeframe, int(ts), int(ts)),
+            ).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def read(self, exchange_id, symbol, timeframe, since_ms, until_ms=None):
+        """Бары [ts, open, high, low, close, volume] с since_ms (и до until_ms включительно)."""
+        query = (
+            "SELECT ts, open, high, low, close, volume FROM candles "
+            "WHERE exchange=? AND symbol=? AND timeframe=? AND ts>=?"
+        )
+        params = [exchange_id, symbol, timeframe, int(since_ms)]
+        if until_ms is not None:
+            query += " AND ts<=?"
+            params.append(int(until_ms))
+        query += " ORDER BY ts"
+        conn = self._connect()
+        try:
+            return [list(r) for r in conn.execute(query, params).fetchall()]
+        finally:
+            conn.close()
+
+    def write(self, exchange_id, symbol, timeframe, bars):
+        """Сохраняет (перезаписывает) бары. Возвращает количество записанных строк."""
+        rows = [
+            (exchange_id, symbol, timeframe, int(b[0]), b[1], b[2], b[3], b[4], b[5])
+            for b in bars
+            if b and b[0] is not None
+        ]
+        if not rows:
+            return 0
+        conn = self._connect()
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO candles "
+                "(exchange, symbol, timeframe, ts, open, high, low, close, volume) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+            return len(rows)
+        finally:
+            conn.close()
+
+    def clear(self, exchange_id, symbol, timeframe):
+        """Удаляет все бары ключа."""
+        conn = self._connect()
+        try:
+            for table in ("candles", "candle_ranges", "candle_gaps"):
+                conn.execute(
+                    f"DELETE FROM {table} WHERE exchange=? AND symbol=? AND timeframe=?",
+                    (exchange_id, symbol, timeframe),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def sync(self, client, symbol, timeframe, since_ms, now_ms, fetch_range):
+        """
+        Возвращает бары с since_ms, докачивая с биржи только недостающее.
+
+        Параметры:
+        - client: клиент биржи (ccxt или заглушка с атрибутом id)
+        - symbol, timeframe: рынок
+        - since_ms, now_ms: запрашиваемый диапазон (мс)
+        - fetch_range: функция fetch_range(client, symbol, timeframe, since_ms, now_ms, until_ms=None),
+          возвращающая список баров с биржи
+
+        Возвращает:
+        - Список баров [ts, open, high, low, close, volume], отсортированный по ts
+        """
+        exchange_id = exchange_id_of(client)
+        tf_ms = timeframe_to_ms(timeframe) or 0
+        first_ts, last_ts = self.bounds(exchange_id, symbol, timeframe)
+
+        # Сохраненный диапазон закончился раньше запрошенного окна - дыру не докачиваем,
+        # а начинаем ключ заново, чтобы диапазон в хранилище оставался непрерывным
+        if last_ts is not None and last_ts + tf_ms < since_ms:
+            self.clear(exchange_id, symbol, timeframe)
+            first_ts, last_ts = None, None
+
+        if first_ts is None:
+            # Начало окна, где биржа уже отвечала пустотой, не запрашиваем повторно
+            start_ms = since_ms
+            empty_end = self.empty_until(exchange_id, symbol, timeframe, since_ms)
+            if empty_end is not None:
+                start_ms = empty_end + 1
+            bars = fetch_range(client, symbol, timeframe, start_ms, now_ms) if start_ms <= now_ms else []
+            self.write(exchange_id, symbol, timeframe, bars)
+            if not bars and tf_ms:
+                # Свечей нет: запоминаем все уже закрытые свечи окна как пустые
+                self.mark_empty(exchange_id, symbol, timeframe, since_ms, now_ms - tf_ms)
+            self._set_covered_from(exchange_id, symbol, timeframe, since_ms)
+            return self.read(exchange_id, symbol, timeframe, since_ms)
+
+        # "Голова": запрошена более ранняя история, чем уже проверено на бирже
+        covered = self.covered_from(exchange_id, symbol, timeframe)
+        if covered is None:
+            covered = first_ts
+        if since_ms + tf_ms < covered:
+            head = fetch_range(client, symbol, timeframe, since_ms, now_ms, until_ms=first_ts - 1)
+            self.write(exchange_id, symbol, timeframe, head)
+            self._set_covered_from(exchange_id, symbol, timeframe, since_ms)
+
+        # "Хвост": последний сохраненный бар мог быть еще не закрыт, поэтому перекачиваем его
+        tail = fetch_range(client, symbol, timeframe, last_ts, now_ms)
+        self.write(exchange_id, symbol, timeframe, tail)
+        return self.read(exchange_id, symbol, timeframe, since_ms)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Отрисовка графика анализа вне потока запроса.
+
+График описывается спецификацией - обычным JSON-совместимым dict (время свечей,
+линии, горизонтальные уровни, заголовок), поэтому ту же спецификацию можно
+отдать клиенту для отрисовки в браузере вместо PNG.
+
+PNG рисуется в отдельном процессе пула: matplotlib без pyplot (Figure + Agg),
+одна фигура с осями на процесс переиспользуется между графиками. Процессы пула
+запускаются через spawn, а не fork: сервер многопоточный, и fork копирует
+блокировки, захваченные другими потоками (логирование, соединения, кэши), -
+процесс пула мог зависнуть на такой блокировке навсегда.
+Готовые PNG кэшируются по ключу (символ, таймфрейм, последняя свеча, уровни, язык...).
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from zoneinfo import ZoneInfo
+
+# Фигура-шаблон процесса: создается при первом графике и дальше только очищается
+_TEMPLATE = {}
+_TEMPLATE_LOCK = threading.Lock()
+
+
+def _init_worker():
+    """Initializer процесса пула: свои фигуры и блокировка (и при start_method="fork" не наследуем чужое состояние)."""
+    global _TEMPLATE_LOCK
+    _TEMPLATE.clear()
+    _TEMPLATE_LOCK = threading.Lock()
+
+
+def _template_axes(size):
+    import matplotlib
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    template = _TEMPLATE.get(tuple(size))
+    if template is None:
+        fig = Figure(figsize=tuple(size))
+        FigureCanvasAgg(fig)
+        template = (fig, fig.add_subplot(1, 1, 1))
+        _TEMPLATE[tuple(size)] = template
+    fig, ax = template
+    ax.cla()
+    # tight_layout прошлого графика сдвинул поля - возвращаем исходные
+    fig.subplots_adjust(**{k: matplotlib.rcParams[f"figure.subplot.{k}"]
+                           for k in ("left", "right", "bottom", "top", "wspace", "hspace")})
+    return fig, ax
+
+
+def render_png(spec):
+    """
+    PNG по спецификации графика (выполняется в процессе пула или, без пула, в текущем).
+
+    Параметры:
+    - spec: dict из chart_spec
+
+    Возвращает:
+    - bytes PNG
+    """
+    import numpy as np
+
+    with _TEMPLATE_LOCK:
+        fig, ax = _template_axes(spec.get("size", (10, 5)))
+        x = np.array(spec["x"], dtype="datetime64[ms]")
+        # Подписи оси - в часовом поясе свечей, как при отрисовке кадра с tz-aware индексом
+        # (задается всегда: оси шаблона переиспользуются, пояс прошлого графика не должен остаться)
+        ax.xaxis_date(ZoneInfo(spec["tz"]) if spec.get("tz") else None)
+        for line in spec["series"]:
+            values = np.array([np.nan if v is None else v for v in line["values"]], dtype=float)
+            ax.plot(x, values, label=line["label"], lw=line.get("lw"), alpha=line.get("alpha"))
+        for level in spec["levels"]:
+            ax.axhline(level["value"], color=level["color"], lw=level["lw"], linestyle=level["style"],
+                       label=level["label"])
+        ax.legend(loc="upper left", fontsize=8)
+        ax.grid(True, alpha=0.3)
+        ax.set_title(spec["title"])
+        buf = io.BytesIO()
+        fig.tight_layout()
+        fig.savefig(buf, format="png", bbox_inches="tight", dpi=spec.get("dpi", 90))
+        return buf.getvalue()
+
+
+def chart_spec(index, series, levels, title, size=(10, 5), dpi=90):
+    """
+    Спецификация графика.
+
+    Параметры:
+    - index: DatetimeIndex свечей
+    - series: [(подпись, значения, {"lw": ..., "alpha": ...}), ...]
+    - levels: [(значение, цвет, толщина, стиль, подпись), ...] - горизонтальные линии
+    - title: заголовок
+
+    Возвращает:
+    - dict: x (время в мс UTC), tz (часовой пояс индекса), series, levels, title, size, dpi -
+      годится и для JSON
+    """
+    x = [int(ts.value // 1_000_000) for ts in index]
+    tz = getattr(index, "tz", None)
+    return {
+        "x": x,
+        "tz": str(tz) if tz is not None else None,
+        "series": [
+            {
+                "label": label,
+                "values": [None if v != v else float(v) for v in values],
+                "lw": style.get("lw"),
+                "alpha": style.get("alpha"),
+            }
+            for label, values, style in series
+        ],
+        "levels": [
+            {"value": float(value), "color": color, "lw": lw, "style": style, "label": label}
+            for value, color, lw, style, label in levels
+        ],
+        "title": title,
+        "size": list(size),
+        "dpi": dpi,
+    }
+
+
+class ChartRenderer:
+    """
+    Пул процессов для PNG графиков с LRU-кэшем готовых картинок.
+
+    Параметры:
+    - max_workers: процессов в пуле (0 - рисовать в текущем процессе)
+    - cache_entries: сколько PNG держать в кэше
+    - timeout: сколько ждать процесс пула; дольше - график рисуется в текущем процессе
+    - start_method: как запускать процессы пула ("spawn" или "forkserver")
+    """
+
+    def __init__(self, max_workers=1, cache_entries=128, timeout=30, start_method="spawn"):
+        self.max_workers = max_workers
+        self.cache_entries = cache_entries
+        self.timeout = timeout
+        self.start_method = start_method
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._cache = OrderedDict()  # key -> bytes PNG
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_env(cls):
+        """CHART_RENDER_WORKERS, CHART_CACHE_ENTRIES, CHART_RENDER_TIMEOUT, CHART_RENDER_START_METHOD."""
+        try:
+            return cls(
+                max_workers=int(os.getenv("CHART_RENDER_WORKERS", "1")),
+                cache_entries=int(os.getenv("CHART_CACHE_ENTRIES", "128")),
+                timeout=float(os.getenv("CHART_RENDER_TIMEOUT", "30")),
+                start_method=os.getenv("CHART_RENDER_START_METHOD", "spawn"),
+            )
+        except ValueError:
+            return cls()
+
+    def _get_pool(self):
+        # Пул создается при первом графике: импорт trading_app не должен запускать процессы
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                                 mp_context=multiprocessing.get_context(self.start_method))
+            return self._pool
+
+    def _render(self, spec):
+        if self.max_workers > 0:
+            try:
+                return self._get_pool().submit(render_png, spec).result(timeout=self.timeout)
+            except Exception as e:
+                print(f"⚠️ Пул отрисовки графиков недоступен, рисуем в текущем процессе: {e}")
+                self.fallbacks += 1
+                self._reset_pool()
+        return render_png(spec)
+
+    def _reset_pool(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, spec, key=None):
+        """
+        PNG графика (BytesIO), из кэша по key, если он задан.
+
+        Параметры:
+        - spec: dict из chart_spec
+        - key: хэшируемый ключ кэша; None - без кэша
+        """
+        if key is not None:
+            with self._lock:
+                png = self._cache.get(key)
+                if png is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return io.BytesIO(png)
+                self.misses += 1
+        png = self._render(spec)
+        if key is not None and self.cache_entries > 0:
+            with self._lock:
+                self._cache[key] = png
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_entries:
+                    self._cache.popitem(last=False)
+        return io.BytesIO(png)
+
+    def shutdown(self):
+        self._reset_pool()
+
+    def stats(self):
+        """Счетчики кэша и переходов на отрисовку в текущем процессе."""
+        with self._lock:
+            return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses,
+                    "fallbacks": self.fallbacks}
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кадр индикаторов анализа: компактное хранение и экспорт по запросу.
+
+Анализ не пишет Excel: кадр один раз сохраняется в хранилище файлов анализа
+компактным файлом (.frame) - parquet, если установлен pyarrow, иначе сжатый npz
+(numpy, без pickle). xlsx / csv / parquet собираются из него только когда файл
+действительно скачивают - в любом процессе и после перезапуска. Сериализации,
+исполняющей код при чтении (pickle), нет. Excel пишется openpyxl в режиме
+write_only - строки уходят в файл потоком, без модели всей книги в памяти.
+"""
+
+import io
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+EXPORT_FORMATS = ("xlsx", "csv", "parquet")
+
+
+def _export_frame(df):
+    """Excel не поддерживает часовые пояса: индекс приводится к наивному времени, как раньше."""
+    if isinstance(df.index, pd.DatetimeIndex) and df.index.tz is not None:
+        df = df.copy(deep=False)
+        df.index = df.index.tz_localize(None)
+    return df
+
+
+def _cell(value):
+    # NaN/NaT в Excel - пустая ячейка (как у DataFrame.to_excel)
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def write_xlsx(df, fileobj, sheet_name="Sheet1"):
+    """Потоковая запись кадра в xlsx (openpyxl write_only): индекс - первая колонка, шапка жирная."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    df = _export_frame(df)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    bold = Font(bold=True)
+    header = []
+    for title in [df.index.name] + [str(c) for c in df.columns]:
+        cell = WriteOnlyCell(sheet, value=title)
+        cell.font = bold
+        header.append(cell)
+    sheet.append(header)
+    for row in df.itertuples(index=True, name=None):
+        sheet.append([_cell(value) for value in row])
+    workbook.save(fileobj)
+
+
+def write_csv(df, fileobj, chunksize=1000):
+    """CSV в UTF-8 частями по chunksize строк."""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="")
+    try:
+        _export_frame(df).to_csv(text, chunksize=chunksize)
+    finally:
+        # Отцепляем обертку, чтобы она не закрыла файл вызывающего
+        text.flush()
+        text.detach()
+
+
+def write_parquet(df, fileobj):
+    """Parquet (нужен pyarrow или fastparquet - иначе ImportError)."""
+    df.to_parquet(fileobj)
+
+
+def write_export(df, fmt, fileobj):
+    """
+    Экспорт кадра в файл.
+
+    Параметры:
+    - df: кадр индикаторов
+    - fmt: "xlsx", "csv" или "parquet"
+    - fileobj: бинарный файл для записи
+    """
+    if fmt == "xlsx":
+        write_xlsx(df, fileobj)
+    elif fmt == "csv":
+        write_csv(df, fileobj)
+    elif fmt == "parquet":
+        write_parquet(df, fileobj)
+    else:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _write_npz(df, fileobj):
+    """Кадр в сжатый npz: колонки - массивами numpy, имена и типы - в JSON-описании."""
+    arrays = {}
+    meta = {"columns": [], "dtypes": [], "index": {"name": df.index.name}}
+    index = df.index
+    if isinstance(index, pd.DatetimeIndex):
+        meta["index"]["tz"] = str(index.tz) if index.tz is not None else None
+        arrays["index"] = (index.tz_localize(None) if index.tz is not None else index).to_numpy()
+    else:
+        arrays["index"] = index.to_numpy()
+    for position, column in enumerate(df.columns):
+        series = df[column]
+        meta["columns"].append(str(column))
+        meta["dtypes"].append(str(series.dtype))
+        values = series.to_numpy()
+        if values.dtype == object or not isinstance(series.dtype, np.dtype):
+            # Строки: пропуски отдельной маской, сами значения - юникод-массивом
+            missing = series.isna().to_numpy()
+            arrays[f"m{position}"] = missing
+            values = np.array(["" if flag else str(value) for value, flag in zip(series.tolist(), missing)], dtype=str)
+        arrays[f"c{position}"] = values
+    arrays["meta"] = np.array(json.dumps(meta))
+    np.savez_compressed(fileobj, **arrays)
+
+
+def _read_npz(fileobj):
+    with np.load(fileobj, allow_pickle=False) as data:
+        meta = json.loads(str(data["meta"]))
+        index = data["index"]
+        if "tz" in meta["index"]:
+            index = pd.DatetimeIndex(index)
+            if meta["index"]["tz"]:
+                index = index.tz_localize(meta["index"]["tz"])
+        index = pd.Index(index, name=meta["index"]["name"])
+        columns = {}
+        for position, (column, dtype) in enumerate(zip(meta["columns"], meta["dtypes"])):
+            values = data[f"c{position}"]
+            if f"m{position}" in data:
+                values = np.where(data[f"m{position}"], None, values.astype(object))
+            columns[column] = pd.Series(values, index=index).astype(dtype)
+    return pd.DataFrame(columns, index=index)
+
+
+def write_frame(df, fileobj):
+    """
+    Компактный файл кадра для хранилища: parquet с pyarrow, иначе сжатый npz.
+
+    Параметры:
+    - df: кадр индикаторов
+    - fileobj: бинарный файл для записи
+    """
+    if _has_pyarrow():
+        df.to_parquet(fileobj)
+    else:
+        _write_npz(df, fileobj)
+
+
+def frame_to_bytes(df):
+    """write_frame в байты (для ArtifactStore.put)."""
+    buf = io.BytesIO()
+    write_frame(df, buf)
+    return buf.getvalue()
+
+
+def read_frame(path):
+    """Кадр из файла write_frame; формат определяется по сигнатуре (PAR1 - parquet, PK - npz)."""
+    with open(path, "rb") as f:
+        if f.read(4) == b"PAR1":
+            f.seek(0)
+            return pd.read_parquet(f)
+        f.seek(0)
+        return _read_npz(f)
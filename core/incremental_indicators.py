@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Инкрементальный расчет индикаторов: новая свеча продвигает состояние без
+пересчета add_indicators/build_indicator_frame по всему кадру. Цена свечи -
+O(окна), а не O(1): скользящие суммы, среднее и std каждый раз считаются
+math.fsum по своему окну (не длиннее VI_WINDOW = 252 значений), зато без
+накопления ошибки округления, как было бы с бегущими суммами.
+
+IncrementalIndicators.from_history(df) прогоняет историю один раз, затем
+update(bar) добавляет закрытую свечу и возвращает последнюю строку с теми же
+колонками и значениями, что и build_indicator_frame на кадре "история + все
+добавленные свечи" (EWM - та же рекурсия, что в pandas; скользящие окна -
+точные суммы по окну, расхождение с pandas на уровне ошибок округления).
+
+Кумулятивные индикаторы (VWAP, OBV, EMA с adjust=True) отсчитываются от
+первой свечи истории, как и в add_indicators на растущем кадре. Сдвиг окна
+истории (отбрасывание старых свечей) требует нового from_history.
+"""
+
+import copy
+import math
+from collections import deque
+
+import pandas as pd
+
+NAN = float("nan")
+SQRT_252 = math.sqrt(252)
+
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+STOCH_PERIOD = 14
+STOCH_SMOOTH = 3
+ST_PERIOD = 10
+ST_MULT = 3.0
+PIVOT_SIDE = 2
+HV_WINDOW = 50
+VI_WINDOW = 252
+BB_PERIOD = 20
+ADX_PERIOD = 14
+
+OHLCV = ("Open", "High", "Low", "Close", "Volume")
+
+
+def _div(a, b):
+    """Деление с семантикой NumPy: x/0 -> ±inf, 0/0 и NaN -> NaN."""
+    if b == 0:
+        if a != a or a == 0:
+            return NAN
+        return math.inf if a > 0 else -math.inf
+    return a / b
+
+
+def _nan_if_inf(x):
+    return NAN if x in (math.inf, -math.inf) else x
+
+
+class _Ewm:
+    """Рекурсия pandas ewm(span=...).mean() (min_periods=0, ignore_na=False) для одного значения за раз."""
+
+    __slots__ = ("factor", "new_wt", "adjust", "old_wt", "value")
+
+    def __init__(self, span, adjust=True):
+        alpha = 2.0 / (span + 1.0)
+        self.factor = 1.0 - alpha
+        self.new_wt = 1.0 if adjust else alpha
+        self.adjust = adjust
+        self.old_wt = 1.0
+        self.value = None
+
+    def update(self, x):
+        if self.value is None or self.value != self.value:
+            self.value = x
+            return x
+        self.old_wt *= self.factor
+        if x == x:
+            if self.value != x:
+                self.value = (self.old_wt * self.value + self.new_wt * x) / (self.old_wt + self.new_wt)
+            if self.adjust:
+                self.old_wt += self.new_wt
+            else:
+                self.old_wt = 1.0
+        return self.value
+
+
+class _Rolling:
+    """Окно rolling(n): NaN, пока в окне меньше n значений или есть NaN."""
+
+    __slots__ = ("n", "values", "nans")
+
+    def __init__(self, n):
+        self.n = n
+        self.values = deque(maxlen=n)
+        self.nans = 0
+
+    def push(self, x):
+        if len(self.values) == self.n and self.values[0] != self.values[0]:
+            self.nans -= 1
+        if x != x:
+            self.nans += 1
+        self.values.append(x)
+
+    @property
+    def ready(self):
+        return len(self.values) == self.n and not self.nans
+
+    def sum(self):
+        return math.fsum(self.values) if self.ready else NAN
+
+    def mean(self):
+        return math.fsum(self.values) / self.n if self.ready else NAN
+
+    def std(self):
+        if not self.ready or self.n < 2:
+            return NAN
+        mean = math.fsum(self.values) / self.n
+        return math.sqrt(math.fsum((v - mean) ** 2 for v in self.values) / (self.n - 1))
+
+    def min(self):
+        return min(self.values) if self.ready else NAN
+
+    def max(self):
+        return max(self.values) if self.ready else NAN
+
+
+class IncrementalIndicators:
+    """
+    Состояние индикаторов одного рынка.
+
+    Параметры:
+    - with_extras: считать также колонки build_indicator_frame (VWMA_20, Bollinger, ADX)
+    """
+
+    def __init__(self, with_extras=True):
+        self.with_extras = with_extras
+        self.count = 0
+        self.last_index = None
+        self.last_row = None
+
+        self.ema20 = _Ewm(20)
+        self.ema50 = _Ewm(50)
+        self.ema200 = _Ewm(200)
+        self.ema12 = _Ewm(12)
+        self.ema26 = _Ewm(26)
+        self.signal = _Ewm(9)
+        self.obv_ema = _Ewm(20, adjust=False)
+
+        self.prev_close = NAN
+        self.prev_high = NAN
+        self.prev_low = NAN
+        self.up = _Rolling(RSI_PERIOD)
+        self.down = _Rolling(RSI_PERIOD)
+        self.tr = _Rolling(ATR_PERIOD)
+        self.tr_st = _Rolling(ST_PERIOD)
+
+        self.cum_tpv = 0.0
+        self.cum_vol = 0.0
+        self.obv = 0.0
+
+        self.rsi = _Rolling(STOCH_PERIOD)
+        self.stoch = _Rolling(STOCH_SMOOTH)
+        self.stoch_k = _Rolling(STOCH_SMOOTH)
+
+        # Supertrend: последние значения полос, линии и закрытия (см. _supertrend_recursion)
+        self.st_upper = NAN
+        self.st_lower = NAN
+        self.st_final_upper = NAN
+        self.st_final_lower = NAN
+        self.st_close = NAN
+        self.st_value = NAN
+        self.st_dir = NAN
+        self.st_prev_value = NAN
+        self.st_prev_final_upper = NAN
+
+        # Точки разворота подтверждаются через PIVOT_SIDE свечей
+        self.recent = deque(maxlen=2 * PIVOT_SIDE + 1)  # (high, low, tp*vol, vol)
+        self.pivot_highs = deque(maxlen=2)
+        self.pivot_lows = deque(maxlen=2)
+        # Суммы tp*vol и vol от последней точки разворота (от начала, пока точек нет)
+        self.anchor_low = [0.0, 0.0]
+        self.anchor_high = [0.0, 0.0]
+
+        self.returns = _Rolling(HV_WINDOW)
+        self.hv_window = deque(maxlen=VI_WINDOW)
+        self.hv_last_nan = -1
+        self.hv_max = NAN
+        self.hv_min = NAN
+
+        self.vwma_pv = _Rolling(BB_PERIOD)
+        self.vwma_v = _Rolling(BB_PERIOD)
+        self.bb = _Rolling(BB_PERIOD)
+        self.plus_dm = _Rolling(ADX_PERIOD)
+        self.minus_dm = _Rolling(ADX_PERIOD)
+        self.dx = _Rolling(ADX_PERIOD)
+
+    @classmethod
+    def from_history(cls, df, with_extras=True):
+        """
+        Строит состояние по кадру OHLCV (колонки Open/High/Low/Close/Volume).
+        Последняя строка совпадает с последней строкой build_indicator_frame(df).
+        """
+        engine = cls(with_extras=with_extras)
+        values = df[list(OHLCV)].to_numpy(dtype=float).tolist()
+        for index, bar in zip(df.index, values):
+            engine._advance(*bar)
+            engine.last_index = index
+        return engine
+
+    def update(self, bar, index=None):
+        """
+        Добавляет закрытую свечу.
+
+        Параметры:
+        - bar: dict/Series с Open/High/Low/Close/Volume или [ts, open, high, low, close, volume]
+        - index: метка строки (по умолчанию ts бара или имя Series)
+
+        Возвращает:
+        - dict последней строки индикаторов
+        """
+        o, h, l, c, v, ts = self._unpack(bar)
+        row = self._advance(o, h, l, c, v)
+        self.last_index = index if index is not None else ts
+        return row
+
+    def preview(self, bar):
+        """Строка индикаторов для формирующейся свечи без изменения состояния."""
+        return copy.deepcopy(self).update(bar)
+
+    @staticmethod
+    def _unpack(bar):
+        if isinstance(bar, (list, tuple)):
+            if len(bar) == 6:
+                return float(bar[1]), float(bar[2]), float(bar[3]), float(bar[4]), float(bar[5]), bar[0]
+            return float(bar[0]), float(bar[1]), float(bar[2]), float(bar[3]), float(bar[4]), None
+        ts = getattr(bar, "name", None) if isinstance(bar, pd.Series) else bar.get("timestamp")
+        return (float(bar["Open"]), float(bar["High"]), float(bar["Low"]),
+                float(bar["Close"]), float(bar["Volume"]), ts)
+
+    def to_series(self):
+        """Последняя строка как pd.Series (имя - метка последней свечи)."""
+        return pd.Series(self.last_row, name=self.last_index)
+
+    def _advance(self, o, h, l, c, v):
+        i = self.count
+        prev_close = self.prev_close
+        first = i == 0
+
+        ema20 = self.ema20.update(c)
+        ema50 = self.ema50.update(c)
+        ema200 = self.ema200.update(c)
+
+        delta = NAN if first else c - prev_close
+        self.up.push(delta if delta != delta else max(delta, 0.0))
+        self.down.push(delta if delta != delta else -min(delta, 0.0))
+        rs = _div(self.up.mean(), self.down.mean())
+        rsi = 100 - (100 / (1 + rs)) if rs == rs else NAN
+
+        macd = self.ema12.update(c) - self.ema26.update(c)
+        signal = self.signal.update(macd)
+
+        tr = h - l
+        if not first:
+            tr = max(tr, abs(h - prev_close), abs(l - prev_close))
+        self.tr.push(tr)
+        self.tr_st.push(tr)
+        atr = self.tr.mean()
+
+        trend_up = ema50 > ema200
+
+        tp = (h + l + c) / 3.0
+        if v != 0:
+            self.cum_tpv += tp * v
+            self.cum_vol += v
+            vwap = self.cum_tpv / self.cum_vol
+        else:
+            vwap = NAN
+
+        avwap = self._advance_pivots(h, l, tp * v, v, trend_up)
+
+        if not first and delta == delta:
+            self.obv += (1.0 if delta > 0 else -1.0 if delta < 0 else 0.0) * v
+        obv = self.obv
+        obv_ema = self.obv_ema.update(obv)
+
+        stoch_k, stoch_d = self._advance_stoch(rsi)
+        supertrend, supertrend_dir = self._advance_supertrend(h, l, c)
+
+        mstruct = False
+        if len(self.pivot_highs) == 2 and len(self.pivot_lows) == 2:
+            (ph0, ph1), (pl0, pl1) = self.pivot_highs, self.pivot_lows
+            mstruct = (ph1 > ph0 and pl1 > pl0) if trend_up else (ph1 < ph0 and pl1 < pl0)
+
+        hv, vol_index = self._advance_volatility(c, prev_close)
+
+        row = {
+            "Open": o, "High": h, "Low": l, "Close": c, "Volume": v,
+            "EMA_20": ema20, "EMA_50": ema50, "EMA_200": ema200,
+            "RSI_14": rsi, "MACD": macd, "Signal_Line": signal, "ATR_14": atr,
+            "Trend": "Uptrend" if trend_up else "Downtrend",
+            "VWAP": vwap, "AVWAP": avwap, "OBV": obv, "OBV_EMA_20": obv_ema,
+            "STOCHRSI_K": stoch_k, "STOCHRSI_D": stoch_d,
+            "SUPERTREND": supertrend, "SUPERTREND_DIR": supertrend_dir,
+            "MSTRUCT": mstruct,
+            "Historical_Volatility": hv, "Volatility_Index": vol_index,
+        }
+        if self.with_extras:
+            row.update(self._advance_extras(h, l, c, v, tr, atr))
+
+        self.prev_close = c
+        self.prev_high = h
+        self.prev_low = l
+        self.count += 1
+        self.last_row = row
+        return row
+
+    def _advance_pivots(self, h, l, tpv, v, trend_up):
+        """Подтверждает точку разворота на свече i-2 и возвращает AVWAP последней строки."""
+        self.recent.append((h, l, tpv, v))
+        for anchor in (self.anchor_low, self.anchor_high):
+            anchor[0] += tpv
+            anchor[1] += v
+        if len(self.recent) == self.recent.maxlen:
+            center = self.recent[PIVOT_SIDE]
+            others = [bar for k, bar in enumerate(self.recent) if k != PIVOT_SIDE]
+            tail = list(self.recent)[PIVOT_SIDE:]
+            if all(center[1] < bar[1] for bar in others):
+                self.pivot_lows.append(center[1])
+                self.anchor_low[:] = [self._tail_sum(tail, 2), self._tail_sum(tail, 3)]
+            if all(center[0] > bar[0] for bar in others):
+                self.pivot_highs.append(center[0])
+                self.anchor_high[:] = [self._tail_sum(tail, 2), self._tail_sum(tail, 3)]
+        tpv_sum, vol_sum = self.anchor_low if trend_up else self.anchor_high
+        return tpv_sum / vol_sum if vol_sum != 0 else NAN
+
+    @staticmethod
+    def _tail_sum(tail, k):
+        # Тот же порядок сложения, что у cumsum в add_indicators
+        total = 0.0
+        for bar in tail:
+            total += bar[k]
+        return total
+
+    def _advance_stoch(self, rsi):
+        self.rsi.push(rsi)
+        rsi_min = self.rsi.min()
+        rsi_max = self.rsi.max()
+        stoch = _nan_if_inf(_div(rsi - rsi_min, rsi_max - rsi_min))
+        if stoch == stoch:
+            stoch = min(max(stoch, 0.0), 1.0)
+        self.stoch.push(stoch)
+        k = self.stoch.mean() * 100.0
+        self.stoch_k.push(k)
+        return k, self.stoch_k.mean()
+
+    def _st_line(self, prev_value, prev_final_upper, close, final_upper, final_lower):
+        """Один шаг второго цикла _supertrend_recursion."""
+        if prev_value == prev_final_upper:
+            if close <= final_upper:
+                return final_upper, -1.0
+            return final_lower, 1.0
+        if close >= final_lower:
+            return final_lower, 1.0
+        return final_upper, -1.0
+
+    def _advance_supertrend(self, h, l, c):
+        atr = self.tr_st.mean()
+        hl2 = (h + l) / 2.0
+        upper = hl2 + ST_MULT * atr
+        lower = hl2 - ST_MULT * atr
+
+        if self.count == 0:
+            final_upper, final_lower = upper, lower
+            value, direction = final_upper, -1.0
+        else:
+            # Первый цикл рекурсии заменяет NaN предыдущей финальной полосы ее исходной полосой,
+            # а линия предыдущей свечи на полном кадре считается уже по исправленным полосам
+            fixed = False
+            if self.st_final_upper != self.st_final_upper:
+                self.st_final_upper = self.st_upper
+                fixed = True
+            if self.st_final_lower != self.st_final_lower:
+                self.st_final_lower = self.st_lower
+                fixed = True
+            if fixed:
+                if self.count == 1:
+                    self.st_value, self.st_dir = self.st_final_upper, -1.0
+                else:
+                    self.st_value, self.st_dir = self._st_line(
+                        self.st_prev_value, self.st_prev_final_upper,
+                        self.st_close, self.st_final_upper, self.st_final_lower,
+                    )
+
+            prev_upper, prev_lower = self.st_final_upper, self.st_final_lower
+            final_upper = upper if (upper < prev_upper or self.st_close > prev_upper) else prev_upper
+            final_lower = lower if (lower > prev_lower or self.st_close < prev_lower) else prev_lower
+            value, direction = self._st_line(self.st_value, prev_upper, c, final_upper, final_lower)
+
+        self.st_prev_value = self.st_value
+        self.st_prev_final_upper = self.st_final_upper
+        self.st_upper, self.st_lower = upper, lower
+        self.st_final_upper, self.st_final_lower = final_upper, final_lower
+        self.st_close = c
+        self.st_value, self.st_dir = value, direction
+        return value, direction
+
+    def _advance_volatility(self, c, prev_close):
+        ret = NAN if self.count == 0 else _nan_if_inf(_div(c, prev_close)) - 1
+        self.returns.push(ret)
+        hv = self.returns.std() * SQRT_252 * 100
+
+        i = self.count
+        self.hv_window.append(hv)
+        if hv != hv:
+            self.hv_last_nan = i
+        else:
+            self.hv_max = hv if self.hv_max != self.hv_max else max(self.hv_max, hv)
+            self.hv_min = hv if self.hv_min != self.hv_min else min(self.hv_min, hv)
+
+        if i + 1 >= VI_WINDOW:
+            if self.hv_last_nan > i - VI_WINDOW:
+                vol_max = vol_min = NAN
+            else:
+                vol_max = max(self.hv_window)
+                vol_min = min(self.hv_window)
+        else:
+            vol_max, vol_min = self.hv_max, self.hv_min
+
+        if vol_max > vol_min:
+            vol_index = (hv - vol_min) / (vol_max - vol_min) * 100
+            if vol_index == vol_index:
+                vol_index = min(max(vol_index, 0.0), 100.0)
+        else:
+            vol_index = 50.0
+        return hv, vol_index
+
+    def _advance_extras(self, h, l, c, v, tr, atr):
+        """Колонки, которые build_indicator_frame добавляет поверх add_indicators."""
+        self.vwma_pv.push(c * v)
+        self.vwma_v.push(v)
+        vwma = _div(self.vwma_pv.sum(), self.vwma_v.sum())
+
+        self.bb.push(c)
+        middle = self.bb.mean()
+        std = self.bb.std()
+
+        if self.count == 0:
+            plus_dm = minus_dm = 0.0
+        else:
+            up_move = h - self.prev_high
+            down_move = -(l - self.prev_low)
+            plus_dm = up_move if (up_move > down_move and up_move > 0) else 0.0
+            minus_dm = down_move if (down_move > up_move and down_move > 0) else 0.0
+        self.plus_dm.push(plus_dm)
+        self.minus_dm.push(minus_dm)
+        atr_adx = NAN if atr == 0 else atr
+        plus_di = 100 * _div(self.plus_dm.sum(), atr_adx)
+        minus_di = 100 * _div(self.minus_dm.sum(), atr_adx)
+        di_sum = plus_di + minus_di
+        dx = 100 * _div(abs(plus_di - minus_di), NAN if di_sum == 0 else di_sum)
+        self.dx.push(dx)
+        adx = self.dx.mean()
+
+        return {
+            "VWMA_20": vwma,
+            "BB_middle": middle, "BB_std": std,
+            "BB_upper": middle + 2 * std, "BB_lower": middle - 2 * std,
+            "ADX": adx if adx == adx else 0.0,
+        }
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ограниченный по памяти LRU/TTL-кэш кадров с индикаторами.
+
+Ключ кэша - (символ, таймфрейм, время последней свечи, количество строк):
+пока на рынке не появилась новая свеча, повторный запрос того же рынка
+получает уже посчитанный кадр. TTL ограничивает "устаревание" текущей
+(еще не закрытой) свечи, у которой время открытия не меняется.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def frame_nbytes(df):
+    """Оценка занимаемой памяти кадра в байтах."""
+    try:
+        return int(df.memory_usage(index=True, deep=True).sum())
+    except Exception:
+        return 0
+
+
+class IndicatorCache:
+    """
+    Потокобезопасный LRU-кэш с TTL и лимитом памяти.
+
+    Параметры:
+    - max_entries: максимум кадров в кэше
+    - max_bytes: лимит суммарного объема кадров
+    - ttl_seconds: время жизни записи
+    """
+
+    def __init__(self, max_entries=64, max_bytes=256 * 1024 * 1024, ttl_seconds=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (created_at, nbytes, df)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls):
+        """INDICATOR_CACHE_ENTRIES, INDICATOR_CACHE_MAX_MB, INDICATOR_CACHE_TTL (0 - кэш отключен)."""
+        try:
+            return cls(
+                max_entries=int(os.getenv("INDICATOR_CACHE_ENTRIES", "64")),
+                max_bytes=int(float(os.getenv("INDICATOR_CACHE_MAX_MB", "256")) * 1024 * 1024),
+                ttl_seconds=float(os.getenv("INDICATOR_CACHE_TTL", "60")),
+            )
+        except ValueError:
+            return cls()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0 and self.ttl_seconds > 0
+
+    def get(self, key):
+        """Возвращает закэшированный кадр (без копирования) или None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            created_at, nbytes, df = entry
+            if time.monotonic() - created_at > self.ttl_seconds:
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return df
+
+    def put(self, key, df):
+        """Кладет кадр в кэш, вытесняя самые старые записи при превышении лимитов."""
+        if not self.enabled:
+            return
+        nbytes = frame_nbytes(df)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic(), nbytes, df)
+            self._total_bytes += nbytes
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+            ):
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._total_bytes -= nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        """Счетчики попаданий/промахов и текущий объем кэша."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total * 100) if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
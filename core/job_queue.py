@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Очередь фоновых задач анализа с хранилищем статусов в SQLite.
+
+Задачи выполняются в ограниченном пуле потоков процесса, который их принял,
+а статус и результат пишутся в SQLite. Поэтому опрашивать задачу можно из
+любого воркера gunicorn, а не только из того, который ее запустил.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_DONE, JOB_FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (status, finished_at);
+"""
+
+_STATUS_COLUMNS = "id, owner, kind, status, created_at, started_at, finished_at, error"
+
+
+class JobQueue:
+    """
+    Ограниченная очередь задач.
+
+    Параметры:
+    - path: путь к файлу SQLite со статусами задач
+    - max_workers: количество одновременно выполняемых задач
+    - max_pending: лимит задач (в очереди + выполняются) в этом процессе
+    - result_ttl: сколько секунд хранить завершенные задачи
+    """
+
+    def __init__(self, path, max_workers=2, max_pending=32, result_ttl=3600):
+        self.path = path
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(1, int(max_pending))
+        self.result_ttl = result_ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="analysis-job")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    @classmethod
+    def from_env(cls, default_path):
+        """JOB_QUEUE_PATH, JOB_QUEUE_WORKERS, JOB_QUEUE_MAX_PENDING, JOB_RESULT_TTL."""
+        try:
+            return cls(
+                os.getenv("JOB_QUEUE_PATH") or default_path,
+                max_workers=int(os.getenv("JOB_QUEUE_WORKERS", "2")),
+                max_pending=int(os.getenv("JOB_QUEUE_MAX_PENDING", "32")),
+                result_ttl=float(os.getenv("JOB_RESULT_TTL", "3600")),
+            )
+        except ValueError:
+            return cls(default_path)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(_SCHEMA)
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def _execute(self, query, params):
+        conn = self._connect()
+        try:
+            conn.execute(query, params)
+            conn.commit()
+        finally:
+            conn.close()
+
+    @property
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def submit(self, owner, kind, func, *args, **kwargs):
+        """
+        Ставит func(*args, **kwargs) в очередь.
+
+        Возвращает:
+        - id задачи (str) или None, если очередь переполнена
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+        try:
+            self.cleanup()
+            job_id = uuid.uuid4().hex
+            self._execute(
+                "INSERT INTO jobs (id, owner, kind, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, str(owner), kind, JOB_QUEUED, time.time()),
+            )
+            self._executor.submit(self._run, job_id, func, args, kwargs)
+            return job_id
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    def _run(self, job_id, func, args, kwargs):
+        try:
+            self._execute(
+                "UPDATE jobs SET status=?, started_at=? WHERE id=?",
+                (JOB_RUNNING, time.time(), job_id),
+            )
+            try:
+                result = func(*args, **kwargs)
+                self._execute(
+                    "UPDATE jobs SET status=?, finished_at=?, result=? WHERE id=?",
+                    (JOB_DONE, time.time(), json.dumps(result, default=str), job_id),
+                )
+            except Exception as e:
+                self._execute(
+                    "UPDATE jobs SET status=?, finished_at=?, error=? WHERE id=?",
+                    (JOB_FAILED, time.time(), str(e) or type(e).__name__, job_id),
+                )
+        except Exception as e:
+            print(f"⚠️ Не удалось обновить статус задачи {job_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def get(self, job_id, owner=None, include_result=True):
+        """
+        Возвращает задачу как dict или None (нет задачи или она принадлежит другому владельцу).
+        Для завершенной задачи с include_result=True в ключе "result" лежит результат.
+        """
+        columns = _STATUS_COLUMNS + (", result" if include_result else "")
+        conn = self._connect()
+        try:
+            row = conn.execute(f"SELECT {columns} FROM jobs WHERE id=?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None or (owner is not None and row["owner"] != str(owner)):
+            return None
+        job = dict(row)
+        if include_result:
+            job["result"] = json.loads(job["result"]) if job.get("result") else None
+        return job
+
+    def cleanup(self):
+        """
+        Удаляет завершенные задачи старше result_ttl и помечает ошибкой задачи,
+        "зависшие" дольше result_ttl (например, процесс был перезапущен).
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (JOB_DONE, JOB_FAILED, now - self.result_ttl),
+            )
+            conn.execute(
+                "UPDATE jobs SET status=?, finished_at=?, error=? WHERE status IN (?, ?) AND created_at < ?",
+                (JOB_FAILED, now, "interrupted", JOB_QUEUED, JOB_RUNNING, now - self.result_ttl),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
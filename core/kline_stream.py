@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потоковое получение свечей (kline) через WebSocket.
+
+Сервис подписывается на пары (символ, таймфрейм), дописывает закрытые свечи
+в локальное хранилище (CandleStore) и держит в памяти формирующуюся свечу.
+Пока поток "живой", а предыдущая свеча в хранилище точно закрыта (записана
+потоком или докачана по REST после закрытия), fetch_ohlcv собирает историю
+из хранилища и текущей свечи без REST-запросов к бирже. Для отслеживаемых
+рынков каждая закрытая свеча также продвигает инкрементальные индикаторы
+(IncrementalIndicators).
+
+Источник событий подключаемый: BinanceWebSocketSource (нужен пакет
+websocket-client) или ReplaySource, который проигрывает записанные события
+и заменяет биржу в офлайн-проверках.
+"""
+
+import json
+import threading
+import time
+
+try:
+    import websocket  # websocket-client
+except ImportError:
+    websocket = None
+
+import pandas as pd
+
+from core.candle_store import timeframe_to_ms
+from core.incremental_indicators import IncrementalIndicators
+
+BINANCE_STREAM_URL = "wss://stream.binance.com:9443/ws"
+
+
+def stream_name(symbol, timeframe):
+    """Имя потока Binance: "BTC/USDT", "1h" -> "btcusdt@kline_1h"."""
+    return f"{symbol.replace('/', '').lower()}@kline_{timeframe}"
+
+
+def parse_kline_event(message):
+    """
+    Разбирает событие kline Binance (в том числе в обертке combined stream).
+
+    Возвращает:
+    - (stream_symbol, timeframe, bar, is_closed), bar = [ts, open, high, low, close, volume],
+      или None, если сообщение не является событием kline
+    """
+    try:
+        if "data" in message and "stream" in message:
+            message = message["data"]
+        if message.get("e") != "kline":
+            return None
+        k = message["k"]
+        bar = [int(k["t"]), float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]), float(k["v"])]
+        return k.get("s", message.get("s", "")).lower(), k["i"], bar, bool(k.get("x"))
+    except Exception:
+        return None
+
+
+class KlineSource:
+    """
+    Источник событий kline.
+    run() блокирует поток и вызывает on_message(dict) для каждого события до stop_event.
+    """
+
+    def run(self, streams, on_message, stop_event):
+        raise NotImplementedError
+
+    def subscribe(self, streams):
+        """Добавляет потоки на ходу (если источник это поддерживает)."""
+
+
+class BinanceWebSocketSource(KlineSource):
+    """
+    Поток Binance через websocket-client с переподключением.
+    url можно направить на локальный сервер, повторяющий протокол Binance.
+    """
+
+    def __init__(self, url=BINANCE_STREAM_URL, recv_timeout=5, max_backoff=60):
+        if websocket is None:
+            raise ImportError("websocket-client не установлен: pip install websocket-client")
+        self.url = url
+        self.recv_timeout = recv_timeout
+        self.max_backoff = max_backoff
+        self._ws = None
+        self._request_id = 0
+        self._lock = threading.Lock()
+
+    def _send_subscribe(self, streams):
+        if not streams or self._ws is None:
+            return
+        with self._lock:
+            self._request_id += 1
+            self._ws.send(json.dumps({"method": "SUBSCRIBE", "params": sorted(streams), "id": self._request_id}))
+
+    def subscribe(self, streams):
+        try:
+            self._send_subscribe(streams)
+        except Exception as e:
+            print(f"⚠️ Не удалось подписаться на {streams}: {e}")
+
+    def run(self, streams, on_message, stop_event):
+        backoff = 1
+        while not stop_event.is_set():
+            try:
+                self._ws = websocket.create_connection(self.url, timeout=self.recv_timeout)
+                self._send_subscribe(streams())
+                backoff = 1
+                while not stop_event.is_set():
+                    try:
+                        raw = self._ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    if raw:
+                        on_message(json.loads(raw))
+            except Exception as e:
+                if stop_event.is_set():
+                    break
+                print(f"⚠️ Поток свечей прерван ({e}), переподключение через {backoff} сек")
+                stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            finally:
+                try:
+                    if self._ws is not None:
+                        self._ws.close()
+                except Exception:
+                    pass
+                self._ws = None
+
+
+class ReplaySource(KlineSource):
+    """
+    Проигрывает записанные события (список dict или JSONL-файл) с паузой interval между ними.
+    """
+
+    def __init__(self, events, interval=0.0):
+        self.events = events
+        self.interval = interval
+
+    def _iter_events(self):
+        if isinstance(self.events, str):
+            with open(self.events, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            yield from self.events
+
+    def run(self, streams, on_message, stop_event):
+        for event in self._iter_events():
+            if stop_event.is_set():
+                break
+            on_message(event)
+            if self.interval:
+                stop_event.wait(self.interval)
+
+
+class KlineStreamService:
+    """
+    Сервис потоковых свечей поверх CandleStore.
+
+    Параметры:
+    - store: CandleStore, куда дописываются закрытые свечи
+    - source: KlineSource
+    - exchange_id: ключ биржи в хранилище (как exchange_id_of(client))
+    - stale_after: через сколько секунд без событий поток считается неактуальным
+    """
+
+    def __init__(self, store, source, exchange_id="binance", stale_after=10.0):
+        self.store = store
+        self.source = source
+        self.exchange_id = exchange_id
+        self.stale_after = stale_after
+        self._subscriptions = {}  # stream_name -> (symbol, timeframe)
+        self._forming = {}  # (symbol, timeframe) -> bar
+        self._last_event = {}  # (symbol, timeframe) -> time.monotonic()
+        # (symbol, timeframe) -> ts, до которого свечи в хранилище точно закрыты:
+        # записаны потоком как закрытые или докачаны по REST уже после закрытия
+        self._closed_until = {}
+        self._indicators = {}  # (symbol, timeframe) -> IncrementalIndicators
+        self._indicators_since = {}  # (symbol, timeframe) -> since_ms истории индикаторов
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.events = 0
+        self.closed_written = 0
+        self.closed_skipped = 0
+        self.indicator_rebuilds = 0
+
+    def subscribe(self, symbol, timeframe):
+        """Подписка на (символ, таймфрейм); повторная подписка ничего не делает."""
+        name = stream_name(symbol, timeframe)
+        with self._lock:
+            if name in self._subscriptions:
+                return
+            self._subscriptions[name] = (symbol, timeframe)
+        if self.running:
+            self.source.subscribe([name])
+
+    def _streams(self):
+        with self._lock:
+            return list(self._subscriptions)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.source.run, args=(self._streams, self.handle, self._stop),
+            name="kline-stream", daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def handle(self, message):
+        """Обрабатывает одно событие источника."""
+        parsed = parse_kline_event(message)
+        if parsed is None:
+            return
+        stream_symbol, timeframe, bar, is_closed = parsed
+        with self._lock:
+            market = self._subscriptions.get(f"{stream_symbol}@kline_{timeframe}")
+        if market is None:
+            return
+        self.events += 1
+        symbol, timeframe = market
+        if is_closed:
+            self._append_closed(symbol, timeframe, bar)
+        with self._lock:
+            if is_closed:
+                # Следующая свеча откроется сразу после закрытой
+                if self._forming.get(market, [None])[0] == bar[0]:
+                    self._forming.pop(market, None)
+            else:
+                self._forming[market] = bar
+            self._last_event[market] = time.monotonic()
+
+    def _append_closed(self, symbol, timeframe, bar):
+        """
+        Дописывает закрытую свечу, только если она продолжает сохраненный диапазон без дыры
+        и предыдущая свеча в хранилище точно закрыта. Иначе хвост (вместе с этой свечой)
+        докачает обычная синхронизация по REST, начиная с последнего сохраненного бара.
+        """
+        market = (symbol, timeframe)
+        tf_ms = timeframe_to_ms(timeframe) or 0
+        try:
+            _, last_ts = self.store.bounds(self.exchange_id, symbol, timeframe)
+            with self._lock:
+                closed_until = self._closed_until.get(market)
+            if (last_ts is not None and last_ts + tf_ms >= bar[0]
+                    and closed_until is not None and closed_until >= bar[0] - tf_ms):
+                self.store.write(self.exchange_id, symbol, timeframe, [bar])
+                self.closed_written += 1
+                rebuild = False
+                with self._lock:
+                    self._closed_until[market] = max(self._closed_until.get(market, bar[0]), bar[0])
+                    engine = self._indicators.get(market)
+                    if engine is not None and bar[0] > engine.last_index:
+                        if bar[0] == engine.last_index + tf_ms:
+                            engine.update(bar)
+                        else:
+                            # Между состоянием и свечой есть бары (пропущенные потоком и докачанные
+                            # по REST) - продвигать EWM/ATR/Supertrend через дыру нельзя
+                            rebuild = True
+                if rebuild:
+                    self._rebuild_indicators(symbol, timeframe, bar[0] + tf_ms)
+            else:
+                # Хранилище отстало или его последний бар мог быть записан по REST еще не закрытым
+                self.closed_skipped += 1
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить свечу {symbol} {timeframe}: {e}")
+
+    def note_synced(self, exchange_id, symbol, timeframe, synced_at_ms):
+        """
+        Отмечает синхронизацию рынка по REST: хранилище докачано до synced_at_ms,
+        значит все свечи, закрывшиеся к этому моменту, в нем уже окончательные.
+        """
+        if exchange_id != self.exchange_id:
+            return
+        tf_ms = timeframe_to_ms(timeframe) or 0
+        if not tf_ms:
+            return
+        market = (symbol, timeframe)
+        with self._lock:
+            closed_until = int(synced_at_ms) - tf_ms
+            self._closed_until[market] = max(self._closed_until.get(market, closed_until), closed_until)
+
+    def forming(self, symbol, timeframe):
+        """Текущая (не закрытая) свеча или None."""
+        with self._lock:
+            bar = self._forming.get((symbol, timeframe))
+            return list(bar) if bar else None
+
+    def is_live(self, symbol, timeframe):
+        with self._lock:
+            last = self._last_event.get((symbol, timeframe))
+        return last is not None and time.monotonic() - last <= self.stale_after
+
+    def bars_since(self, exchange_id, symbol, timeframe, since_ms):
+        """
+        История с since_ms из хранилища + формирующаяся свеча, без обращения к бирже.
+
+        Возвращает:
+        - Список баров или None, если поток не актуален или хранилище не покрывает диапазон
+          (тогда вызывающий код идет обычным путем через REST)
+        """
+        if exchange_id != self.exchange_id or not self.is_live(symbol, timeframe):
+            return None
+        bar = self.forming(symbol, timeframe)
+        if bar is None:
+            return None
+        tf_ms = timeframe_to_ms(timeframe) or 0
+        with self._lock:
+            closed_until = self._closed_until.get((symbol, timeframe))
+        # Предыдущая свеча должна быть в хранилище окончательной: бар, записанный по REST
+        # до закрытия, без этой проверки ушел бы клиенту как закрытый
+        if closed_until is None or closed_until < bar[0] - tf_ms:
+            return None
+        covered = self.store.covered_from(self.exchange_id, symbol, timeframe)
+        _, last_ts = self.store.bounds(self.exchange_id, symbol, timeframe)
+        if covered is None or last_ts is None:
+            return None
+        if since_ms + tf_ms < covered or last_ts + tf_ms < bar[0]:
+            return None
+        return self.store.read(self.exchange_id, symbol, timeframe, since_ms, until_ms=bar[0] - 1) + [bar]
+
+    def track_indicators(self, symbol, timeframe, since_ms, now_ms=None):
+        """
+        Включает инкрементальные индикаторы рынка: состояние строится по закрытым свечам
+        хранилища с since_ms, дальше его продвигает каждая закрытая свеча потока.
+
+        Возвращает:
+        - True, если в хранилище нашлась история для рынка
+        """
+        tf_ms = timeframe_to_ms(timeframe) or 0
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        # Последний бар хранилища может быть еще не закрыт (его перекачивает синхронизация по REST)
+        until_ms = now_ms - tf_ms
+        with self._lock:
+            closed_until = self._closed_until.get((symbol, timeframe))
+        if closed_until is not None:
+            until_ms = min(until_ms, closed_until)
+        bars = self.store.read(self.exchange_id, symbol, timeframe, since_ms, until_ms=until_ms)
+        if not bars:
+            return False
+        df = pd.DataFrame(bars, columns=["ts", "Open", "High", "Low", "Close", "Volume"]).set_index("ts")
+        engine = IncrementalIndicators.from_history(df)
+        with self._lock:
+            self._indicators[(symbol, timeframe)] = engine
+            self._indicators_since[(symbol, timeframe)] = since_ms
+        return True
+
+    def _rebuild_indicators(self, symbol, timeframe, now_ms):
+        """Пересобирает состояние индикаторов по хранилищу; не вышло - рынок перестает отслеживаться."""
+        market = (symbol, timeframe)
+        with self._lock:
+            since_ms = self._indicators_since.get(market)
+        try:
+            if since_ms is not None and self.track_indicators(symbol, timeframe, since_ms, now_ms=now_ms):
+                self.indicator_rebuilds += 1
+                return
+        except Exception as e:
+            print(f"⚠️ Не удалось пересобрать индикаторы {symbol} {timeframe}: {e}")
+        # live_indicators построит состояние заново при следующем запросе
+        with self._lock:
+            self._indicators.pop(market, None)
+            self._indicators_since.pop(market, None)
+
+    def is_tracking(self, symbol, timeframe):
+        with self._lock:
+            return (symbol, timeframe) in self._indicators
+
+    def indicators(self, symbol, timeframe, include_forming=False):
+        """
+        Последняя строка индикаторов рынка (dict) или None, если рынок не отслеживается.
+        include_forming=True считает строку для текущей свечи, не меняя состояние.
+        """
+        forming = self.forming(symbol, timeframe) if include_forming else None
+        with self._lock:
+            engine = self._indicators.get((symbol, timeframe))
+            if engine is None or engine.last_row is None:
+                return None
+            if forming is not None and forming[0] > engine.last_index:
+                return engine.preview(forming)
+            return dict(engine.last_row)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscriptions": len(self._subscriptions),
+                "indicators": len(self._indicators),
+                "live": sum(1 for m in self._last_event if time.monotonic() - self._last_event[m] <= self.stale_after),
+                "events": self.events,
+                "closed_written": self.closed_written,
+                "closed_skipped": self.closed_skipped,
+                "indicator_rebuilds": self.indicator_rebuilds,
+            }
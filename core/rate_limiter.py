@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Общий для всех процессов лимит запросов к Binance (token bucket).
+
+Состояние корзины хранится в маленьком файле и меняется под файловой
+блокировкой (fcntl на Linux/macOS, msvcrt на Windows), поэтому воркеры
+gunicorn, воркер авто-сигналов и десктопное приложение на одной машине
+расходуют один и тот же бюджет веса запросов.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:  # POSIX
+    msvcrt = None
+
+# Binance spot: 6000 единиц веса в минуту на IP; по умолчанию оставляем запас
+DEFAULT_WEIGHT_PER_MINUTE = 4800
+DEFAULT_BURST = 800
+
+# Пауза для всех процессов после ответа 429 (превышен лимит) и 418 (IP временно заблокирован)
+RATE_LIMIT_BACKOFF_SECONDS = 30
+IP_BAN_BACKOFF_SECONDS = 120
+
+# Веса методов ccxt по документации Binance (GET /api/v3/...)
+BINANCE_WEIGHTS = {
+    "fetch_ohlcv": 2,  # klines
+    "fetch_ticker": 2,  # ticker/24hr для одного символа
+    "fetch_trades": 25,  # trades
+    "load_markets": 20,  # exchangeInfo
+    "fetch_markets": 20,
+    "fetch_time": 1,
+    "fetch_status": 1,
+}
+DEFAULT_WEIGHT = 2
+
+
+def binance_request_weight(method, args=(), kwargs=None):
+    """
+    Вес вызова метода ccxt в единицах Binance.
+
+    Параметры:
+    - method: имя метода ccxt ("fetch_ohlcv", "fetch_order_book", ...)
+    - args, kwargs: аргументы вызова (вес стакана и тикеров зависит от них)
+
+    Возвращает:
+    - Вес запроса (int)
+    """
+    kwargs = kwargs or {}
+    if method == "fetch_order_book":
+        limit = kwargs.get("limit", args[1] if len(args) > 1 else None) or 100
+        if limit <= 100:
+            return 5
+        if limit <= 500:
+            return 25
+        if limit <= 1000:
+            return 50
+        return 250
+    if method == "fetch_tickers":
+        symbols = kwargs.get("symbols", args[0] if args else None)
+        if not symbols:
+            return 80
+        return 2 if len(symbols) <= 20 else 40 if len(symbols) <= 100 else 80
+    return BINANCE_WEIGHTS.get(method, DEFAULT_WEIGHT)
+
+
+# HTTP-статус в начале сообщения ccxt: "binance 418 ..." (binance.handle_errors)
+# или "binance GET https://... 429 ..." (Exchange.handle_http_status_code).
+# Ищется только в этой позиции: в URL запроса (startTime, цены, символы) могут быть любые цифры
+_STATUS_PREFIX_RE = re.compile(r"^\S+ (?:[A-Z]+ \S+ )?(\d{3}) ")
+
+RATE_LIMIT_STATUSES = (418, 429)
+
+
+def _status_attribute(error):
+    """HTTP-статус из атрибутов исключения (http_status, status_code, response.status_code) или None."""
+    status = getattr(error, "http_status", None) or getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limit_status(error):
+    """
+    HTTP-статус ответа биржи об ограничении запросов.
+
+    Берется из атрибута исключения (http_status, status_code или response.status_code),
+    а для ccxt - из префикса сообщения "<биржа> [<метод> <url>] <статус>".
+
+    Возвращает:
+    - 418, 429 или None
+    """
+    status = _status_attribute(error)
+    if status is None:
+        match = _STATUS_PREFIX_RE.match(str(error))
+        status = int(match.group(1)) if match else None
+    return status if status in RATE_LIMIT_STATUSES else None
+
+
+def is_rate_limit_error(error):
+    """
+    Ответ биржи о превышении лимита: классы ccxt RateLimitExceeded/DDoSProtection
+    или исключение с HTTP-статусом 429/418 в атрибуте (не по цифрам в тексте сообщения).
+    """
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & {"RateLimitExceeded", "DDoSProtection"}:
+        return True
+    return _status_attribute(error) in RATE_LIMIT_STATUSES
+
+
+class _FileLock:
+    """Эксклюзивная блокировка открытого файла между процессами."""
+
+    def __init__(self, handle):
+        self.handle = handle
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            self.handle.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.handle.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK сдается через ~10 сек - ждем дальше
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            self.handle.seek(0)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        return False
+
+
+class SharedRateLimiter:
+    """
+    Token bucket с состоянием в файле.
+
+    Параметры:
+    - path: файл состояния (общий для всех процессов)
+    - weight_per_minute: скорость пополнения бюджета
+    - burst: емкость корзины (сколько веса можно потратить разом)
+    """
+
+    def __init__(self, path, weight_per_minute=DEFAULT_WEIGHT_PER_MINUTE, burst=DEFAULT_BURST):
+        self.path = path
+        self.rate = float(weight_per_minute) / 60.0
+        self.capacity = float(burst)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Файл открывается на каждую операцию: после fork у процессов не должно быть общего дескриптора
+        with open(self.path, "a"):
+            pass
+        self._local_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.weight = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.blocks = 0
+        self.by_method = {}
+
+    @classmethod
+    def from_env(cls, default_path):
+        """
+        RATE_LIMIT=0 отключает лимитер (возвращается None), RATE_LIMIT_PATH - файл состояния,
+        RATE_LIMIT_WEIGHT_PER_MIN и RATE_LIMIT_BURST - бюджет.
+        """
+        if os.getenv("RATE_LIMIT", "1").strip().lower() in ("0", "false", "no", "off"):
+            return None
+        try:
+            return cls(
+                os.getenv("RATE_LIMIT_PATH") or default_path,
+                weight_per_minute=float(os.getenv("RATE_LIMIT_WEIGHT_PER_MIN", DEFAULT_WEIGHT_PER_MINUTE)),
+                burst=float(os.getenv("RATE_LIMIT_BURST", DEFAULT_BURST)),
+            )
+        except Exception as e:
+            print(f"⚠️ Общий лимит запросов недоступен: {e}")
+            return None
+
+    def _update(self, func):
+        """Читает состояние, применяет func(state, now) -> результат и сохраняет состояние под блокировкой."""
+        with self._local_lock, open(self.path, "r+") as handle, _FileLock(handle):
+            handle.seek(0)
+            raw = handle.read()
+            try:
+                state = json.loads(raw) if raw.strip() else {}
+            except ValueError:
+                state = {}
+            now = time.time()
+            tokens = float(state.get("tokens", self.capacity))
+            updated = float(state.get("updated", now))
+            # Пополнение; часы могли сдвинуться назад - не уходим в минус
+            tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+            state = {"tokens": tokens, "updated": now, "blocked_until": float(state.get("blocked_until", 0.0))}
+            result = func(state, now)
+            handle.seek(0)
+            handle.truncate()
+            handle.write(json.dumps(state))
+            handle.flush()
+            return result
+
+    def _try_take(self, weight):
+        def take(state, now):
+            if state["blocked_until"] > now:
+                return state["blocked_until"] - now
+            if state["tokens"] >= weight:
+                state["tokens"] -= weight
+                return 0.0
+            return (weight - state["tokens"]) / self.rate if self.rate > 0 else 1.0
+        return self._update(take)
+
+    def acquire(self, weight=1, method=None):
+        """
+        Блокирует до появления weight единиц бюджета и списывает их.
+
+        Возвращает:
+        - Время ожидания в секундах
+        """
+        weight = min(float(weight), self.capacity)
+        started = time.monotonic()
+        while True:
+            delay = self._try_take(weight)
+            if delay <= 0:
+                break
+            time.sleep(min(delay, 1.0))
+        waited = time.monotonic() - started
+        with self._stats_lock:
+            self.requests += 1
+            self.weight += weight
+            if waited > 0.001:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait = max(self.max_wait, waited)
+            if method:
+                self.by_method[method] = self.by_method.get(method, 0) + weight
+        return waited
+
+    def block(self, seconds):
+        """Останавливает запросы всех процессов на seconds (после 429/418)."""
+        def apply(state, now):
+            state["blocked_until"] = max(state["blocked_until"], now + seconds)
+            state["tokens"] = 0.0
+        self._update(apply)
+        with self._stats_lock:
+            self.blocks += 1
+
+    def available(self):
+        """Текущий остаток бюджета (без списания)."""
+        return self._update(lambda state, now: state["tokens"])
+
+    def stats(self):
+        """Метрики этого процесса: запросы, вес, ожидания."""
+        with self._stats_lock:
+            return {
+                "requests": self.requests,
+                "weight": self.weight,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "avg_wait": round(self.wait_seconds / self.waits, 3) if self.waits else 0.0,
+                "max_wait": round(self.max_wait, 3),
+                "blocks": self.blocks,
+                "weight_by_method": dict(self.by_method),
+            }
+
+
+class RateLimitedExchange:
+    """
+    Обертка клиента ccxt: каждый вызов fetch_*/load_markets сначала списывает вес из общего бюджета.
+    Остальные атрибуты (id, rateLimit, markets, ...) проксируются клиенту без изменений.
+    """
+
+    def __init__(self, client, limiter, weight_fn=binance_request_weight):
+        self._client = client
+        self._limiter = limiter
+        self._weight_fn = weight_fn
+
+    @classmethod
+    def wrap(cls, client, limiter):
+        """Оборачивает клиент, если лимитер включен."""
+        return cls(client, limiter) if limiter is not None else client
+
+    @property
+    def client(self):
+        return self._client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or not (name.startswith("fetch_") or name == "load_markets"):
+            return attr
+
+        def call(*args, **kwargs):
+            weight = self._weight_fn(name, args, kwargs)
+            # Первый запрос ccxt сам загружает рынки (exchangeInfo) - учитываем и его
+            if name != "load_markets" and not getattr(self._client, "markets", True):
+                weight += self._weight_fn("load_markets")
+            self._limiter.acquire(weight, method=name)
+            try:
+                return attr(*args, **kwargs)
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    seconds = IP_BAN_BACKOFF_SECONDS if rate_limit_status(e) == 418 else RATE_LIMIT_BACKOFF_SECONDS
+                    print(f"⚠️ Биржа ограничила запросы ({name}), пауза {seconds} сек для всех процессов")
+                    self._limiter.block(seconds)
+                raise
+
+        return call
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Хранилище отчетов с ключами переводов (SQLite) и кэш их отрисовки.
+
+Анализ отрисовывает отчет только на запрошенном языке, а markdown с ключами
+{{key}} сохраняется здесь один раз под идентификатором из хэша содержимого:
+одинаковые отчеты получают один и тот же report_id. Другие языки
+отрисовываются по запросу (/api/translate_report) и держатся в небольшом
+LRU-кэше в памяти процесса.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    report_id TEXT PRIMARY KEY,
+    markdown TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reports_created_at ON reports (created_at);
+"""
+
+
+def report_id_of(markdown):
+    """Идентификатор отчета - первые 32 символа SHA-256 от markdown."""
+    return hashlib.sha256(markdown.encode("utf-8")).hexdigest()[:32]
+
+
+class ReportStore:
+    """
+    Контентно-адресуемое хранилище markdown-отчетов.
+
+    Параметры:
+    - path: путь к файлу базы SQLite
+    - max_reports: сколько последних отчетов хранить (старые удаляются при записи)
+    - render_cache_entries: размер LRU-кэша отрисованных отчетов (report_id, язык)
+    """
+
+    prune_every = 100  # Чистка старых отчетов - раз в столько записей
+
+    def __init__(self, path, max_reports=5000, render_cache_entries=256):
+        self.path = path
+        self.max_reports = max_reports
+        self.render_cache_entries = render_cache_entries
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._renders = OrderedDict()  # (report_id, language) -> текст
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, default_path):
+        """
+        Создает хранилище по переменным окружения.
+
+        REPORT_STORE=0 отключает хранилище (возвращается None),
+        REPORT_STORE_PATH переопределяет путь к файлу базы,
+        REPORT_STORE_MAX - сколько отчетов хранить, REPORT_RENDER_CACHE - размер кэша отрисовки.
+        """
+        if os.getenv("REPORT_STORE", "1").strip().lower() in ("0", "false", "no", "off"):
+            return None
+        try:
+            return cls(
+                os.getenv("REPORT_STORE_PATH") or default_path,
+                max_reports=int(os.getenv("REPORT_STORE_MAX", "5000")),
+                render_cache_entries=int(os.getenv("REPORT_RENDER_CACHE", "256")),
+            )
+        except Exception as e:
+            print(f"⚠️ Хранилище отчетов недоступно: {e}")
+            return None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(_SCHEMA)
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def put(self, markdown, rendered=None):
+        """
+        Сохраняет markdown с ключами и возвращает его report_id.
+
+        Параметры:
+        - markdown: отчет с ключами {{key}}
+        - rendered: уже отрисованные версии {язык: текст} - сразу попадают в кэш
+        """
+        report_id = report_id_of(markdown)
+        conn = self._connect()
+        try:
+            # Повторный отчет только освежает время, чтобы не попасть под чистку
+            conn.execute(
+                "INSERT INTO reports (report_id, markdown, created_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(report_id) DO UPDATE SET created_at=excluded.created_at",
+                (report_id, markdown, time.time()),
+            )
+            with self._lock:
+                self._puts += 1
+                prune = self._puts % self.prune_every == 0
+            if prune and self.max_reports > 0:
+                conn.execute(
+                    "DELETE FROM reports WHERE report_id NOT IN "
+                    "(SELECT report_id FROM reports ORDER BY created_at DESC LIMIT ?)",
+                    (self.max_reports,),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+        for language, text in (rendered or {}).items():
+            self._remember(report_id, language, text)
+        return report_id
+
+    def get(self, report_id):
+        """markdown с ключами по report_id или None."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT markdown FROM reports WHERE report_id=?", (str(report_id),)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def _remember(self, report_id, language, text):
+        if self.render_cache_entries <= 0:
+            return
+        with self._lock:
+            self._renders[(report_id, language)] = text
+            self._renders.move_to_end((report_id, language))
+            while len(self._renders) > self.render_cache_entries:
+                self._renders.popitem(last=False)
+
+    def render(self, report_id, language, renderer):
+        """
+        Отчет на языке: из кэша или renderer(markdown, language) по сохраненному markdown.
+
+        Возвращает:
+        - Текст отчета или None, если report_id неизвестен (удален или из другой базы)
+        """
+        key = (report_id, language)
+        with self._lock:
+            text = self._renders.get(key)
+            if text is not None:
+                self._renders.move_to_end(key)
+                self.hits += 1
+                return text
+            self.misses += 1
+        markdown = self.get(report_id)
+        if markdown is None:
+            return None
+        text = renderer(markdown, language)
+        self._remember(report_id, language, text)
+        return text
+
+    def stats(self):
+        """Счетчики попаданий/промахов кэша отрисовки."""
+        with self._lock:
+            return {"renders": len(self._renders), "hits": self.hits, "misses": self.misses}
@@ -6,9 +6,12 @@ import requests
 import os
 
 import runpy
+import multiprocessing
 
 
 if __name__ == "__main__":
+    # Сборка PyInstaller: процессы пула отрисовки графиков (spawn) запускают этот же exe
+    multiprocessing.freeze_support()
     _base_dir = os.path.dirname(os.path.abspath(__file__))
     _target = os.path.join(_base_dir, "crypto-analyzer", "desktop_app.py")
     if os.path.exists(_target):
@@ -0,0 +1,104 @@
+"""
+Сканер рынков из командной строки.
+Прогоняет индикаторы и подтверждения по списку пар (или топу по объему) и печатает
+таблицу сигналов, отсортированную по рейтингу надежности и R:R.
+
+Примеры:
+    python market_scanner.py --symbols BTC/USDT,ETH/USDT,SOL/USDT
+    python market_scanner.py --top 100 --strategy aggressive --trading-type swing --json
+"""
+import os
+import sys
+import json
+import argparse
+
+# Добавляем путь к проекту
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from trading_app import SCAN_WORKERS, STRATEGY_INPUT_MAP, TRADING_TYPE_INPUT_MAP, scan_markets, top_symbols_by_volume
+
+COLUMNS = [
+    ("symbol", "Пара", 14),
+    ("direction", "Напр.", 6),
+    ("reliability_rating", "Надежн.%", 9),
+    ("rr", "R:R", 6),
+    ("price", "Цена", 12),
+    ("entry", "Вход", 12),
+    ("stop_loss", "SL", 12),
+    ("take_profit", "TP", 12),
+    ("rsi", "RSI", 6),
+    ("adx", "ADX", 6),
+]
+
+
+def _cell(value, width):
+    if value is None:
+        text = "-"
+    elif isinstance(value, float):
+        text = f"{value:.6g}"
+    else:
+        text = str(value)
+    return text[:width].ljust(width)
+
+
+def format_table(results, limit=None):
+    """Таблица результатов скана для вывода в консоль."""
+    rows = results[:limit] if limit else results
+    lines = [" ".join(title.ljust(width) for _, title, width in COLUMNS)]
+    lines.append(" ".join("-" * width for _, _, width in COLUMNS))
+    for row in rows:
+        lines.append(" ".join(_cell(row.get(key), width) for key, _, width in COLUMNS))
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Скан рынков: сигналы по списку пар без отчетов и графиков")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--symbols", help="Пары через запятую: BTC/USDT,ETH/USDT")
+    source.add_argument("--top", type=int, help="Взять N самых ликвидных пар по объему за 24 часа")
+    parser.add_argument("--quote", default="USDT", help="Валюта котировки для --top")
+    parser.add_argument("--strategy", default="balanced", help="conservative / balanced / aggressive")
+    parser.add_argument("--trading-type", default="daytrading",
+                        help="scalping / daytrading / swing / medium_term / long_term")
+    parser.add_argument("--timeframe", help="Таймфрейм (по умолчанию - из типа торговли)")
+    parser.add_argument("--confirmation", default="ALL", help="Подтверждения: ALL или EMA+RSI+...")
+    parser.add_argument("--min-reliability", type=float, default=0, help="Минимальный рейтинг надежности, %%")
+    parser.add_argument("--workers", type=int, default=SCAN_WORKERS, help="Сколько рынков обрабатывать одновременно")
+    parser.add_argument("--limit", type=int, help="Показать только первые N строк")
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.symbols:
+        symbols = [s for s in args.symbols.split(",") if s.strip()]
+    else:
+        symbols = top_symbols_by_volume(args.top, quote=args.quote)
+
+    scan = scan_markets(
+        symbols,
+        strategy=STRATEGY_INPUT_MAP.get(args.strategy, args.strategy),
+        trading_type=TRADING_TYPE_INPUT_MAP.get(args.trading_type, args.trading_type),
+        timeframe=args.timeframe,
+        confirmation=args.confirmation,
+        min_reliability=args.min_reliability,
+        max_workers=args.workers,
+    )
+
+    if args.json:
+        if args.limit:
+            scan["results"] = scan["results"][:args.limit]
+        print(json.dumps(scan, ensure_ascii=False, indent=2))
+        return 0
+
+    print(format_table(scan["results"], args.limit))
+    print(f"\n✅ Просканировано {scan['scanned']} пар ({scan['timeframe']}) за {scan['elapsed']} сек, "
+          f"сигналов: {len(scan['results'])}")
+    for symbol, error in scan["errors"].items():
+        print(f"⚠️ {symbol}: {error}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
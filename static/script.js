@@ -172,7 +172,8 @@ let userPlan = null;
 let lastAnalysisParams = null; // Параметры последнего анализа
 let lastAnalysisData = null; // Данные последнего анализа
 let lastReportMarkdown = null; // Markdown отчета с ключами переводов
-let lastReportsByLanguage = null; // ✅ Отчеты на всех трех языках {"ru": "...", "en": "...", "uk": "..."}
+let lastReportsByLanguage = null; // ✅ Уже отрисованные версии отчета {"ru": "...", "en": "..."}
+let lastReportId = null; // id отчета на сервере: другие языки отрисовываются через /api/translate_report
 
 function getSelectedConfirmationsFromCheckboxes(containerId) {
   const container = document.getElementById(containerId);
@@ -306,6 +307,38 @@ function updateTranslations() {
   }
 }
 
+// ✅ Сохранение ZIP отчета: десктоп-приложение - из base64, браузер - по ссылке на файл анализа
+async function saveAnalysisZip(data) {
+  if (window.pyjs && typeof window.pyjs.saveZipFile === "function" && data.zip_base64) {
+    const res = await window.pyjs.saveZipFile(data.zip_base64, "analysis_report.zip");
+    if (res === "ok") {
+      showToast("📦 ZIP-файл сохранён", "success");
+    } else {
+      showToast(t('save_cancelled') || "⚠️ Сохранение отменено", "error");
+    }
+    return;
+  }
+  let url = data.zip_url ? `${data.zip_url}?download=analysis_report.zip` : null;
+  let objectUrl = null;
+  if (!url) {
+    const bin = atob(data.zip_base64);
+    const bytes = new Uint8Array(bin.length);
+    for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+    objectUrl = URL.createObjectURL(new Blob([bytes], { type: "application/zip" }));
+    url = objectUrl;
+  }
+  const a = document.createElement("a");
+  a.href = url;
+  a.download = "analysis_report.zip";
+  document.body.appendChild(a);
+  a.click();
+  document.body.removeChild(a);
+  if (objectUrl) {
+    URL.revokeObjectURL(objectUrl);
+  }
+  showToast("📦 ZIP-файл загружен", "success");
+}
+
 // ✅ НОВОЕ: Перегенерация отчетов при смене языка
 async function regenerateReportsOnLanguageChange() {
   // Проверяем, есть ли уже сгенерированный отчет
@@ -324,6 +357,29 @@ async function regenerateReportsOnLanguageChange() {
     return; // Мгновенное переключение без запросов к серверу
   }
   
+  // ✅ Отрисовка сохраненного отчета на новом языке без повторного анализа
+  if (lastReportId || lastReportMarkdown) {
+    try {
+      const response = await fetch('/api/translate_report', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(lastReportId
+          ? { report_id: lastReportId, language: currentLanguage }
+          : { markdown: lastReportMarkdown, language: currentLanguage })
+      });
+      const data = await response.json();
+      if (response.ok && data.translated) {
+        lastReportsByLanguage = { ...(lastReportsByLanguage || {}), [currentLanguage]: data.translated };
+        reportText.innerHTML = renderReport(data.translated);
+        showToast(t('language_changed') || '✅ Язык изменен', 'success');
+        return;
+      }
+      console.warn('Отчет не найден на сервере, перегенерация через /api/analyze:', data.error);
+    } catch (e) {
+      console.warn('Ошибка перевода отчета:', e);
+    }
+  }
+  
   // ✅ Fallback: Перегенерируем отчет ПОЛНОСТЬЮ через /api/analyze с новым языком
   // Это необходимо, если предсгенерированные отчеты недоступны
   if (lastAnalysisParams) {
@@ -363,8 +419,9 @@ async function regenerateReportsOnLanguageChange() {
       // Обновляем отчет
     if (data.report_text) {
         // ✅ Сохраняем сырой markdown С КЛЮЧАМИ для будущих операций
-        lastReportMarkdown = data.report_markdown_raw || data.report_text;
-        // ✅ Сохраняем отчеты на всех языках, если они есть
+        lastReportMarkdown = data.report_markdown_raw || null;
+        lastReportId = data.report_id || null;
+        // ✅ Сохраняем уже отрисованные версии отчета
         if (data.reports_by_language) {
           lastReportsByLanguage = data.reports_by_language;
         }
@@ -373,10 +430,10 @@ async function regenerateReportsOnLanguageChange() {
       }
       
       // ✅ Обновляем график отчета, если он есть
-      if (data.chart_base64) {
-        const chartImg = document.querySelector('#result img[src*="data:image"]');
+      if (data.chart_url || data.chart_base64) {
+        const chartImg = document.querySelector('#result img[src*="data:image"], #result img[src*="/api/artifacts/"]');
         if (chartImg) {
-          chartImg.src = `data:image/png;base64,${data.chart_base64}`;
+          chartImg.src = data.chart_url || `data:image/png;base64,${data.chart_base64}`;
         }
       }
       
@@ -421,32 +478,14 @@ async function regenerateReportsOnLanguageChange() {
       
       // ✅ Активируем кнопку скачивания отчета после перегенерации
       const downloadBtn = document.getElementById('downloadZip');
-      if (downloadBtn && data.zip_base64) {
+      if (downloadBtn && (data.zip_url || data.zip_base64)) {
         downloadBtn.disabled = false;
         downloadBtn.classList.remove('disabled-free');
         // Обновляем обработчик для нового ZIP
         downloadBtn.onclick = async (e) => {
           e.preventDefault();
           try {
-            if (window.pyjs && typeof window.pyjs.saveZipFile === "function") {
-              const res = await window.pyjs.saveZipFile(data.zip_base64 || "", "analysis_report.zip");
-              if (res === "ok") {
-                showToast("📦 ZIP-файл сохранён", "success");
-              } else {
-                showToast(t('save_cancelled') || "⚠️ Сохранение отменено", "error");
-              }
-              return;
-            }
-            const blob = base64ToBlob(data.zip_base64, "application/zip");
-            const url = URL.createObjectURL(blob);
-            const a = document.createElement("a");
-            a.href = url;
-            a.download = "analysis_report.zip";
-            document.body.appendChild(a);
-            a.click();
-            document.body.removeChild(a);
-            URL.revokeObjectURL(url);
-            showToast("📦 ZIP-файл загружен", "success");
+            await saveAnalysisZip(data);
           } catch (err) {
             console.error("Ошибка скачивания:", err);
             showToast("⚠️ Не удалось сохранить файл", "error");
@@ -2648,15 +2687,6 @@ document.addEventListener("DOMContentLoaded", () => {
     console.warn("Demo report elements not found:", { demoReportEl: !!demoReportEl, reportText: !!reportText });
   }
 
-  // === base64 → Blob ===
-  function base64ToBlob(base64, type = "application/octet-stream") {
-    const bin = atob(base64);
-    const len = bin.length;
-    const bytes = new Uint8Array(len);
-    for (let i = 0; i < len; i++) bytes[i] = bin.charCodeAt(i);
-    return new Blob([bytes], { type });
-  }
-
   // === Запуск анализа ===
   analyzeBtn.addEventListener("click", async () => {
     const symbol = document.getElementById("symbol").value;
@@ -2721,6 +2751,8 @@ document.addEventListener("DOMContentLoaded", () => {
           backtest_days: backtestDays,
           enable_trailing: enableTrailing,
           trailing_percent: trailingPercent,
+          // Десктоп-приложение сохраняет ZIP из base64, браузеру достаточно ссылок на файлы
+          inline_artifacts: !!(window.pyjs && typeof window.pyjs.saveZipFile === "function"),
         language: currentLanguage // ✅ Сохраняем язык
       };
       
@@ -2737,10 +2769,10 @@ document.addEventListener("DOMContentLoaded", () => {
       if (!data.error) {
         lastAnalysisParams = analysisParams;
         lastAnalysisData = data;
-        // ✅ Сохраняем отчеты на всех языках для мгновенного переключения
+        // ✅ Сохраняем отрисованный отчет; другие языки - по report_id при переключении
+        lastReportId = data.report_id || null;
         if (data.reports_by_language) {
           lastReportsByLanguage = data.reports_by_language;
-          console.log('✅ Сохранены отчеты на всех языках:', Object.keys(data.reports_by_language));
         }
       }
 
@@ -2769,8 +2801,8 @@ document.addEventListener("DOMContentLoaded", () => {
 
       if (data.report_text) {
         // ✅ Сохраняем сырой markdown С КЛЮЧАМИ для перегенерации при смене языка
-        // Используем report_markdown_raw если есть, иначе fallback на report_text
-        lastReportMarkdown = data.report_markdown_raw || data.report_text;
+        // report_markdown_raw приходит только при отключенном хранилище отчетов (иначе - report_id)
+        lastReportMarkdown = data.report_markdown_raw || null;
         reportText.innerHTML = renderReport(data.report_text);
 
         result.classList.remove("demo");
@@ -2874,7 +2906,7 @@ document.addEventListener("DOMContentLoaded", () => {
         }
 
         // ИСПРАВЛЕНО: Кнопка "Скачать ZIP" доступна всем после успешного анализа (только если есть данные)
-        if (downloadBtn && data.zip_base64) {
+        if (downloadBtn && (data.zip_url || data.zip_base64)) {
         downloadBtn.disabled = false;
           // Удаляем класс disabled-free, если он есть (может быть установлен при инициализации)
           downloadBtn.classList.remove('disabled-free');
@@ -2911,29 +2943,11 @@ document.addEventListener("DOMContentLoaded", () => {
         analyzeBtn.textContent = originalBtnText;
 
         // === Скачать ZIP отчёт ===
-        if (downloadBtn && data.zip_base64) {
+        if (downloadBtn && (data.zip_url || data.zip_base64)) {
         downloadBtn.onclick = async (e) => {
           e.preventDefault();
           try {
-            if (window.pyjs && typeof window.pyjs.saveZipFile === "function") {
-              const res = await window.pyjs.saveZipFile(data.zip_base64 || "", "analysis_report.zip");
-              if (res === "ok") {
-                showToast("📦 ZIP-файл сохранён", "success");
-              } else {
-                showToast(t('save_cancelled') || "⚠️ Сохранение отменено", "error");
-              }
-              return;
-            }
-            const blob = base64ToBlob(data.zip_base64, "application/zip");
-            const url = URL.createObjectURL(blob);
-            const a = document.createElement("a");
-            a.href = url;
-            a.download = "analysis_report.zip";
-            document.body.appendChild(a);
-            a.click();
-            document.body.removeChild(a);
-            URL.revokeObjectURL(url);
-            showToast("📦 ZIP-файл загружен", "success");
+            await saveAnalysisZip(data);
           } catch (err) {
             console.error("Ошибка скачивания:", err);
             showToast("⚠️ Не удалось сохранить файл", "error");
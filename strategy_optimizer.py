@@ -0,0 +1,312 @@
+"""
+Оптимизатор параметров стратегий (перебор по сетке) с walk-forward проверкой.
+
+Перебирает atr_sl, atr_tp, entry_type, ema_buffer и наборы подтверждений на одном
+кадре индикаторов. Массивы бэктеста (_backtest_arrays) считаются один раз и
+передаются каждому процессу пула при запуске, задачи - это только пачки
+комбинаций параметров. Каждая комбинация оценивается на всей истории, на
+обучающих и на тестовых (out-of-sample) окнах walk-forward.
+
+Пример:
+    python strategy_optimizer.py --symbol BTC/USDT --trading-type swing \\
+        --atr-sl 1,1.2,1.5,2 --atr-tp 1.5,1.8,2.5,3 --entry-type ema20,ema50,close \\
+        --confirm-pool EMA,RSI,MACD,ADX,SUPERTREND --confirm-size 1-3 --folds 4 --top 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Добавляем путь к проекту
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from trading_app import (
+    STRATEGIES, CONFIRMATION_INDICATORS, TRADING_TYPE_INPUT_MAP, build_indicator_frame, fetch_ohlcv, market_params,
+    _backtest_arrays, _run_backtest, _slice_arrays, walk_forward_split,
+)
+
+OPTIMIZER_WORKERS = int(os.getenv("OPTIMIZER_WORKERS", str(os.cpu_count() or 2)))
+GRID_KEYS = ("atr_sl", "atr_tp", "entry_type", "ema_buffer")
+SCORE_METRICS = ("total_profit_pct", "win_rate", "profit_to_drawdown")
+BACKTEST_START = 100
+
+# Массивы и настройки процесса пула (заполняются initializer один раз на процесс)
+_WORKER_STATE = {}
+
+
+def confirmation_subsets(pool, min_size=1, max_size=None):
+    """
+    Все наборы подтверждений из pool размером от min_size до max_size.
+
+    Возвращает:
+    - список кортежей, например [("EMA",), ("EMA", "RSI"), ...]
+    """
+    pool = [p.strip().upper() for p in pool if p and p.strip()]
+    max_size = min(max_size or len(pool), len(pool))
+    subsets = []
+    for size in range(max(1, min_size), max_size + 1):
+        subsets.extend(itertools.combinations(pool, size))
+    return subsets
+
+
+def parameter_grid(base_strategy="Сбалансированная", confirmations=None, **grid):
+    """
+    Комбинации параметров стратегии.
+
+    Параметры:
+    - base_strategy: профиль из STRATEGIES, параметры которого не перебираются
+    - confirmations: список наборов подтверждений (кортежи или строки "EMA+RSI")
+    - grid: списки значений для atr_sl, atr_tp, entry_type, ema_buffer
+
+    Возвращает:
+    - список dict: {"strategy": {...}, "confirmation": (...)}
+    """
+    base = STRATEGIES.get(base_strategy, STRATEGIES["Сбалансированная"])
+    keys = [k for k in GRID_KEYS if grid.get(k)]
+    values = [list(grid[k]) for k in keys]
+    confirmations = confirmations or [("ALL",)]
+    combos = []
+    for point in itertools.product(*values):
+        strat = dict(base)
+        strat.update(zip(keys, point))
+        for conf in confirmations:
+            if isinstance(conf, str):
+                conf = tuple(s.strip().upper() for s in conf.split("+") if s.strip())
+            combos.append({"strategy": strat, "confirmation": tuple(conf)})
+    return combos
+
+
+def _score(result, metric):
+    if not result or not result.get("total_trades"):
+        return 0.0
+    if metric == "win_rate":
+        return float(result["win_rate"])
+    if metric == "profit_to_drawdown":
+        return float(result["total_profit_pct"]) / max(float(result["max_drawdown"]), 1.0)
+    return float(result["total_profit_pct"])
+
+
+def _init_worker(arrays, windows, settings):
+    _WORKER_STATE["arrays"] = arrays
+    _WORKER_STATE["windows"] = windows
+    _WORKER_STATE["settings"] = settings
+    # Обучающие окна: срезы общих массивов, считаются один раз на процесс
+    _WORKER_STATE["train_arrays"] = {stop: _slice_arrays(arrays, stop) for _, stop, _, _ in windows}
+
+
+def _summary(result):
+    """Метрики прогона без кривой капитала (она не нужна для ранжирования)."""
+    if not result:
+        return {"total_trades": 0, "win_rate": 0.0, "total_profit_pct": 0.0, "max_drawdown": 0.0}
+    return {
+        "total_trades": result["total_trades"],
+        "win_rate": round(float(result["win_rate"]), 2),
+        "total_profit_pct": result["total_profit_pct"],
+        "max_drawdown": result["max_drawdown"],
+    }
+
+
+def evaluate_combo(combo, arrays, windows, settings, train_arrays=None):
+    """
+    Оценка одной комбинации: вся история + обучающие и тестовые окна walk-forward.
+
+    Возвращает:
+    - dict с параметрами, метриками full/train/test и оценкой score
+    """
+    strat = combo["strategy"]
+    selected = list(combo["confirmation"])
+    run = lambda arr, start, stop: _run_backtest(
+        arr, strat, selected, settings["capital"], settings["risk"], settings["commission"],
+        settings["spread"], start=start, stop=stop, verbose=False,
+    )
+    metric = settings["metric"]
+    full = run(arrays, BACKTEST_START, arrays["n"] - 1)
+    train, test = [], []
+    for train_start, train_stop, test_start, test_stop in windows:
+        train_arr = train_arrays[train_stop] if train_arrays else _slice_arrays(arrays, train_stop)
+        train.append(_summary(run(train_arr, train_start, train_stop - 1)))
+        test.append(_summary(run(arrays, test_start, test_stop)))
+
+    test_trades = sum(w["total_trades"] for w in test)
+    test_wins = sum(w["total_trades"] * w["win_rate"] / 100 for w in test)
+    row = {
+        "params": {k: strat[k] for k in GRID_KEYS if k in strat},
+        "confirmation": "+".join(selected),
+        "full": _summary(full),
+        "score_full": round(_score(full, metric), 4),
+        "train": train,
+        "test": test,
+    }
+    if windows:
+        row["score_train"] = round(sum(_score(w, metric) for w in train) / len(train), 4)
+        row["score_test"] = round(sum(_score(w, metric) for w in test) / len(test), 4)
+        row["test_trades"] = test_trades
+        row["test_win_rate"] = round(test_wins / test_trades * 100, 2) if test_trades else 0.0
+        row["test_profitable_windows"] = sum(1 for w in test if w["total_profit_pct"] > 0)
+    return row
+
+
+def _evaluate_chunk(chunk):
+    state = _WORKER_STATE
+    return [
+        (index, evaluate_combo(combo, state["arrays"], state["windows"], state["settings"], state["train_arrays"]))
+        for index, combo in chunk
+    ]
+
+
+def optimize(df, combos, folds=4, train_ratio=0.7, anchored=False, metric="total_profit_pct",
+             capital=10000, risk=0.01, commission=0.001, spread=0.0, max_workers=None, chunk_size=None):
+    """
+    Перебор комбинаций на кадре индикаторов (build_indicator_frame) в пуле процессов.
+
+    Параметры:
+    - combos: результат parameter_grid
+    - folds: количество тестовых окон walk-forward (0 - только вся история)
+    - train_ratio: доля обучающего окна в паре "обучение + тест"
+    - anchored: растущее обучающее окно вместо скользящего
+    - metric: total_profit_pct, win_rate или profit_to_drawdown
+
+    Возвращает:
+    - dict: results (по убыванию score_test, при folds=0 - score_full), walk_forward
+      (лучшая на обучении комбинация каждого окна и ее результат на тесте), windows, elapsed
+    """
+    if metric not in SCORE_METRICS:
+        raise ValueError(f"metric должен быть одним из {SCORE_METRICS}")
+    started = time.monotonic()
+    arrays = _backtest_arrays(df)
+    n = arrays["n"]
+
+    windows = walk_forward_split(n, folds, train_ratio, start=BACKTEST_START, anchored=anchored)
+    settings = {"capital": capital, "risk": risk, "commission": commission, "spread": spread, "metric": metric}
+
+    indexed = list(enumerate(combos))
+    workers = max(1, int(max_workers or OPTIMIZER_WORKERS))
+    rows = [None] * len(indexed)
+    if workers == 1 or len(indexed) < 2:
+        train_arrays = {stop: _slice_arrays(arrays, stop) for _, stop, _, _ in windows}
+        for index, combo in indexed:
+            rows[index] = evaluate_combo(combo, arrays, windows, settings, train_arrays)
+    else:
+        chunk_size = chunk_size or max(1, min(64, len(indexed) // (workers * 4) or 1))
+        chunks = [indexed[i:i + chunk_size] for i in range(0, len(indexed), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(arrays, windows, settings)) as pool:
+            for future in as_completed([pool.submit(_evaluate_chunk, chunk) for chunk in chunks]):
+                for index, row in future.result():
+                    rows[index] = row
+
+    sort_key = "score_test" if windows else "score_full"
+    ranked = sorted(rows, key=lambda r: (r[sort_key], r["score_full"]), reverse=True)
+
+    # Walk-forward выбор: в каждом окне берем лучшую на обучении комбинацию и смотрим ее тест
+    walk_forward = []
+    for w, (train_start, train_stop, test_start, test_stop) in enumerate(windows):
+        best = max(rows, key=lambda r: _score(r["train"][w], metric))
+        walk_forward.append({
+            "window": [train_start, train_stop, test_start, test_stop],
+            "params": best["params"],
+            "confirmation": best["confirmation"],
+            "train": best["train"][w],
+            "test": best["test"][w],
+        })
+
+    return {
+        "combinations": len(rows),
+        "metric": metric,
+        "windows": [list(w) for w in windows],
+        "results": ranked,
+        "walk_forward": walk_forward,
+        "elapsed": round(time.monotonic() - started, 3),
+    }
+
+
+def format_table(results, limit=20, walk_forward=True):
+    """Таблица лучших комбинаций для вывода в консоль."""
+    header = f"{'#':>3} {'atr_sl':>6} {'atr_tp':>6} {'entry':>6} {'buffer':>7} {'подтверждения':<28} " \
+             f"{'сделок':>6} {'win%':>6} {'прибыль%':>9} {'DD%':>6}"
+    if walk_forward:
+        header += f" {'OOS score':>9} {'OOS win%':>8} {'окна+':>5}"
+    lines = [header, "-" * len(header)]
+    for i, row in enumerate(results[:limit], 1):
+        p = row["params"]
+        full = row["full"]
+        line = (f"{i:>3} {p.get('atr_sl', ''):>6} {p.get('atr_tp', ''):>6} {str(p.get('entry_type', '')):>6} "
+                f"{p.get('ema_buffer', ''):>7} {row['confirmation'][:28]:<28} {full['total_trades']:>6} "
+                f"{full['win_rate']:>6.1f} {full['total_profit_pct']:>9.2f} {full['max_drawdown']:>6.2f}")
+        if walk_forward and "score_test" in row:
+            line += f" {row['score_test']:>9.2f} {row['test_win_rate']:>8.1f} " \
+                    f"{row['test_profitable_windows']:>2}/{len(row['test']):<2}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _float_list(value):
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Перебор параметров стратегии с walk-forward проверкой")
+    parser.add_argument("--symbol", required=True, help="Пара, например BTC/USDT")
+    parser.add_argument("--strategy", default="Сбалансированная", help="Базовый профиль из STRATEGIES")
+    parser.add_argument("--trading-type", default="daytrading",
+                        help="scalping / daytrading / swing / medium_term / long_term")
+    parser.add_argument("--timeframe", help="Таймфрейм (по умолчанию - из типа торговли)")
+    parser.add_argument("--days", type=int, help="Глубина истории в днях (по умолчанию - двойная глубина анализа)")
+    parser.add_argument("--atr-sl", type=_float_list, default=[1.0, 1.2, 1.5, 2.0])
+    parser.add_argument("--atr-tp", type=_float_list, default=[1.5, 1.8, 2.5, 3.0])
+    parser.add_argument("--entry-type", default="ema20,ema50,close")
+    parser.add_argument("--ema-buffer", type=_float_list, default=[0.0, 0.0007, 0.001])
+    parser.add_argument("--confirm-pool", default=",".join(CONFIRMATION_INDICATORS[:6]),
+                        help="Подтверждения для перебора наборов")
+    parser.add_argument("--confirm-size", default="1-2", help="Размер набора подтверждений: N или MIN-MAX")
+    parser.add_argument("--folds", type=int, default=4, help="Количество тестовых окон walk-forward (0 - без них)")
+    parser.add_argument("--train-ratio", type=float, default=0.7)
+    parser.add_argument("--anchored", action="store_true", help="Растущее обучающее окно")
+    parser.add_argument("--metric", default="total_profit_pct", choices=SCORE_METRICS)
+    parser.add_argument("--workers", type=int, default=OPTIMIZER_WORKERS)
+    parser.add_argument("--top", type=int, default=20, help="Сколько лучших комбинаций показать")
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    trading_type = TRADING_TYPE_INPUT_MAP.get(args.trading_type, args.trading_type)
+    timeframe, range_days = market_params(trading_type, args.timeframe)
+    days = args.days or range_days * 2
+    df = fetch_ohlcv(args.symbol, timeframe, history_days=days)
+    if df.empty:
+        print(f"❌ Нет данных для {args.symbol} {timeframe}")
+        return 1
+    df = build_indicator_frame(df, args.symbol, timeframe)
+
+    min_size, _, max_size = args.confirm_size.partition("-")
+    subsets = confirmation_subsets(args.confirm_pool.split(","), int(min_size), int(max_size or min_size))
+    combos = parameter_grid(
+        args.strategy, subsets,
+        atr_sl=args.atr_sl, atr_tp=args.atr_tp, ema_buffer=args.ema_buffer,
+        entry_type=[e.strip() for e in args.entry_type.split(",") if e.strip()],
+    )
+    print(f"🔧 {args.symbol} {timeframe}: {len(df)} свечей, {len(combos)} комбинаций, процессов: {args.workers}",
+          file=sys.stderr)
+
+    result = optimize(df, combos, folds=args.folds, train_ratio=args.train_ratio, anchored=args.anchored,
+                      metric=args.metric, max_workers=args.workers)
+    if args.json:
+        result["results"] = result["results"][:args.top]
+        print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+        return 0
+
+    print(format_table(result["results"], args.top, walk_forward=bool(result["windows"])))
+    for wf in result["walk_forward"]:
+        print(f"🔁 Окно {wf['window']}: {wf['params']} {wf['confirmation']} -> "
+              f"обучение {wf['train']['total_profit_pct']:+.2f}%, тест {wf['test']['total_profit_pct']:+.2f}%")
+    print(f"\n✅ {result['combinations']} комбинаций за {result['elapsed']} сек")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
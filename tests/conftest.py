@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Общие фикстуры тестов: корень проекта в sys.path, генератор свечей, биржа-заглушка и замеры (--benchmark)."""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+HOUR_MS = 60 * 60 * 1000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def make_ohlcv(n, seed=0, start="2024-01-01", freq="1h", decimals=None):
+    """
+    Случайные свечи OHLCV (случайное блуждание).
+
+    Параметры:
+    - n: количество свечей
+    - seed: зерно генератора
+    - decimals: округление цен (для совпадающих максимумов/минимумов)
+    """
+    rng = np.random.default_rng(seed)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    open_ = np.concatenate([close[:1], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.006, n)) * close
+    high = np.maximum(open_, close) + spread
+    low = np.minimum(open_, close) - spread
+    if decimals is not None:
+        open_, high, low, close = (np.round(a, decimals) for a in (open_, high, low, close))
+    volume = rng.uniform(10, 1000, n)
+    index = pd.date_range(start, periods=n, freq=freq, tz="UTC")
+    return pd.DataFrame({"Open": open_, "High": high, "Low": low, "Close": close, "Volume": volume}, index=index)
+
+
+class StubExchange:
+    """Биржа-заглушка: фиксированные часовые свечи на символ (до текущего часа) и тикеры с объемом."""
+
+    id = "stubex"
+
+    def __init__(self, symbols, n_bars=1000):
+        last = int(time.time() * 1000) // HOUR_MS * HOUR_MS
+        self.bars = {}
+        for seed, symbol in enumerate(symbols):
+            df = make_ohlcv(n_bars, seed=seed)
+            ts = [last - (n_bars - 1 - k) * HOUR_MS for k in range(n_bars)]
+            self.bars[symbol] = [[t, *row] for t, row in zip(ts, df.to_numpy().tolist())]
+
+    def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None):
+        if symbol not in self.bars:
+            raise ValueError(f"unknown symbol {symbol}")
+        assert timeframe == "1h"
+        return [bar for bar in self.bars[symbol] if since is None or bar[0] >= since][:limit]
+
+    def fetch_tickers(self):
+        tickers = {symbol: {"quoteVolume": 1000.0 * (k + 1)} for k, symbol in enumerate(self.bars)}
+        tickers["BTC/EUR"] = {"quoteVolume": 1e12}
+        tickers["BTC/USDT:USDT"] = {"quoteVolume": 1e12}
+        return tickers
+
+
+def best_time(fn, repeat=5):
+    """Лучшее из repeat времен выполнения fn() в секундах (для тестов-замеров)."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def pytest_addoption(parser):
+    parser.addoption("--benchmark", action="store_true", help="Запустить тесты-замеры (@pytest.mark.benchmark)")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: замер прежней реализации против новой (только с --benchmark)")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="замер: запускается с --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def ohlcv():
+    return make_ohlcv
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """
+    Модуль app на временной SQLite и временных хранилищах (импортируется один раз за сессию).
+    """
+    root = tmp_path_factory.mktemp("app")
+    os.environ["DATABASE_URL"] = f"sqlite:///{root / 'app.db'}"
+    os.environ["ARTIFACT_STORE_PATH"] = str(root / "artifacts")
+    os.environ["JOB_QUEUE_PATH"] = str(root / "jobs.db")
+    os.environ.pop("KLINE_STREAM_SUBSCRIPTIONS", None)
+    import app
+    return app
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""/api/artifacts: файлы анализа отдаются только владельцу."""
+
+import json
+import os
+import time
+
+import pytest
+
+import trading_app
+from core.artifact_store import ArtifactStore
+from core.indicator_cache import IndicatorCache
+
+
+def test_store_records_owners_per_file(tmp_path):
+    store = ArtifactStore(str(tmp_path), ttl_seconds=60)
+    first = store.put(b"chart", "png", owner="user:1")
+    # Тот же файл у второго владельца - тот же id, оба владельца записаны
+    assert store.put(b"chart", "png", owner="demo:abc") == first
+    assert store.is_owner(first, "user:1") and store.is_owner(first, "demo:abc")
+    assert not store.is_owner(first, "user:2") and not store.is_owner(first, None)
+    assert not store.is_owner(store.put(b"other", "png"), "user:1")
+    # Метка владельца живет столько же, сколько файл
+    stale = time.time() - 120
+    for path in tmp_path.rglob("*.owner"):
+        os.utime(path, (stale, stale))
+    assert not store.is_owner(first, "user:1")
+    assert store.cleanup() == 2 and not list(tmp_path.rglob("*.owner"))
+
+
+@pytest.fixture
+def client(app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, "ARTIFACT_STORE", ArtifactStore(str(tmp_path)))
+    monkeypatch.setattr(app_module, "FRAME_CACHE", IndicatorCache(max_entries=2, ttl_seconds=3600))
+    return app_module.app.test_client()
+
+
+def login(client, user_id):
+    with client.session_transaction() as sess:
+        sess.clear()
+        if user_id is not None:
+            sess["user_id"] = user_id
+
+
+def test_download_only_for_owner(app_module, client):
+    ref = app_module._artifact_ref(b"report", "txt", "user:1")
+    login(client, 1)
+    response = client.get(ref["url"])
+    assert response.status_code == 200 and response.data == b"report"
+    login(client, 2)
+    assert client.get(ref["url"]).status_code == 404
+    login(client, None)
+    assert client.get(ref["url"]).status_code == 404
+
+
+def test_demo_session_owns_its_files(app_module, client):
+    login(client, None)
+    with client.session_transaction() as sess:
+        sess["job_owner"] = "token"
+    ref = app_module._artifact_ref(b"chart", "png", "demo:token")
+    assert client.get(ref["url"]).status_code == 200
+    login(client, None)
+    assert client.get(ref["url"]).status_code == 404
+
+
+def test_exports_check_owner_of_source(app_module, client, ohlcv):
+    owner = "user:7"
+    frame_ref = app_module._frame_ref(trading_app.build_indicator_frame(ohlcv(40)), owner)
+    report_id = app_module._artifact_ref(b"report", "txt", owner)["id"]
+    bundle = json.dumps({"report": report_id, "chart": None, "frame": frame_ref["id"]}, sort_keys=True)
+    bundle_ref = app_module._artifact_ref(bundle.encode("utf-8"), "json", owner)
+    login(client, 8)
+    assert client.get(f"{frame_ref['url']}/csv").status_code == 404
+    assert client.get(f"{bundle_ref['url']}/zip").status_code == 404
+    login(client, 7)
+    csv = client.get(f"{frame_ref['url']}/csv")
+    assert csv.status_code == 200 and csv.data.startswith(b",Open")
+    assert client.get(f"{bundle_ref['url']}/zip").status_code == 200
+    # Производный файл напрямую по id не отдается никому: владелец записан только у источника
+    csv_id = frame_ref["id"].replace(".frame", ".csv")
+    assert app_module.ARTIFACT_STORE.path(csv_id) is not None
+    assert client.get(f"/api/artifacts/{csv_id}").status_code == 404
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""run_bounded: зависшая задача не плодит потоки на следующих тиках."""
+
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def worker(app_module):
+    import auto_signals_worker
+    yield auto_signals_worker
+    auto_signals_worker._ABANDONED.clear()
+
+
+def test_hung_key_is_busy_until_its_thread_finishes(worker):
+    release = threading.Event()
+    calls = []
+
+    def func(key, cancelled):
+        calls.append(key)
+        if key == "hung":
+            release.wait(10)
+        return "ok"
+
+    far = time.monotonic() + 60
+    assert worker.run_bounded(["hung", "a"], func, 2, 0.2, far, label="t") == {"hung": "timeout", "a": "ok"}
+    assert worker.abandoned_threads() == 1
+    threads = threading.active_count()
+    # Следующие тики: новый поток для зависшего ключа не запускается, остальные ключи работают
+    for _ in range(3):
+        assert worker.run_bounded(["hung", "a"], func, 2, 0.2, far, label="t") == {"hung": "busy", "a": "ok"}
+    assert calls.count("hung") == 1 and calls.count("a") == 4
+    assert threading.active_count() <= threads
+    # Поток завершился - ключ снова запускается
+    release.set()
+    deadline = time.monotonic() + 5
+    while worker.abandoned_threads() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert worker.abandoned_threads() == 0
+    assert worker.run_bounded(["hung"], func, 1, 5, far, label="t") == {"hung": "ok"}
+    assert calls.count("hung") == 2
+
+
+def test_busy_market_marks_its_users(worker, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(worker, "prepare_market", lambda market: release.wait(10))
+    monkeypatch.setattr(worker, "process_user", lambda user_id, cancelled, market_df=None: "ok")
+    market = ("BTC/USDT", "1h", 30)
+    try:
+        assert worker.run_due_users([(1, market)], 2, 0.2, 60) == {1: "timeout"}
+        assert worker.run_due_users([(1, market), (2, market)], 2, 0.2, 60) == {1: "busy", 2: "busy"}
+    finally:
+        release.set()
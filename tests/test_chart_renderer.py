@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""ChartRenderer: PNG через пул процессов (spawn), кэш и отрисовка в текущем процессе."""
+
+import pytest
+
+from core.chart_renderer import ChartRenderer, chart_spec, render_png
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def make_spec(df, title="BTC/USDT"):
+    return chart_spec(
+        df.index,
+        [("Close", df["Close"], {"lw": 1.5}), ("Open", df["Open"], {"alpha": 0.7})],
+        [(float(df["Close"].iloc[-1]), "cyan", 1, "--", "price"), (float(df["High"].max()), "red", 1.5, "--", "SL")],
+        title,
+    )
+
+
+@pytest.fixture
+def pool_renderer():
+    renderer = ChartRenderer(max_workers=1, cache_entries=4, timeout=120)
+    yield renderer
+    renderer.shutdown()
+
+
+def test_pool_renders_with_spawn(pool_renderer, ohlcv):
+    spec = make_spec(ohlcv(120))
+    png = pool_renderer.render(spec).getvalue()
+    assert png.startswith(PNG_SIGNATURE)
+    # Картинка нарисована процессом пула, а не запасным путем в текущем процессе
+    assert pool_renderer.stats()["fallbacks"] == 0
+    assert pool_renderer._pool._mp_context.get_start_method() == "spawn"
+    assert png == render_png(spec)
+
+
+def test_pool_reuses_figure_between_charts(pool_renderer, ohlcv):
+    first = make_spec(ohlcv(120, seed=1), title="A")
+    second = make_spec(ohlcv(60, seed=2), title="B")
+    assert pool_renderer.render(first).getvalue() == render_png(first)
+    assert pool_renderer.render(second).getvalue() == render_png(second)
+    assert pool_renderer.render(first).getvalue() == render_png(first)
+    assert pool_renderer.stats()["fallbacks"] == 0
+
+
+def test_cache_by_key(pool_renderer, ohlcv):
+    spec = make_spec(ohlcv(50))
+    png = pool_renderer.render(spec, key="k").getvalue()
+    assert pool_renderer.render(spec, key="k").getvalue() == png
+    stats = pool_renderer.stats()
+    assert (stats["hits"], stats["misses"], stats["cached"]) == (1, 1, 1)
+
+
+def test_in_process_renderer(ohlcv):
+    renderer = ChartRenderer(max_workers=0)
+    spec = make_spec(ohlcv(50))
+    assert renderer.render(spec).getvalue() == render_png(spec)
+    assert renderer._pool is None
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Постраничная загрузка OHLCV: параллельные страницы, склейка, пропуски и пустые диапазоны."""
+
+import threading
+import time
+
+import pytest
+
+import trading_app
+from core.candle_store import CandleStore
+
+TF = "1h"
+TF_MS = 60 * 60 * 1000
+
+
+class FakeExchange:
+    """
+    Биржа-заглушка в стиле ccxt: бары по расписанию с паузами торгов.
+
+    Параметры:
+    - start_ms, end_ms: первая и последняя свеча
+    - holes: [(от, до)] - диапазоны ts без свечей
+    - latency: задержка ответа (сек)
+    - drop_once: {since: (от, до)} - при первом запросе страницы с since выкинуть бары диапазона
+    - fail_since: since, на котором запрос падает
+    """
+
+    id = "fakeex"
+    rateLimit = 0
+    enableRateLimit = False
+
+    def __init__(self, start_ms, end_ms, holes=(), latency=0.0, drop_once=None, fail_since=None):
+        self.timeline = [ts for ts in range(start_ms, end_ms + 1, TF_MS)
+                         if not any(a <= ts <= b for a, b in holes)]
+        self.latency = latency
+        self.drop_once = dict(drop_once or {})
+        self.fail_since = fail_since
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None):
+        with self._lock:
+            self.calls.append(since)
+        if self.latency:
+            time.sleep(self.latency)
+        if since is not None and since == self.fail_since:
+            raise ValueError("injected page error")
+        bars = [[ts, 1.0, 2.0, 0.5, 1.5, 10.0] for ts in self.timeline if since is None or ts >= since]
+        bars = bars[-limit:] if since is None else bars[:limit]
+        dropped = self.drop_once.pop(since, None)
+        if dropped:
+            bars = [bar for bar in bars if not dropped[0] <= bar[0] <= dropped[1]]
+        return bars
+
+
+@pytest.fixture
+def small_pages(monkeypatch):
+    monkeypatch.setattr(trading_app, "OHLCV_PAGE_LIMIT", 50)
+    monkeypatch.setattr(trading_app, "OHLCV_FETCH_WORKERS", 4)
+    monkeypatch.setattr(trading_app, "CANDLE_STORE", None)
+    return 50
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    candle_store = CandleStore(str(tmp_path / "candles.db"))
+    monkeypatch.setattr(trading_app, "CANDLE_STORE", candle_store)
+    return candle_store
+
+
+START = 1_700_000_000_000 // TF_MS * TF_MS
+END = START + 499 * TF_MS
+
+
+def _timestamps(bars):
+    return [bar[0] for bar in bars]
+
+
+def test_parallel_matches_sequential(small_pages):
+    exchange = FakeExchange(START, END, holes=[(START + 120 * TF_MS, START + 180 * TF_MS)])
+    sequential = trading_app._fetch_ohlcv_sequential(exchange, "X/USDT", TF, START, END + TF_MS)
+    parallel = trading_app._fetch_ohlcv_range(exchange, "X/USDT", TF, START, END + TF_MS)
+    assert parallel == sequential
+    assert _timestamps(parallel) == exchange.timeline
+
+
+def test_parallel_pages_are_ordered_and_deduplicated(small_pages):
+    # Страницы отвечают с задержкой и вразнобой; перекрытия страниц не дают дублей
+    exchange = FakeExchange(START, END, latency=0.01)
+    bars = trading_app._fetch_ohlcv_parallel(exchange, "X/USDT", TF, START, END + TF_MS, None, TF_MS, 4)
+    ts = _timestamps(bars)
+    assert ts == sorted(set(ts)) == exchange.timeline
+
+
+def test_parallel_is_faster_than_sequential(small_pages):
+    exchange = FakeExchange(START, END, latency=0.05)
+    started = time.monotonic()
+    trading_app._fetch_ohlcv_sequential(exchange, "X/USDT", TF, START, END + TF_MS)
+    sequential = time.monotonic() - started
+    started = time.monotonic()
+    trading_app._fetch_ohlcv_range(exchange, "X/USDT", TF, START, END + TF_MS)
+    parallel = time.monotonic() - started
+    assert parallel < sequential * 0.6
+
+
+def test_until_ms_is_respected(small_pages):
+    exchange = FakeExchange(START, END)
+    until = START + 333 * TF_MS
+    bars = trading_app._fetch_ohlcv_range(exchange, "X/USDT", TF, START, END + TF_MS, until_ms=until)
+    assert _timestamps(bars) == [ts for ts in exchange.timeline if ts <= until]
+
+
+def test_dropped_page_slice_is_refetched(small_pages):
+    page_start = START + 100 * TF_MS
+    exchange = FakeExchange(START, END, drop_once={page_start: (page_start + 10 * TF_MS, page_start + 19 * TF_MS)})
+    bars = trading_app._fetch_ohlcv_range(exchange, "X/USDT", TF, START, END + TF_MS)
+    assert _timestamps(bars) == exchange.timeline
+    assert exchange.calls.count(page_start + 10 * TF_MS) == 1
+
+
+def test_page_error_falls_back_to_sequential(small_pages):
+    exchange = FakeExchange(START, END, fail_since=START + 150 * TF_MS)
+    bars = trading_app._fetch_ohlcv_range(exchange, "X/USDT", TF, START, END + TF_MS)
+    assert _timestamps(bars) == exchange.timeline
+
+
+def test_known_empty_gap_is_not_requested_again(small_pages, store):
+    hole = (START + 120 * TF_MS, START + 180 * TF_MS)
+    exchange = FakeExchange(START, END, holes=[hole])
+    first = trading_app._fetch_ohlcv_range(exchange, "X/USDT", TF, START, END + TF_MS)
+    gap_requests = exchange.calls.count(hole[0])
+    assert gap_requests == 1
+    assert store.empty_until("fakeex", "X/USDT", TF, hole[0]) >= hole[1]
+
+    exchange.calls.clear()
+    second = trading_app._fetch_ohlcv_range(exchange, "X/USDT", TF, START, END + TF_MS)
+    assert second == first
+    assert hole[0] not in exchange.calls
+
+
+def test_partially_filled_gap_marks_only_empty_part(small_pages, store):
+    hole = (START + 120 * TF_MS, START + 180 * TF_MS)
+    page_start = START + 100 * TF_MS
+    # Страница потеряла бары 110..119, а 120..180 на бирже действительно нет
+    exchange = FakeExchange(START, END, holes=[hole],
+                            drop_once={page_start: (page_start + 10 * TF_MS, page_start + 19 * TF_MS)})
+    bars = trading_app._fetch_ohlcv_range(exchange, "X/USDT", TF, START, END + TF_MS)
+    assert _timestamps(bars) == exchange.timeline
+    assert store.empty_until("fakeex", "X/USDT", TF, page_start + 10 * TF_MS) is None
+    # Пустой диапазон - до следующего бара (не включая его)
+    assert store.empty_until("fakeex", "X/USDT", TF, hole[0]) == hole[1] + TF_MS - 1
+
+
+def test_store_skips_known_empty_window(store, monkeypatch):
+    # Биржа не торговала всё окно: второй fetch_ohlcv не перезапрашивает закрытые пустые свечи
+    monkeypatch.setattr(trading_app, "KLINE_STREAM", None)
+    exchange = FakeExchange(START, START - TF_MS)
+    assert trading_app.fetch_ohlcv("X/USDT", TF, history_days=5, client=exchange).empty
+    first_since = exchange.calls[0]
+    exchange.calls.clear()
+    assert trading_app.fetch_ohlcv("X/USDT", TF, history_days=5, client=exchange).empty
+    assert exchange.calls and min(exchange.calls) > first_since + 100 * TF_MS
+
+
+def test_mark_empty_merges_ranges(store):
+    store.mark_empty("ex", "X/USDT", TF, 100, 200)
+    store.mark_empty("ex", "X/USDT", TF, 201, 300)
+    store.mark_empty("ex", "X/USDT", TF, 150, 250)
+    store.mark_empty("ex", "X/USDT", TF, 500, 600)
+    assert store.empty_until("ex", "X/USDT", TF, 100) == 300
+    assert store.empty_until("ex", "X/USDT", TF, 400) is None
+    assert store.empty_until("ex", "X/USDT", TF, 550) == 600
+    store.clear("ex", "X/USDT", TF)
+    assert store.empty_until("ex", "X/USDT", TF, 100) is None
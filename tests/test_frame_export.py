@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Выгрузка кадра индикаторов по запросу: форматы и сборка в хранилище файлов анализа."""
+
+import io
+import json
+import zipfile
+
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+import trading_app
+from core.artifact_store import ArtifactStore
+from core.frame_export import frame_to_bytes, read_frame, write_export
+from core.indicator_cache import IndicatorCache
+
+
+def test_csv_export_roundtrip(ohlcv):
+    df = ohlcv(30)
+    buf = io.BytesIO()
+    write_export(df, "csv", buf)
+    loaded = pd.read_csv(io.BytesIO(buf.getvalue()), index_col=0, parse_dates=True)
+    # Часовой пояс снимается, как и в Excel
+    assert list(loaded.index) == list(df.index.tz_localize(None))
+    pd.testing.assert_frame_equal(loaded.reset_index(drop=True), df.reset_index(drop=True), check_exact=False)
+
+
+def test_xlsx_export_writes_header_and_empty_cells(ohlcv):
+    df = ohlcv(10)
+    df.iloc[3, 1] = float("nan")
+    buf = io.BytesIO()
+    write_export(df, "xlsx", buf)
+    rows = list(load_workbook(io.BytesIO(buf.getvalue())).active.iter_rows(values_only=True))
+    assert rows[0][1:] == tuple(df.columns)
+    assert len(rows) == len(df) + 1
+    assert rows[4][2] is None
+
+
+def test_unknown_format_raises(ohlcv):
+    with pytest.raises(ValueError):
+        write_export(ohlcv(5), "pkl", io.BytesIO())
+
+
+def test_frame_file_roundtrip_without_pickle(tmp_path, ohlcv):
+    df = trading_app.build_indicator_frame(ohlcv(120))
+    df.iloc[4, df.columns.get_loc("Trend")] = None
+    path = tmp_path / "frame"
+    path.write_bytes(frame_to_bytes(df))
+    pd.testing.assert_frame_equal(read_frame(str(path)), df, check_freq=False)
+
+
+@pytest.fixture
+def frame_app(app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, "ARTIFACT_STORE", ArtifactStore(str(tmp_path)))
+    monkeypatch.setattr(app_module, "FRAME_CACHE", IndicatorCache(max_entries=2, ttl_seconds=3600))
+    return app_module
+
+
+def export_bytes(app_module, frame_id, fmt):
+    with open(app_module.ARTIFACT_STORE.path(app_module._frame_export_id(frame_id, fmt)), "rb") as f:
+        return f.read()
+
+
+def expected_bytes(df, fmt):
+    buf = io.BytesIO()
+    write_export(df, fmt, buf)
+    return buf.getvalue()
+
+
+def test_export_rebuilt_from_store_after_eviction_and_reopen(frame_app, tmp_path, ohlcv):
+    df = trading_app.build_indicator_frame(ohlcv(80))
+    ref = frame_app._frame_ref(df)
+    assert ref["id"].endswith(".frame") and frame_app.ARTIFACT_STORE.path(ref["id"]) is not None
+    assert export_bytes(frame_app, ref["id"], "csv") == expected_bytes(df, "csv")
+    # Кадр вытеснен из памяти более новыми анализами - выгрузка собирается из файла кадра
+    for seed in (1, 2):
+        frame_app._frame_ref(trading_app.build_indicator_frame(ohlcv(40, seed=seed)))
+    assert frame_app.FRAME_CACHE.get(ref["id"]) is None
+    rows = list(load_workbook(io.BytesIO(export_bytes(frame_app, ref["id"], "xlsx"))).active.iter_rows(values_only=True))
+    assert len(rows) == len(df) + 1 and rows[0][1:] == tuple(df.columns)
+    # Перезапуск: новое хранилище на том же каталоге и пустой кэш
+    frame_app.ARTIFACT_STORE = ArtifactStore(str(tmp_path))
+    frame_app.FRAME_CACHE = IndicatorCache(max_entries=2, ttl_seconds=3600)
+    for path in tmp_path.rglob("*.csv"):
+        path.unlink()
+    assert export_bytes(frame_app, ref["id"], "csv") == expected_bytes(df, "csv")
+
+
+def test_report_zip_after_restart(frame_app, tmp_path, ohlcv):
+    df = trading_app.build_indicator_frame(ohlcv(50))
+    frame_id = frame_app._frame_ref(df)["id"]
+    report_id = frame_app._artifact_ref("report".encode("utf-8"), "txt")["id"]
+    bundle = json.dumps({"report": report_id, "chart": None, "frame": frame_id}, sort_keys=True)
+    bundle_id = frame_app._artifact_ref(bundle.encode("utf-8"), "json")["id"]
+    frame_app.ARTIFACT_STORE = ArtifactStore(str(tmp_path))
+    frame_app.FRAME_CACHE = IndicatorCache(max_entries=2, ttl_seconds=3600)
+    with zipfile.ZipFile(frame_app.ARTIFACT_STORE.path(frame_app._report_zip_id(bundle_id))) as z:
+        assert sorted(z.namelist()) == ["data.xlsx", "report.txt"]
+        assert z.read("report.txt") == b"report"
+        assert len(list(load_workbook(io.BytesIO(z.read("data.xlsx"))).active.iter_rows())) == len(df) + 1
+
+
+def test_missing_frame_leaves_no_file(frame_app, tmp_path):
+    frame_id = "1" * 32 + ".frame"
+    with pytest.raises(FileNotFoundError):
+        frame_app._frame_export_id(frame_id, "csv")
+    assert frame_app.ARTIFACT_STORE.path("1" * 32 + ".csv") is None
+    assert not [p for p in tmp_path.rglob("*.tmp")]
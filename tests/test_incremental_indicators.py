@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""IncrementalIndicators против build_indicator_frame на растущем кадре."""
+
+import math
+
+import numpy as np
+import pytest
+
+import trading_app
+from core.incremental_indicators import IncrementalIndicators
+
+N_BARS = 300
+EXACT_COLUMNS = ("Trend", "MSTRUCT")
+
+
+def assert_row_matches(row, expected, position):
+    assert set(row) == set(expected.index), position
+    for column in expected.index:
+        value, reference = row[column], expected[column]
+        if column in EXACT_COLUMNS:
+            assert value == reference, (position, column)
+            continue
+        if isinstance(reference, float) and math.isnan(reference):
+            assert math.isnan(value), (position, column, value)
+            continue
+        np.testing.assert_allclose(value, reference, rtol=1e-9, atol=1e-9, err_msg=f"{position} {column}")
+
+
+@pytest.mark.parametrize("seed, decimals", [(0, None), (3, 1)])
+def test_update_matches_full_recalculation(ohlcv, seed, decimals):
+    df = ohlcv(N_BARS, seed=seed, decimals=decimals)
+    engine = IncrementalIndicators.from_history(df.iloc[:1])
+    assert_row_matches(engine.last_row, trading_app.build_indicator_frame(df.iloc[:1]).iloc[-1], 1)
+    for j in range(2, N_BARS + 1):
+        engine.update(df.iloc[j - 1])
+        assert engine.last_index == df.index[j - 1]
+        assert_row_matches(engine.last_row, trading_app.build_indicator_frame(df.iloc[:j]).iloc[-1], j)
+
+
+def test_from_history_and_preview_match_full_recalculation(ohlcv):
+    df = ohlcv(N_BARS, seed=11)
+    engine = IncrementalIndicators.from_history(df.iloc[:-1])
+    assert_row_matches(engine.last_row, trading_app.build_indicator_frame(df.iloc[:-1]).iloc[-1], N_BARS - 1)
+    # Формирующаяся свеча не меняет состояние
+    assert_row_matches(engine.preview(df.iloc[-1]), trading_app.build_indicator_frame(df).iloc[-1], N_BARS)
+    assert_row_matches(engine.last_row, trading_app.build_indicator_frame(df.iloc[:-1]).iloc[-1], N_BARS - 1)
+    assert engine.last_index == df.index[-2]
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Поток свечей: события kline через KlineStreamService.handle и ReplaySource, без сети."""
+
+import time
+
+import pandas as pd
+import pytest
+
+import trading_app
+from core.candle_store import CandleStore
+from core.incremental_indicators import IncrementalIndicators
+from core.kline_stream import KlineStreamService, ReplaySource
+
+SYMBOL = "BTC/USDT"
+TF = "1h"
+TF_MS = 60 * 60 * 1000
+T0 = 1_700_000_000_000 // TF_MS * TF_MS  # начало истории
+H10 = T0 + 10 * TF_MS  # "10:00" - последняя свеча, записанная по REST
+
+
+def kline(ts, close, closed, symbol="BTCUSDT", timeframe=TF, combined=False):
+    """Событие kline в формате Binance."""
+    event = {"e": "kline", "s": symbol, "k": {
+        "t": ts, "s": symbol, "i": timeframe,
+        "o": str(close - 1), "h": str(close + 2), "l": str(close - 2), "c": str(close), "v": "5",
+        "x": closed,
+    }}
+    if combined:
+        return {"stream": f"{symbol.lower()}@kline_{timeframe}", "data": event}
+    return event
+
+
+def bar(ts, close):
+    return [ts, close - 1, close + 2, close - 2, close, 5.0]
+
+
+@pytest.fixture
+def store(tmp_path):
+    candle_store = CandleStore(str(tmp_path / "candles.db"))
+    # История по REST: свечи 00:00..10:00, проверенный диапазон - с T0
+    candle_store.write("binance", SYMBOL, TF, [bar(T0 + k * TF_MS, 100.0 + k) for k in range(11)])
+    candle_store._set_covered_from("binance", SYMBOL, TF, T0)
+    return candle_store
+
+
+@pytest.fixture
+def service(store):
+    stream = KlineStreamService(store, ReplaySource([]), exchange_id="binance", stale_after=60)
+    stream.subscribe(SYMBOL, TF)
+    return stream
+
+
+def test_forming_event_is_kept_in_memory_only(service, store):
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS + 5_000)
+    service.handle(kline(H10 + TF_MS, 111.0, closed=False))
+    assert service.forming(SYMBOL, TF) == bar(H10 + TF_MS, 111.0)
+    assert store.bounds("binance", SYMBOL, TF)[1] == H10
+    assert service.closed_written == 0 and service.closed_skipped == 0
+
+
+def test_closed_event_is_written_after_closed_predecessor(service, store):
+    # REST докачал хранилище после закрытия 10:00 - закрытие 11:00 из потока продолжает диапазон
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS + 5_000)
+    service.handle(kline(H10 + TF_MS, 111.0, closed=False))
+    service.handle(kline(H10 + TF_MS, 112.0, closed=True))
+    assert service.closed_written == 1
+    assert store.read("binance", SYMBOL, TF, H10 + TF_MS) == [bar(H10 + TF_MS, 112.0)]
+    assert service.forming(SYMBOL, TF) is None
+    # Следующее закрытие опирается на свечу, записанную потоком
+    service.handle(kline(H10 + 2 * TF_MS, 113.0, closed=True))
+    assert service.closed_written == 2
+
+
+def test_closed_event_skipped_when_store_lags(service, store):
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS + 5_000)
+    service.handle(kline(H10 + 3 * TF_MS, 120.0, closed=True))
+    assert service.closed_skipped == 1
+    assert store.bounds("binance", SYMBOL, TF)[1] == H10
+
+
+def test_closed_event_skipped_after_partial_rest_bar(service, store):
+    # REST записал свечу 10:00 в 10:59:59 (еще формировалась), поток ожил в 11:00:01
+    # и пропустил ее закрытие: закрытие 11:00 не пишется, иначе REST больше не перекачает 10:00
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS - 1_000)
+    service.handle(kline(H10 + TF_MS, 111.0, closed=False))
+    assert service.bars_since("binance", SYMBOL, TF, T0) is None
+    service.handle(kline(H10 + TF_MS, 112.0, closed=True))
+    assert service.closed_skipped == 1 and service.closed_written == 0
+    assert store.bounds("binance", SYMBOL, TF)[1] == H10
+
+
+def test_bars_since_serves_history_and_forming_bar(service, store):
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS + 5_000)
+    service.handle(kline(H10 + TF_MS, 111.0, closed=False, combined=True))
+    bars = service.bars_since("binance", SYMBOL, TF, T0 + 5 * TF_MS)
+    assert [b[0] for b in bars] == [T0 + k * TF_MS for k in range(5, 12)]
+    assert bars[-1] == bar(H10 + TF_MS, 111.0)
+
+
+def test_bars_since_falls_back_to_rest(service, store):
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS + 5_000)
+    # Нет формирующейся свечи
+    assert service.bars_since("binance", SYMBOL, TF, T0) is None
+    service.handle(kline(H10 + TF_MS, 111.0, closed=False))
+    # Запрошена история раньше проверенного диапазона
+    assert service.bars_since("binance", SYMBOL, TF, T0 - 5 * TF_MS) is None
+    # Другая биржа
+    assert service.bars_since("bybit", SYMBOL, TF, T0) is None
+    # Рынок без подписки
+    assert service.bars_since("binance", "ETH/USDT", TF, T0) is None
+    assert service.bars_since("binance", SYMBOL, TF, T0) is not None
+
+
+def test_stale_stream_falls_back_to_rest(service):
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS + 5_000)
+    service.handle(kline(H10 + TF_MS, 111.0, closed=False))
+    assert service.is_live(SYMBOL, TF)
+    service.stale_after = 0.05
+    time.sleep(0.1)
+    assert not service.is_live(SYMBOL, TF)
+    assert service.bars_since("binance", SYMBOL, TF, T0) is None
+    # Новое событие снова делает поток актуальным
+    service.handle(kline(H10 + TF_MS, 111.5, closed=False))
+    assert service.bars_since("binance", SYMBOL, TF, T0)[-1] == bar(H10 + TF_MS, 111.5)
+
+
+def test_reconnect_after_missed_close(service, store):
+    # Поток писал закрытия, затем переподключился и пропустил закрытие 11:00
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS + 5_000)
+    service.handle(kline(H10 + TF_MS, 112.0, closed=True))
+    service.handle(kline(H10 + 3 * TF_MS, 130.0, closed=False))
+    assert service.bars_since("binance", SYMBOL, TF, T0) is None
+    service.handle(kline(H10 + 3 * TF_MS, 131.0, closed=True))
+    assert service.closed_skipped == 1
+
+    # Синхронизация по REST закрывает дыру - поток снова обслуживает запросы и пишет закрытия
+    store.write("binance", SYMBOL, TF, [bar(H10 + 2 * TF_MS, 120.0), bar(H10 + 3 * TF_MS, 131.0)])
+    service.note_synced("binance", SYMBOL, TF, H10 + 4 * TF_MS + 2_000)
+    service.handle(kline(H10 + 4 * TF_MS, 140.0, closed=False))
+    assert service.bars_since("binance", SYMBOL, TF, T0)[-1][0] == H10 + 4 * TF_MS
+    service.handle(kline(H10 + 4 * TF_MS, 141.0, closed=True))
+    assert service.closed_written == 2
+
+
+def _history_row(store, since_ms):
+    bars = store.read("binance", SYMBOL, TF, since_ms)
+    df = pd.DataFrame(bars, columns=["ts", "Open", "High", "Low", "Close", "Volume"]).set_index("ts")
+    return pd.Series(IncrementalIndicators.from_history(df).last_row)
+
+
+def test_indicators_follow_contiguous_closes(service, store):
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS + 5_000)
+    assert service.track_indicators(SYMBOL, TF, T0, now_ms=H10 + TF_MS + 5_000)
+    service.handle(kline(H10 + TF_MS, 112.0, closed=True))
+    assert service._indicators[(SYMBOL, TF)].last_index == H10 + TF_MS
+    pd.testing.assert_series_equal(pd.Series(service.indicators(SYMBOL, TF)), _history_row(store, T0))
+    assert service.indicator_rebuilds == 0
+
+
+def test_indicators_rebuilt_after_rest_filled_hole(service, store):
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS + 5_000)
+    service.track_indicators(SYMBOL, TF, T0, now_ms=H10 + TF_MS + 5_000)
+    service.handle(kline(H10 + TF_MS, 112.0, closed=True))
+    # Закрытие 12:00 пропущено потоком, REST докачал его - состояние нельзя продвигать через дыру
+    store.write("binance", SYMBOL, TF, [bar(H10 + 2 * TF_MS, 120.0)])
+    service.note_synced("binance", SYMBOL, TF, H10 + 3 * TF_MS + 2_000)
+    service.handle(kline(H10 + 3 * TF_MS, 131.0, closed=True))
+    assert service.closed_written == 2
+    assert service.indicator_rebuilds == 1
+    assert service._indicators[(SYMBOL, TF)].last_index == H10 + 3 * TF_MS
+    pd.testing.assert_series_equal(pd.Series(service.indicators(SYMBOL, TF)), _history_row(store, T0))
+
+
+def test_indicators_untracked_when_rebuild_fails(service, store, monkeypatch):
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS + 5_000)
+    service.track_indicators(SYMBOL, TF, T0, now_ms=H10 + TF_MS + 5_000)
+    store.write("binance", SYMBOL, TF, [bar(H10 + TF_MS, 111.0)])
+    service.note_synced("binance", SYMBOL, TF, H10 + 2 * TF_MS + 2_000)
+    monkeypatch.setattr(store, "read", lambda *args, **kwargs: [])
+    service.handle(kline(H10 + 2 * TF_MS, 121.0, closed=True))
+    assert not service.is_tracking(SYMBOL, TF)
+    assert service.indicators(SYMBOL, TF) is None
+
+
+def test_ignores_foreign_and_malformed_messages(service):
+    service.handle({"result": None, "id": 1})
+    service.handle(kline(H10, 1.0, closed=False, symbol="ETHUSDT"))
+    service.handle(kline(H10, 1.0, closed=False, timeframe="5m"))
+    assert service.events == 0
+
+
+def test_replay_source_runs_in_thread(store):
+    events = [kline(H10 + TF_MS, 111.0, closed=False), kline(H10 + TF_MS, 112.0, closed=True),
+              kline(H10 + 2 * TF_MS, 113.0, closed=False)]
+    service = KlineStreamService(store, ReplaySource(events), exchange_id="binance", stale_after=60)
+    service.subscribe(SYMBOL, TF)
+    service.note_synced("binance", SYMBOL, TF, H10 + TF_MS + 5_000)
+    service.start()
+    service._thread.join(5)
+    service.stop()
+    assert service.stats()["events"] == 3
+    assert service.closed_written == 1
+    assert service.bars_since("binance", SYMBOL, TF, T0)[-2:] == [bar(H10 + TF_MS, 112.0), bar(H10 + 2 * TF_MS, 113.0)]
+
+
+def test_fetch_ohlcv_uses_stream_after_rest_sync(tmp_path, monkeypatch):
+    now_ms = int(time.time() * 1000)
+    current = now_ms // TF_MS * TF_MS
+
+    class Exchange:
+        id = "binance"
+        calls = 0
+
+        def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None):
+            Exchange.calls += 1
+            return [bar(ts, 100.0) for ts in range(current - 48 * TF_MS, current + 1, TF_MS) if ts >= since][:limit]
+
+    candle_store = CandleStore(str(tmp_path / "candles.db"))
+    service = KlineStreamService(candle_store, ReplaySource([]), exchange_id="binance", stale_after=60)
+    service.subscribe(SYMBOL, TF)
+    monkeypatch.setattr(trading_app, "CANDLE_STORE", candle_store)
+    monkeypatch.setattr(trading_app, "KLINE_STREAM", service)
+
+    service.handle(kline(current, 101.0, closed=False))
+    trading_app.fetch_ohlcv(SYMBOL, TF, history_days=1, client=Exchange())
+    assert Exchange.calls >= 1
+    calls = Exchange.calls
+    df = trading_app.fetch_ohlcv(SYMBOL, TF, history_days=1, client=Exchange())
+    assert Exchange.calls == calls
+    assert df["Close"].iloc[-1] == 101.0
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""scan_markets на бирже-заглушке: ранжирование, min_reliability, ошибки и топ по объему."""
+
+import pytest
+
+import trading_app
+from trading_app import STRATEGY_INPUT_MAP, TRADING_TYPE_INPUT_MAP, scan_markets, scan_symbol, top_symbols_by_volume
+
+from conftest import StubExchange
+
+SYMBOLS = [f"C{k}/USDT" for k in range(12)]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    client = StubExchange(SYMBOLS)
+    monkeypatch.setattr(trading_app, "exchange", client)
+    monkeypatch.setattr(trading_app, "CANDLE_STORE", None)
+    monkeypatch.setattr(trading_app, "KLINE_STREAM", None)
+    return client
+
+
+def test_results_ranked_by_reliability_then_rr(stub):
+    result = scan_markets(SYMBOLS, max_workers=4)
+    assert result["scanned"] == len(SYMBOLS) and result["errors"] == {}
+    rows = result["results"]
+    assert sorted(row["symbol"] for row in rows) == sorted(SYMBOLS)
+    keys = [(row["reliability_rating"] or 0, row["rr"] or 0) for row in rows]
+    assert keys == sorted(keys, reverse=True)
+    assert len({row["reliability_rating"] for row in rows}) > 1
+    # Строки совпадают с расчетом по одному рынку
+    for row in rows:
+        assert row == scan_symbol(row["symbol"])
+
+
+def test_min_reliability_filters_rows(stub):
+    everything = scan_markets(SYMBOLS, max_workers=4)["results"]
+    ratings = sorted(row["reliability_rating"] for row in everything)
+    threshold = ratings[len(ratings) // 2]
+    filtered = scan_markets(SYMBOLS, min_reliability=threshold, max_workers=4)["results"]
+    assert filtered == [row for row in everything if row["reliability_rating"] >= threshold]
+    assert 0 < len(filtered) < len(everything)
+
+
+def test_errors_and_duplicates(stub):
+    result = scan_markets(["c0/usdt", "C0/USDT", " C1/USDT ", "BAD/USDT"], max_workers=2)
+    assert result["scanned"] == 3
+    assert sorted(row["symbol"] for row in result["results"]) == ["C0/USDT", "C1/USDT"]
+    assert list(result["errors"]) == ["BAD/USDT"]
+
+
+def test_top_symbols_by_volume(stub):
+    assert top_symbols_by_volume(3, client=stub) == ["C11/USDT", "C10/USDT", "C9/USDT"]
+
+
+def test_input_maps_cover_strategies_and_trading_types():
+    assert set(STRATEGY_INPUT_MAP.values()) == set(trading_app.STRATEGIES)
+    assert set(TRADING_TYPE_INPUT_MAP.values()) == set(trading_app.TRADING_TYPES)
+    assert STRATEGY_INPUT_MAP["aggressive"] == STRATEGY_INPUT_MAP["Агрессивная"] == "Агрессивная"
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""MSTRUCT и точки разворота: маски _pivot_masks + _market_structure против прежнего цикла."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import trading_app
+
+
+def reference_pivots(df):
+    """Прежние маски точек разворота (по 2 свечи с каждой стороны)."""
+    pivot_low = (
+        (df["Low"] < df["Low"].shift(1)) &
+        (df["Low"] < df["Low"].shift(2)) &
+        (df["Low"] < df["Low"].shift(-1)) &
+        (df["Low"] < df["Low"].shift(-2))
+    ).fillna(False).values
+    pivot_high = (
+        (df["High"] > df["High"].shift(1)) &
+        (df["High"] > df["High"].shift(2)) &
+        (df["High"] > df["High"].shift(-1)) &
+        (df["High"] > df["High"].shift(-2))
+    ).fillna(False).values
+    return pivot_low, pivot_high
+
+
+def reference_mstruct(df, trend):
+    """Прежний построчный цикл MSTRUCT из add_indicators."""
+    pivot_low, pivot_high = reference_pivots(df)
+    last_ph = None
+    prev_ph = None
+    last_pl = None
+    prev_pl = None
+    mstruct = np.zeros(len(df), dtype=bool)
+    for i in range(len(df)):
+        if pivot_high[i]:
+            prev_ph = last_ph
+            last_ph = float(df["High"].iat[i])
+        if pivot_low[i]:
+            prev_pl = last_pl
+            last_pl = float(df["Low"].iat[i])
+
+        trend_i = trend.iat[i]
+        if prev_ph is None or prev_pl is None or last_ph is None or last_pl is None:
+            mstruct[i] = False
+        elif trend_i == "Uptrend":
+            mstruct[i] = (last_ph > prev_ph) and (last_pl > prev_pl)
+        else:
+            mstruct[i] = (last_ph < prev_ph) and (last_pl < prev_pl)
+    return mstruct
+
+
+def _trend(df, seed):
+    # Тренд с частыми сменами, чтобы обе ветки сравнения срабатывали
+    rng = np.random.default_rng(seed)
+    flips = np.cumsum(rng.random(len(df)) < 0.05) % 2
+    return pd.Series(np.where(flips == 0, "Uptrend", "Downtrend"), index=df.index)
+
+
+def _assert_same(df, seed=0):
+    trend = _trend(df, seed)
+    ref_low, ref_high = reference_pivots(df)
+    pivot_low, pivot_high = trading_app._pivot_masks(df)
+    np.testing.assert_array_equal(pivot_low, ref_low)
+    np.testing.assert_array_equal(pivot_high, ref_high)
+    mstruct = trading_app._market_structure(
+        df["High"].to_numpy(dtype=float),
+        df["Low"].to_numpy(dtype=float),
+        (trend == "Uptrend").to_numpy(),
+        pivot_high,
+        pivot_low,
+    )
+    np.testing.assert_array_equal(np.asarray(mstruct, dtype=bool), reference_mstruct(df, trend))
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_matches_reference_loop(ohlcv, seed):
+    _assert_same(ohlcv(500, seed=seed), seed)
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_equal_highs_and_lows(ohlcv, seed):
+    # Цены с точностью до целых: много равных соседних максимумов/минимумов (не точки разворота)
+    # и равных последовательных точек разворота (ни повышение, ни понижение)
+    df = ohlcv(500, seed=seed, decimals=0)
+    assert df["High"].duplicated().any() and df["Low"].duplicated().any()
+    _assert_same(df, seed)
+
+
+def test_flat_plateau():
+    index = pd.date_range("2024-01-01", periods=12, freq="1h", tz="UTC")
+    high = [5, 6, 7, 7, 6, 5, 6, 7, 8, 7, 6, 5]
+    low = [4, 3, 2, 2, 3, 4, 3, 2, 1, 2, 3, 4]
+    df = pd.DataFrame({"High": high, "Low": low}, index=index, dtype=float)
+    pivot_low, pivot_high = trading_app._pivot_masks(df)
+    # Плато из двух равных свечей - не точка разворота, одиночный экстремум - да
+    assert list(np.flatnonzero(pivot_high)) == [8]
+    assert list(np.flatnonzero(pivot_low)) == [8]
+    _assert_same(df)
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 3, 4, 5, 6])
+def test_series_shorter_than_pivot_window(ohlcv, n):
+    # Меньше 2*2+1 свечей - точек разворота нет, MSTRUCT везде False
+    df = ohlcv(n, seed=n)
+    _assert_same(df, n)
+    if n < 5:
+        pivot_low, pivot_high = trading_app._pivot_masks(df)
+        assert not pivot_low.any() and not pivot_high.any()
+
+
+def test_add_indicators_column_matches(ohlcv):
+    df = ohlcv(600, seed=11)
+    out = trading_app.add_indicators(df)
+    np.testing.assert_array_equal(out["MSTRUCT"].to_numpy(dtype=bool), reference_mstruct(df, out["Trend"]))
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""ReportFeatureTable: синхронизация окна последних завершенных отчетов."""
+
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+from trading_app import ReportFeatureTable, predict_ml_success
+
+
+def report(report_id, success, strategy="Trend", confirmation="EMA+RSI", rr=2.0):
+    return SimpleNamespace(id=report_id, strategy=strategy, trading_type="Swing", direction="long",
+                           trend="Uptrend", rr_long=rr, rr_short=None, confirmation=confirmation,
+                           success=success)
+
+
+class FakeDb:
+    """Источник отчетов: окно (id, success) и загрузка строк по id, как в get_ml_feature_table."""
+
+    def __init__(self, reports):
+        self.reports = {r.id: r for r in reports}
+        self.loaded = []
+
+    def window(self, max_rows):
+        resolved = sorted((r.id, r.success) for r in self.reports.values() if r.success is not None)
+        return resolved[::-1][:max_rows]
+
+    def load(self, ids):
+        self.loaded.extend(ids)
+        return [self.reports[i] for i in ids]
+
+    def sync(self, table):
+        return table.sync(self.window(table.max_rows), self.load)
+
+
+def test_sync_loads_only_changes():
+    db = FakeDb([report(i, i % 2 == 0) for i in range(1, 6)])
+    table = ReportFeatureTable(max_rows=10)
+    assert db.sync(table) == (5, 0)
+    db.loaded.clear()
+    assert db.sync(table) == (0, 0)
+    assert db.loaded == []
+
+
+def test_report_resolved_out_of_id_order_enters_table():
+    db = FakeDb([report(1, True), report(2, None), report(3, False)])
+    table = ReportFeatureTable(max_rows=10)
+    db.sync(table)
+    assert len(table) == 2
+    # Старый отчет 2 завершился после нового отчета 3
+    db.reports[2].success = True
+    assert db.sync(table) == (1, 0)
+    assert len(table) == 3
+    assert table.success_flags().sum() == 2
+
+
+def test_changed_result_replaces_row():
+    db = FakeDb([report(1, True), report(2, True)])
+    table = ReportFeatureTable(max_rows=10)
+    db.sync(table)
+    db.reports[2].success = False
+    assert db.sync(table) == (1, 0)
+    assert len(table) == 2
+    assert table.success_flags().sum() == 1
+
+
+def test_full_table_keeps_rolling_window():
+    db = FakeDb([report(i, True) for i in range(1, 6)])
+    table = ReportFeatureTable(max_rows=3)
+    db.sync(table)
+    assert table.full and sorted(table._rows) == [3, 4, 5]
+    db.reports[6] = report(6, False)
+    db.reports[7] = report(7, False)
+    assert db.sync(table) == (2, 2)
+    assert sorted(table._rows) == [5, 6, 7]
+    assert table.success_flags().sum() == 1
+
+
+def test_deleted_reports_leave_table():
+    db = FakeDb([report(i, True) for i in range(1, 6)])
+    table = ReportFeatureTable(max_rows=10)
+    db.sync(table)
+    del db.reports[2]
+    del db.reports[4]
+    assert db.sync(table) == (0, 2)
+    assert sorted(table._rows) == [1, 3, 5]
+
+
+def test_add_keeps_newest_rows():
+    table = ReportFeatureTable(max_rows=2)
+    table.add([report(3, True), report(1, True), report(2, False)])
+    assert sorted(table._rows) == [2, 3]
+
+
+def test_synced_table_predicts_like_fresh_table():
+    rng = np.random.default_rng(0)
+    strategies = ["Trend", "Breakout", "Mean"]
+    confirmations = ["EMA+RSI", "MACD", "EMA+MACD+ADX", ""]
+    reports = [report(i, bool(rng.random() < 0.6), strategy=strategies[i % 3],
+                      confirmation=confirmations[i % 4], rr=float(rng.uniform(1, 3)))
+               for i in range(1, 200)]
+    db = FakeDb(reports[:120])
+    table = ReportFeatureTable(max_rows=100)
+    db.sync(table)
+    for r in reports[120:]:
+        db.reports[r.id] = r
+    db.sync(table)
+
+    fresh = ReportFeatureTable.from_reports([db.reports[i] for i, _ in db.window(100)])
+    params = {"strategy": "Trend", "trading_type": "Swing", "direction": "long", "trend": "Uptrend",
+              "rr_long": 2.0, "confirmation": "EMA+RSI"}
+    assert predict_ml_success(params, table) == predict_ml_success(params, fresh)
+
+
+PARAMS = {"strategy": "Trend", "trading_type": "Swing", "direction": "long", "trend": "Uptrend",
+          "rr_long": 2.0, "confirmation": "EMA+RSI"}
+
+
+def test_snapshot_is_not_changed_by_sync():
+    db = FakeDb([report(i, True) for i in range(1, 6)])
+    table = ReportFeatureTable(max_rows=4)
+    db.sync(table)
+    snapshot = table.snapshot()
+    assert table.snapshot() is snapshot
+    expected = predict_ml_success(PARAMS, snapshot)
+    db.reports[6] = report(6, False, confirmation="MACD+ADX")
+    db.sync(table)
+    assert table.snapshot() is not snapshot
+    assert sorted(snapshot._rows) == [2, 3, 4, 5] and len(snapshot.similarity(PARAMS)) == 4
+    assert predict_ml_success(PARAMS, snapshot) == expected
+
+
+def test_concurrent_sync_and_similarity():
+    lock = threading.Lock()
+    table = ReportFeatureTable(max_rows=50)
+    windows = [FakeDb([report(i, i % 3 != 0, confirmation=f"EMA+C{i % 7}") for i in range(start, start + size)])
+               for start, size in ((1, 60), (20, 30), (5, 45), (40, 12))]
+    stop = threading.Event()
+    errors = []
+
+    def writer():
+        k = 0
+        while not stop.is_set():
+            with lock:
+                windows[k % len(windows)].sync(table)
+            k += 1
+
+    def reader():
+        for _ in range(2000):
+            with lock:
+                snapshot = table.snapshot()
+            try:
+                scores = snapshot.similarity(PARAMS)
+                assert len(scores) == len(snapshot.success_flags()) == len(snapshot)
+                if len(snapshot) >= 5:
+                    assert predict_ml_success(PARAMS, snapshot)[0] is not None
+            except Exception as e:  # noqa: BLE001 - ошибка любого типа должна провалить тест
+                errors.append(e)
+                return
+
+    with lock:
+        windows[0].sync(table)
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads[1:]:
+        thread.join()
+    stop.set()
+    threads[0].join()
+    assert errors == []
+
+
+def test_app_returns_snapshot_of_shared_table(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "ML_FEATURE_TABLE", ReportFeatureTable(max_rows=10))
+    with app_module.app.app_context():
+        db, ReportV2 = app_module.db, app_module.ReportV2
+        rows = [ReportV2(strategy="Trend", trading_type="Swing", direction="long", trend="Uptrend",
+                         rr_long=2.0, confirmation="EMA+RSI", success=i % 2 == 0) for i in range(6)]
+        db.session.add_all(rows)
+        db.session.commit()
+        try:
+            first = app_module.get_ml_feature_table()
+            assert first is not app_module.ML_FEATURE_TABLE and len(first) == 6
+            assert app_module.get_ml_feature_table() is first
+            rows[0].success = None
+            db.session.commit()
+            assert len(app_module.get_ml_feature_table()) == 5 and len(first) == 6
+        finally:
+            for row in rows:
+                db.session.delete(row)
+            db.session.commit()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Монте-Карло по сделкам бэктеста: включение по запросу и проверка параметров."""
+
+import pytest
+
+import trading_app
+
+
+@pytest.fixture
+def frame(ohlcv):
+    return trading_app.build_indicator_frame(ohlcv(1500, seed=0))
+
+
+def test_backtest_runs_monte_carlo_only_on_request(frame):
+    plain = trading_app.backtest_strategy(frame.copy(), "Агрессивная", "Дейтрейдинг", "RSI")
+    assert plain["total_trades"] > 0 and "monte_carlo" not in plain
+    assert "monte_carlo" not in trading_app.backtest_strategy(frame.copy(), "Агрессивная", "Дейтрейдинг", "RSI",
+                                                              monte_carlo=0)
+    with_mc = trading_app.backtest_strategy(frame.copy(), "Агрессивная", "Дейтрейдинг", "RSI", monte_carlo=200)
+    assert with_mc["monte_carlo"]["simulations"] == 200
+    assert {k: v for k, v in with_mc.items() if k != "monte_carlo"} == plain
+
+
+def test_shuffle_without_costs_reproduces_backtest(frame):
+    df = frame.copy()
+    trading_app._add_backtest_columns(df)
+    result = trading_app._run_backtest(trading_app._backtest_arrays(df), trading_app.STRATEGIES["Агрессивная"],
+                                       ["RSI"], start=100, stop=len(df) - 1, return_trades=True)
+    mc = trading_app.monte_carlo_trades(result["trades"], simulations=50, method="shuffle",
+                                        slippage_pct=0, spread_jitter=0, seed=1)
+    assert mc["return_pct"]["p5"] == mc["return_pct"]["p95"] == pytest.approx(result["total_profit_pct"], abs=0.01)
+
+
+def test_unknown_method_raises():
+    trades = [{"capital_before": 10000, "profit_usd": 100, "position_value": 5000}]
+    with pytest.raises(ValueError):
+        trading_app.monte_carlo_trades(trades, method="bootstrapp")
+    with pytest.raises(ValueError):
+        trading_app.monte_carlo_trades([], method="permute")
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Распознавание ответов биржи об ограничении запросов и пауза для всех процессов."""
+
+import ccxt
+import pytest
+
+from core.rate_limiter import (
+    IP_BAN_BACKOFF_SECONDS,
+    RATE_LIMIT_BACKOFF_SECONDS,
+    RateLimitedExchange,
+    SharedRateLimiter,
+    is_rate_limit_error,
+    rate_limit_status,
+)
+
+KLINES_URL = "https://api.binance.com/api/v3/klines?interval=1h&limit=1000&symbol=BTCUSDT&startTime=1700418000000"
+
+
+class HttpError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.http_status = status
+
+
+@pytest.mark.parametrize("error, status", [
+    (ccxt.DDoSProtection("binance 418 I'm a teapot {\"code\":-1003}"), 418),
+    (ccxt.DDoSProtection("binance 429 Too Many Requests {\"code\":-1003}"), 429),
+    (ccxt.RateLimitExceeded(f"binance GET {KLINES_URL} 429 Too Many Requests "), 429),
+    (ccxt.DDoSProtection(f"binance GET {KLINES_URL} 418 "), 418),
+    (HttpError("too many requests", 429), 429),
+])
+def test_rate_limit_responses(error, status):
+    assert is_rate_limit_error(error)
+    assert rate_limit_status(error) == status
+
+
+@pytest.mark.parametrize("error", [
+    # Цифры 418/429 в URL, ценах и символах - не статус ответа
+    ccxt.NetworkError(f"binance GET {KLINES_URL.replace('1700418000000', '1700429418000')} read timeout"),
+    ccxt.RequestTimeout(f"binance GET {KLINES_URL} 504 Gateway Timeout"),
+    ccxt.BadSymbol("binance does not have market symbol 429/USDT"),
+    ccxt.ExchangeError('binance {"code":-1013,"msg":"Filter failure: price 0.0418"}'),
+    ValueError("startTime 1700429000000 is invalid"),
+    HttpError("not found", 404),
+])
+def test_other_errors_are_not_rate_limits(error):
+    assert not is_rate_limit_error(error)
+    assert rate_limit_status(error) is None
+
+
+class FailingClient:
+    id = "binance"
+    markets = {"BTC/USDT": {}}
+
+    def __init__(self, error):
+        self.error = error
+
+    def fetch_ohlcv(self, *args, **kwargs):
+        raise self.error
+
+
+@pytest.fixture
+def limiter(tmp_path, monkeypatch):
+    limiter = SharedRateLimiter(str(tmp_path / "limit.json"))
+    blocks = []
+    monkeypatch.setattr(limiter, "block", blocks.append)
+    limiter.blocks_requested = blocks
+    return limiter
+
+
+@pytest.mark.parametrize("error, seconds", [
+    (ccxt.DDoSProtection("binance 418 I'm a teapot"), IP_BAN_BACKOFF_SECONDS),
+    (ccxt.DDoSProtection("binance 429 Too Many Requests"), RATE_LIMIT_BACKOFF_SECONDS),
+    # 418 только в URL: пауза обычная, не как при бане IP
+    (ccxt.RateLimitExceeded(f"binance GET {KLINES_URL.replace('BTCUSDT', 'X418USDT')} 429 "), RATE_LIMIT_BACKOFF_SECONDS),
+])
+def test_block_duration_follows_status(limiter, error, seconds):
+    client = RateLimitedExchange(FailingClient(error), limiter)
+    with pytest.raises(type(error)):
+        client.fetch_ohlcv("BTC/USDT", "1h")
+    assert limiter.blocks_requested == [seconds]
+
+
+def test_ordinary_error_does_not_block(limiter):
+    error = ccxt.NetworkError(f"binance GET {KLINES_URL.replace('1700418000000', '1700429418000')} timeout")
+    client = RateLimitedExchange(FailingClient(error), limiter)
+    with pytest.raises(ccxt.NetworkError):
+        client.fetch_ohlcv("BTC/USDT", "1h")
+    assert limiter.blocks_requested == []
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""strategy_optimizer: сетка параметров, оценка комбинации, пул процессов и walk-forward выбор."""
+
+import pytest
+
+import trading_app
+from strategy_optimizer import (
+    BACKTEST_START, _score, confirmation_subsets, evaluate_combo, optimize, parameter_grid,
+)
+
+from conftest import make_ohlcv
+
+GRID = {"atr_sl": [1.0, 1.5], "atr_tp": [1.8, 3.0], "entry_type": ["ema20", "close", "ema50"]}
+SUBSETS = [("RSI",), ("EMA", "MACD")]
+
+
+@pytest.fixture(scope="module")
+def frame():
+    df = trading_app.build_indicator_frame(make_ohlcv(1500, seed=2))
+    trading_app._add_backtest_columns(df)
+    return df
+
+
+def test_grid_and_subset_counts():
+    subsets = confirmation_subsets(["ema", " RSI ", "MACD", ""], 1, 2)
+    assert len(subsets) == 6 and ("EMA", "RSI") in subsets
+    assert len(confirmation_subsets(["EMA", "RSI", "MACD"], 2)) == 4
+    combos = parameter_grid("Агрессивная", SUBSETS + ["ADX+BB"], **GRID)
+    assert len(combos) == 2 * 2 * 3 * 3
+    assert combos[-1]["confirmation"] == ("ADX", "BB")
+    assert combos[0]["strategy"]["atr_sl"] == 1.0 and combos[-1]["strategy"]["entry_type"] == "ema50"
+    # Параметры вне сетки берутся из базового профиля
+    assert combos[0]["strategy"]["ema_buffer"] == trading_app.STRATEGIES["Агрессивная"]["ema_buffer"]
+    assert parameter_grid(atr_sl=[1.0])[0]["confirmation"] == ("ALL",)
+
+
+def test_evaluate_combo_full_history_matches_backtest(frame):
+    arrays = trading_app._backtest_arrays(frame)
+    settings = {"capital": 10000, "risk": 0.01, "commission": 0.001, "spread": 0.0, "metric": "total_profit_pct"}
+    combo = parameter_grid("Агрессивная", [("RSI",)], atr_sl=[1.5], atr_tp=[3.0])[0]
+    row = evaluate_combo(combo, arrays, [], settings)
+    reference = trading_app._run_backtest(arrays, combo["strategy"], ["RSI"], 10000, 0.01, 0.001, 0.0,
+                                          start=BACKTEST_START, stop=arrays["n"] - 1)
+    assert reference["total_trades"] > 0
+    assert row["full"] == {
+        "total_trades": reference["total_trades"],
+        "win_rate": round(float(reference["win_rate"]), 2),
+        "total_profit_pct": reference["total_profit_pct"],
+        "max_drawdown": reference["max_drawdown"],
+    }
+    assert row["score_full"] == round(reference["total_profit_pct"], 4)
+    assert row["confirmation"] == "RSI" and row["params"]["atr_tp"] == 3.0
+
+
+def test_pool_matches_serial(frame):
+    combos = parameter_grid("Агрессивная", SUBSETS, **GRID)
+    serial = optimize(frame, combos, folds=3, max_workers=1)
+    pooled = optimize(frame, combos, folds=3, max_workers=2, chunk_size=5)
+    assert serial["combinations"] == pooled["combinations"] == 24
+    assert pooled["results"] == serial["results"]
+    assert pooled["walk_forward"] == serial["walk_forward"]
+
+
+def test_walk_forward_picks_best_on_train(frame):
+    combos = parameter_grid("Агрессивная", SUBSETS, **GRID)
+    result = optimize(frame, combos, folds=3, max_workers=1, metric="win_rate")
+    assert len(result["windows"]) == len(result["walk_forward"]) == 3
+    for w, chosen in enumerate(result["walk_forward"]):
+        best = max(_score(row["train"][w], "win_rate") for row in result["results"])
+        assert _score(chosen["train"], "win_rate") == best
+        row = next(r for r in result["results"]
+                   if r["params"] == chosen["params"] and r["confirmation"] == chosen["confirmation"])
+        assert chosen["test"] == row["test"][w]
+    scores = [row["score_test"] for row in result["results"]]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_optimize_is_quiet(frame, capsys):
+    optimize(frame, parameter_grid("Агрессивная", SUBSETS, atr_sl=[1.0]), folds=2, max_workers=1)
+    assert capsys.readouterr().out == ""
+
+
+def test_unknown_metric_rejected(frame):
+    with pytest.raises(ValueError):
+        optimize(frame, parameter_grid(atr_sl=[1.0]), metric="sharpe")
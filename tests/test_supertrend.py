@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Supertrend: ядро _supertrend_bands против прежнего цикла по .iat."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import trading_app
+
+from conftest import best_time
+
+
+def reference_supertrend(df, st_period=10, st_mult=3.0):
+    """Прежняя реализация из add_indicators (цикл по pd.Series.iat); рекурсия - в reference_recursion, без изменений."""
+    hl = df["High"] - df["Low"]
+    hc = (df["High"] - df["Close"].shift()).abs()
+    lc = (df["Low"] - df["Close"].shift()).abs()
+    tr = pd.concat([hl, hc, lc], axis=1).max(axis=1)
+    atr_st = tr.rolling(st_period).mean()
+    hl2 = (df["High"] + df["Low"]) / 2.0
+    upperband = hl2 + st_mult * atr_st
+    lowerband = hl2 - st_mult * atr_st
+    return (upperband, lowerband) + reference_recursion(upperband, lowerband, df["Close"].values)
+
+
+def reference_recursion(upperband, lowerband, close):
+    """Рекурсия полос и направления из прежнего цикла (полосы - pd.Series, close - массив)."""
+    final_upper = upperband.copy()
+    final_lower = lowerband.copy()
+    n = len(close)
+
+    for i in range(1, n):
+        if np.isnan(final_upper.iat[i - 1]):
+            final_upper.iat[i - 1] = upperband.iat[i - 1]
+        if np.isnan(final_lower.iat[i - 1]):
+            final_lower.iat[i - 1] = lowerband.iat[i - 1]
+
+        if upperband.iat[i] < final_upper.iat[i - 1] or close[i - 1] > final_upper.iat[i - 1]:
+            final_upper.iat[i] = upperband.iat[i]
+        else:
+            final_upper.iat[i] = final_upper.iat[i - 1]
+
+        if lowerband.iat[i] > final_lower.iat[i - 1] or close[i - 1] < final_lower.iat[i - 1]:
+            final_lower.iat[i] = lowerband.iat[i]
+        else:
+            final_lower.iat[i] = final_lower.iat[i - 1]
+
+    supertrend = pd.Series(index=upperband.index, dtype=float)
+    supertrend_dir = pd.Series(index=upperband.index, dtype=float)
+    if n:
+        supertrend.iat[0] = final_upper.iat[0]
+        supertrend_dir.iat[0] = -1.0
+    for i in range(1, n):
+        prev_st = supertrend.iat[i - 1]
+        if prev_st == final_upper.iat[i - 1]:
+            if close[i] <= final_upper.iat[i]:
+                supertrend.iat[i] = final_upper.iat[i]
+                supertrend_dir.iat[i] = -1.0
+            else:
+                supertrend.iat[i] = final_lower.iat[i]
+                supertrend_dir.iat[i] = 1.0
+        else:
+            if close[i] >= final_lower.iat[i]:
+                supertrend.iat[i] = final_lower.iat[i]
+                supertrend_dir.iat[i] = 1.0
+            else:
+                supertrend.iat[i] = final_upper.iat[i]
+                supertrend_dir.iat[i] = -1.0
+
+    return final_upper, final_lower, supertrend, supertrend_dir
+
+
+@pytest.fixture(params=["jit", "python"])
+def kernel(request, monkeypatch):
+    """Обе ветки _supertrend_bands: numba (если установлен) и рекурсия по спискам Python."""
+    if request.param == "jit":
+        if trading_app._supertrend_recursion_jit is None:
+            pytest.skip("numba не установлен")
+    else:
+        monkeypatch.setattr(trading_app, "_supertrend_recursion_jit", None)
+    return request.param
+
+
+def _assert_same(df):
+    upperband, lowerband, ref_upper, ref_lower, ref_st, ref_dir = reference_supertrend(df)
+    final_upper, final_lower, supertrend, supertrend_dir = trading_app._supertrend_bands(
+        upperband.to_numpy(dtype=float), lowerband.to_numpy(dtype=float), df["Close"].to_numpy(dtype=float)
+    )
+    np.testing.assert_array_equal(final_upper, ref_upper.to_numpy())
+    np.testing.assert_array_equal(final_lower, ref_lower.to_numpy())
+    np.testing.assert_array_equal(supertrend, ref_st.to_numpy())
+    np.testing.assert_array_equal(supertrend_dir, ref_dir.to_numpy())
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_matches_reference_loop(kernel, ohlcv, seed):
+    # Первые 9 строк - прогрев ATR (NaN полосы), их обработка тоже должна совпасть
+    _assert_same(ohlcv(400, seed=seed))
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 5, 10, 11])
+def test_short_series_only_warmup(kernel, ohlcv, n):
+    _assert_same(ohlcv(n, seed=n))
+
+
+def test_nan_gap_inside_series(kernel, ohlcv):
+    # Пропуск в данных посреди ряда: ATR снова прогревается, полосы NaN несколько строк
+    df = ohlcv(200, seed=42)
+    df.iloc[80:83, df.columns.get_loc("High")] = np.nan
+    _assert_same(df)
+
+
+def test_add_indicators_columns_match(ohlcv):
+    df = ohlcv(300, seed=7)
+    _, _, _, _, ref_st, ref_dir = reference_supertrend(df)
+    out = trading_app.add_indicators(df)
+    np.testing.assert_array_equal(out["SUPERTREND"].to_numpy(), ref_st.to_numpy())
+    np.testing.assert_array_equal(out["SUPERTREND_DIR"].to_numpy(), ref_dir.to_numpy())
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("n", [1_000, 10_000])
+def test_benchmark_kernel_against_reference_loop(kernel, ohlcv, n):
+    """Время рекурсии: прежний цикл по .iat против _supertrend_bands (--benchmark -s печатает замеры)."""
+    upperband, lowerband, *_ = reference_supertrend(ohlcv(n, seed=1))
+    close = ohlcv(n, seed=1)["Close"].to_numpy(dtype=float)
+    upper, lower = upperband.to_numpy(dtype=float), lowerband.to_numpy(dtype=float)
+    trading_app._supertrend_bands(upper, lower, close)  # Компиляция numba - вне замера
+    old = best_time(lambda: reference_recursion(upperband, lowerband, close), repeat=3)
+    new = best_time(lambda: trading_app._supertrend_bands(upper, lower, close), repeat=5)
+    print(f"\nSupertrend {kernel} n={n}: цикл .iat {old * 1000:.1f} мс, ядро {new * 1000:.2f} мс, x{old / new:.0f}")
+    assert new * 5 < old
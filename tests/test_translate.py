@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""translate_markdown (одно регулярное выражение) против прежней цепочки замен по каждому ключу."""
+
+import re
+
+import pytest
+
+import trading_app
+from trading_app import REPORT_TRANSLATIONS, translate_markdown
+
+from conftest import StubExchange, best_time, make_ohlcv
+
+LANGUAGES = ["ru", "en", "uk", "de"]
+
+
+def reference_translate(md, language="ru"):
+    """Прежний translate_markdown: ключи от длинных к коротким, сначала {{key}}, затем {key}."""
+    if not md:
+        return md
+    lang = language if language in REPORT_TRANSLATIONS else "ru"
+    translations = REPORT_TRANSLATIONS[lang]
+    all_keys = set()
+    for lang_code in ["ru", "en", "uk"]:
+        all_keys.update(REPORT_TRANSLATIONS[lang_code].keys())
+    result = md
+    for _ in range(10):
+        prev_result = result
+        sorted_keys = sorted(sorted(all_keys), key=len, reverse=True)
+        for key in sorted_keys:
+            pattern = r'\{\{' + re.escape(key) + r'\}\}'
+            if re.search(pattern, result):
+                translation = translations.get(key, REPORT_TRANSLATIONS["ru"].get(key, key))
+                result = re.sub(pattern, translation, result)
+        for key in sorted_keys:
+            pattern = r'\{' + re.escape(key) + r'\}'
+            if re.search(pattern, result):
+                translation = translations.get(key, REPORT_TRANSLATIONS["ru"].get(key, key))
+                result = re.sub(pattern, translation, result)
+        if result == prev_result:
+            break
+    return result
+
+
+def _all_keys():
+    return sorted(set().union(*(REPORT_TRANSLATIONS[lang].keys() for lang in ("ru", "en", "uk"))))
+
+
+@pytest.fixture(scope="module")
+def report_templates():
+    """Сырые отчеты run_analysis (с ключами) на бирже-заглушке, без сети."""
+    patch = pytest.MonkeyPatch()
+    patch.setattr(trading_app, "exchange", StubExchange(["BTC/USDT", "ETH/USDT"], n_bars=3000))
+    patch.setattr(trading_app, "CANDLE_STORE", None)
+    patch.setattr(trading_app, "KLINE_STREAM", None)
+    patch.setattr(trading_app, "get_fear_greed_index", lambda: (55, "Greed"))
+    patch.setattr(trading_app, "compare_with_btc",
+                  lambda *args, **kwargs: {"btc_return": 5.0, "alpha": 1.5, "better": "strategy"})
+    templates = []
+    try:
+        for seed, (symbol, strategy, options) in enumerate([
+            ("BTC/USDT", "Сбалансированная", {"enable_forecast": True, "enable_backtest": True}),
+            ("ETH/USDT", "Агрессивная", {"enable_backtest": True, "walk_forward": 3, "monte_carlo": 100,
+                                         "enable_trailing": True}),
+            ("BTC/USDT", "Консервативная", {"confirmation": "EMA,RSI,MACD", "min_reliability": 90}),
+        ]):
+            df = trading_app.build_indicator_frame(make_ohlcv(1500, seed=seed))
+            options.setdefault("confirmation", "ALL")
+            result = trading_app.run_analysis(symbol, timeframe="1h", strategy=strategy, market_df=df,
+                                              chart_format="json", **options)
+            templates.append(result[1])
+    finally:
+        patch.undo()
+    return templates
+
+
+@pytest.mark.parametrize("language", LANGUAGES)
+def test_real_reports_match_reference(report_templates, language):
+    for template in report_templates:
+        assert "{" in template
+        translated = translate_markdown(template, language)
+        assert translated == reference_translate(template, language)
+        assert translated != template
+
+
+@pytest.mark.parametrize("language", LANGUAGES)
+def test_overlapping_keys(language):
+    keys = _all_keys()
+    # Ключ, который целиком входит в более длинный ключ (price / current_price)
+    pairs = [(short, long) for short in keys for long in keys if short != long and short in long]
+    assert pairs
+    lines = []
+    for short, long in pairs:
+        lines.append(f"{{{short}}} {{{long}}} {{{{{long}}}}} {{{{{short}}}}}")
+        lines.append(f"{{{long}}}{{{short}}}|{{{{{short}}}}}{{{long}}}|{{{{{{{short}}}}}}}")
+        lines.append(f"{short} {{x_{short}}} {{{short}_x}} {{{long[:len(long) - 1]}}}")
+    text = "\n".join(lines)
+    assert translate_markdown(text, language) == reference_translate(text, language)
+
+
+@pytest.mark.parametrize("language", LANGUAGES)
+def test_every_key_and_unknown_tokens(language):
+    keys = _all_keys()
+    text = " ".join(f"{{{key}}} {{{{{key}}}}}" for key in keys)
+    text += " {confidence} {{not_a_key}} {} {{}} { price } price}"
+    assert translate_markdown(text, language) == reference_translate(text, language)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("language", ["en", "uk"])
+def test_benchmark_against_reference_chain(report_templates, language):
+    """Время перевода реальных отчетов: прежняя цепочка re.sub против одного прохода (--benchmark -s)."""
+    translate_markdown(report_templates[0], language)  # Компиляция выражения - вне замера
+    old = best_time(lambda: [reference_translate(t, language) for t in report_templates], repeat=3)
+    new = best_time(lambda: [translate_markdown(t, language) for t in report_templates], repeat=10)
+    print(f"\ntranslate {language}, {len(report_templates)} отчета: цепочка {old * 1000:.1f} мс, "
+          f"одно выражение {new * 1000:.2f} мс, x{old / new:.0f}")
+    assert new * 5 < old
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""walk_forward_backtest: тестовые окна продолжают капитал предыдущего окна."""
+
+import pytest
+
+import trading_app
+
+
+@pytest.fixture
+def frame(ohlcv):
+    df = trading_app.build_indicator_frame(ohlcv(3000, seed=0))
+    trading_app._add_backtest_columns(df)
+    return df
+
+
+@pytest.mark.parametrize("risk", [0.01, 0.2])
+def test_windows_chain_running_capital(frame, risk):
+    capital = 10000
+    result = trading_app.walk_forward_backtest(frame, trading_app.STRATEGIES["Агрессивная"], ["RSI"],
+                                               capital=capital, risk=risk, folds=4, return_trades=True)
+    trades = result["trades"]
+    assert len(result["windows"]) == 4 and trades
+    # Каждая сделка начинается с капитала после предыдущей, в том числе на границах окон
+    assert trades[0]["capital_before"] == capital
+    for previous, trade in zip(trades, trades[1:]):
+        assert trade["capital_before"] == previous["capital_after"]
+    curve = [capital] + [trade["capital_after"] for trade in trades]
+    assert max(curve) <= capital * 11
+    assert result["equity_curve"] == curve[-100:]
+    assert result["final_capital"] == round(curve[-1], 2)
+    assert result["total_trades"] == len(trades)
+
+
+def test_capital_cap_binds_across_windows(frame):
+    capital = 10000
+    result = trading_app.walk_forward_backtest(frame, trading_app.STRATEGIES["Агрессивная"], ["RSI"],
+                                               capital=capital, risk=0.2, folds=4, return_trades=True)
+    afters = [trade["capital_after"] for trade in result["trades"]]
+    assert max(afters) == capital * 11
@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import io
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 import traceback
@@ -9,12 +15,42 @@ import pandas as pd
 import numpy as np
 import matplotlib
 matplotlib.use("Agg")
-import matplotlib.pyplot as plt
 import requests
 from scipy.stats import norm
 
+from core.candle_store import CandleStore, exchange_id_of, timeframe_to_ms
+from core.chart_renderer import ChartRenderer, chart_spec
+from core.indicator_cache import IndicatorCache
+from core.kline_stream import BinanceWebSocketSource, KlineStreamService
+from core.rate_limiter import RateLimitedExchange, SharedRateLimiter
+from core.report_store import ReportStore
+
 LOCAL_TZ = ZoneInfo("Europe/Kyiv")
-exchange = ccxt.binance({"enableRateLimit": True, "timeout": 20000})
+
+# Общий для всех процессов бюджет веса запросов к Binance (RATE_LIMIT=0 - отключить)
+RATE_LIMITER = SharedRateLimiter.from_env(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "binance_rate_limit.json")
+)
+exchange = RateLimitedExchange.wrap(ccxt.binance({"enableRateLimit": True, "timeout": 20000}), RATE_LIMITER)
+
+# Локальное хранилище свечей (CANDLE_STORE=0 - отключить, CANDLE_STORE_PATH - путь к базе)
+CANDLE_STORE = CandleStore.from_env(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "candles.db")
+)
+
+# Кэш кадров с индикаторами (INDICATOR_CACHE_ENTRIES / INDICATOR_CACHE_MAX_MB / INDICATOR_CACHE_TTL)
+INDICATOR_CACHE = IndicatorCache.from_env()
+
+# Отрисовка графиков анализа в пуле процессов (CHART_RENDER_WORKERS=0 - в текущем процессе)
+CHART_RENDERER = ChartRenderer.from_env()
+
+# Отчеты с ключами переводов для отрисовки на других языках (REPORT_STORE=0 - отключить)
+REPORT_STORE = ReportStore.from_env(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "reports.db")
+)
+
+# Потоковые свечи по WebSocket (start_kline_stream); None - история всегда через REST
+KLINE_STREAM = None
 
 # --- Конфигурация ---
 STRATEGIES = {
@@ -31,6 +67,23 @@ TRADING_TYPES = {
     "Долгосрочная": {"mult_sl": 3.0, "mult_tp": 4.0, "hold": "месяцы"},
 }
 
+# Значения из формы, CLI и настроек автосигналов -> ключи STRATEGIES / TRADING_TYPES
+STRATEGY_INPUT_MAP = {
+    "conservative": "Консервативная",
+    "balanced": "Сбалансированная",
+    "aggressive": "Агрессивная",
+    **{name: name for name in STRATEGIES},
+}
+
+TRADING_TYPE_INPUT_MAP = {
+    "scalping": "Скальпинг",
+    "daytrading": "Дейтрейдинг",
+    "swing": "Свинг",
+    "medium_term": "Среднесрочная",
+    "long_term": "Долгосрочная",
+    **{name: name for name in TRADING_TYPES},
+}
+
 DEFAULT_TIMEFRAMES = {
     "Скальпинг": "5m",
     "Дейтрейдинг": "1h",
@@ -201,6 +254,13 @@ REPORT_TRANSLATIONS = {
         "backtest_max_drawdown": "Максимальная просадка",
         "backtest_avg_rr": "Средний R:R",
         "backtest_final_capital": "Финальный капитал",
+        "backtest_walk_forward": "walk-forward: {windows} тестовых окон, вне выборки",
+        "backtest_in_sample_win_rate": "Win Rate на обучающих окнах",
+        "backtest_mc_return_range": "Монте-Карло ({simulations} симуляций): доходность 5–95 перцентиль",
+        "backtest_mc_median_return": "Монте-Карло: медианная доходность",
+        "backtest_mc_drawdown_p95": "Монте-Карло: просадка (95 перцентиль)",
+        "backtest_mc_prob_loss": "Монте-Карло: вероятность убытка",
+        "backtest_mc_prob_ruin": "Монте-Карло: вероятность просадки ≥{ruin}%",
         "all_confirmations": "Все подтверждения",
         # Ошибки и сообщения
         "error_user_not_found": "Пользователь не найден",
@@ -486,6 +546,13 @@ REPORT_TRANSLATIONS = {
         "backtest_max_drawdown": "Max Drawdown",
         "backtest_avg_rr": "Avg R:R",
         "backtest_final_capital": "Final Capital",
+        "backtest_walk_forward": "walk-forward: {windows} test windows, out-of-sample",
+        "backtest_in_sample_win_rate": "In-sample Win Rate",
+        "backtest_mc_return_range": "Monte Carlo ({simulations} runs): return 5th–95th percentile",
+        "backtest_mc_median_return": "Monte Carlo: median return",
+        "backtest_mc_drawdown_p95": "Monte Carlo: drawdown (95th percentile)",
+        "backtest_mc_prob_loss": "Monte Carlo: probability of loss",
+        "backtest_mc_prob_ruin": "Monte Carlo: probability of ≥{ruin}% drawdown",
         "all_confirmations": "All confirmations",
         # Errors and messages
         "error_user_not_found": "User not found",
@@ -777,6 +844,13 @@ REPORT_TRANSLATIONS = {
         "backtest_max_drawdown": "Максимальна просадка",
         "backtest_avg_rr": "Середній R:R",
         "backtest_final_capital": "Фінальний капітал",
+        "backtest_walk_forward": "walk-forward: {windows} тестових вікон, поза вибіркою",
+        "backtest_in_sample_win_rate": "Win Rate на навчальних вікнах",
+        "backtest_mc_return_range": "Монте-Карло ({simulations} симуляцій): дохідність 5–95 перцентиль",
+        "backtest_mc_median_return": "Монте-Карло: медіанна дохідність",
+        "backtest_mc_drawdown_p95": "Монте-Карло: просідання (95 перцентиль)",
+        "backtest_mc_prob_loss": "Монте-Карло: ймовірність збитку",
+        "backtest_mc_prob_ruin": "Монте-Карло: ймовірність просідання ≥{ruin}%",
         "all_confirmations": "Всі підтвердження",
         # Помилки API
         "error_user_not_found": "Користувач не знайдений",
@@ -1007,59 +1081,86 @@ def get_report_translation(key, language="ru", default=None, **params):
             return translation
     return translation
 
+# Токены шаблона отчета: {{key}} (двойные скобки) или {key} (одинарные - после f-строк)
+_TEMPLATE_KEY_RE = re.compile(r"\{\{(\w+)\}\}|\{(\w+)\}")
+_translation_tables = {}
+
+
+def _translation_table(lang):
+    """
+    Таблица подстановки для языка: каждый ключ любого языка -> перевод
+    (нет перевода - русский, нет и русского - сам ключ). Собирается один раз на язык.
+    """
+    table = _translation_tables.get(lang)
+    if table is None:
+        translations = REPORT_TRANSLATIONS[lang]
+        ru = REPORT_TRANSLATIONS["ru"]
+        all_keys = set()
+        for lang_code in ["ru", "en", "uk"]:
+            if lang_code in REPORT_TRANSLATIONS:
+                all_keys.update(REPORT_TRANSLATIONS[lang_code].keys())
+        table = {key: translations.get(key, ru.get(key, key)) for key in all_keys}
+        _translation_tables[lang] = table
+    return table
+
+
 def translate_markdown(md, language="ru"):
     """Заменяет все ключи {key} и {{key}} на переводы из REPORT_TRANSLATIONS
     
     Гарантирует 100% замену всех ключей на сервере перед отправкой на клиент.
     Обрабатывает вложенные ключи через множественные проходы.
     Поддерживает оба формата: {{key}} (двойные скобки) и {key} (одинарные - после f-строк).
+    Один проход - одно сканирование текста общим регулярным выражением;
+    токены, которые не являются ключами перевода, остаются как есть.
     """
-    if not md:
+    if not md or "{" not in md:
         return md
     
-    import re
     lang = language if language in REPORT_TRANSLATIONS else "ru"
-    translations = REPORT_TRANSLATIONS[lang]
-    
-    # Создаем набор всех ключей переводов для проверки
-    all_keys = set()
-    for lang_code in ["ru", "en", "uk"]:
-        if lang_code in REPORT_TRANSLATIONS:
-            all_keys.update(REPORT_TRANSLATIONS[lang_code].keys())
-    
-    # Заменяем все ключи на переводы (ключи могут содержать буквы, цифры и подчеркивания)
-    # Делаем несколько проходов для обработки вложенных ключей
+    table = _translation_table(lang)
+
+    def replace(match):
+        return table.get(match.group(1) or match.group(2), match.group(0))
+
+    # Несколько проходов - для ключей внутри переводов; стоп, когда текст перестал меняться
     result = md
     max_iterations = 10  # Максимум итераций для обработки вложенных ключей
-    iteration = 0
-    
-    while iteration < max_iterations:
+    for _ in range(max_iterations):
         prev_result = result
-        
-        # Сортируем ключи по длине (от больших к меньшим) чтобы избежать частичных замен
-        sorted_keys = sorted(all_keys, key=len, reverse=True)
-        
-        # Сначала заменяем двойные скобки {{key}}
-        for key in sorted_keys:
-            pattern = r'\{\{' + re.escape(key) + r'\}\}'
-            if re.search(pattern, result):
-                translation = translations.get(key, REPORT_TRANSLATIONS["ru"].get(key, key))
-                result = re.sub(pattern, translation, result)
-        
-        # Затем заменяем одинарные скобки {key}, но только если это ключ перевода
-        for key in sorted_keys:
-            pattern = r'\{' + re.escape(key) + r'\}'
-            if re.search(pattern, result):
-                translation = translations.get(key, REPORT_TRANSLATIONS["ru"].get(key, key))
-                result = re.sub(pattern, translation, result)
-        
-        # Если ничего не изменилось, значит все ключи заменены
+        result = _TEMPLATE_KEY_RE.sub(replace, result)
         if result == prev_result:
             break
-        iteration += 1
     
     return result
 
+def store_report(markdown_with_keys, rendered=None):
+    """
+    Сохраняет markdown отчета с ключами в REPORT_STORE.
+
+    Параметры:
+    - markdown_with_keys: отчет с ключами {{key}} (второй элемент результата run_analysis)
+    - rendered: уже отрисованные версии {язык: текст}
+
+    Возвращает:
+    - report_id или None, если хранилище отключено или недоступно
+    """
+    if REPORT_STORE is None or not markdown_with_keys:
+        return None
+    try:
+        return REPORT_STORE.put(markdown_with_keys, rendered=rendered)
+    except Exception as e:
+        print(f"⚠️ Не удалось сохранить отчет: {e}")
+        return None
+
+
+def render_report(report_id, language="ru"):
+    """Отчет report_id на языке language (с кэшем отрисовки) или None, если отчет неизвестен."""
+    if REPORT_STORE is None or not report_id:
+        return None
+    lang = language if language in REPORT_TRANSLATIONS else "ru"
+    return REPORT_STORE.render(report_id, lang, translate_markdown)
+
+
 # === вспомогательные функции ===
 def safe_fmt(x):
     try:
@@ -1318,8 +1419,16 @@ def find_psychological_levels(price, count=5):
     # Возвращаем ближайшие уровни (включая текущую цену)
     return levels[:count * 2 + 1]
 
+# Индекс обновляется раз в сутки - пакет анализов (авто-сигналы) запрашивает его один раз
+FEAR_GREED_TTL = float(os.getenv("FEAR_GREED_TTL", "300"))
+_fear_greed_cache = {"value": None, "fetched_at": 0.0}
+
+
 def get_fear_greed_index():
     """Получает Fear & Greed Index из API. Возвращает: (value: int 0-100, classification: str) или None"""
+    cached = _fear_greed_cache["value"]
+    if cached is not None and time.monotonic() - _fear_greed_cache["fetched_at"] < FEAR_GREED_TTL:
+        return cached
     try:
         response = requests.get("https://api.alternative.me/fng/", timeout=5)
         if response.status_code == 200:
@@ -1328,6 +1437,8 @@ def get_fear_greed_index():
                 latest = data["data"][0]
                 value = int(latest.get("value", 50))
                 classification = latest.get("value_classification", "Neutral")
+                _fear_greed_cache["value"] = (value, classification)
+                _fear_greed_cache["fetched_at"] = time.monotonic()
                 return value, classification
     except Exception as e:
         print(f"⚠️ Ошибка получения Fear & Greed Index: {e}")
@@ -1451,83 +1562,222 @@ def calculate_confidence_index(reliability_rating, fear_greed_value=None, volati
     confidence_index = sum(base_components.values()) + indicator_rating
     return max(0, min(100, confidence_index))
 
-def fetch_ohlcv(symbol, timeframe, history_days=30):
+OHLCV_PAGE_LIMIT = 1000  # Максимум баров в одном ответе Binance
+# Сколько страниц истории загружать одновременно (1 - строго последовательно)
+OHLCV_FETCH_WORKERS = int(os.getenv("OHLCV_FETCH_WORKERS", "4"))
+
+
+def _fetch_ohlcv_page(client, symbol, timeframe, since_ms, allow_latest=True):
+    """
+    Одна страница баров с since_ms с ретраями временных ошибок.
+    allow_latest: при ошибке startTime запросить последние бары без since
+    (для страницы из середины истории это подменило бы данные, поэтому отключаемо).
+    """
+    try:
+        # Исправляем вызов API - передаем timeframe как позиционный аргумент
+        max_attempts = 3
+        chunk = None
+        last_error = None
+        for attempt in range(1, max_attempts + 1):
+            try:
+                chunk = client.fetch_ohlcv(symbol, timeframe, since=since_ms, limit=OHLCV_PAGE_LIMIT)
+                last_error = None
+                break
+            except Exception as inner_e:
+                last_error = inner_e
+                msg = str(inner_e)
+
+                # Если проблема со startTime — пробуем запросить без since
+                if allow_latest and ("startTime" in msg or "Invalid" in msg or "-1021" in msg or "recvWindow" in msg):
+                    try:
+                        chunk = client.fetch_ohlcv(symbol, timeframe, since=None, limit=OHLCV_PAGE_LIMIT)
+                        last_error = None
+                        break
+                    except Exception as inner_e2:
+                        last_error = inner_e2
+                        msg = str(inner_e2)
+
+                # Ретрай только для сетевых/временных ошибок
+                low = msg.lower()
+                transient = any(k in low for k in [
+                    "requesttimeout",
+                    "timeout",
+                    "exchangenotavailable",
+                    "networkerror",
+                    "connectionerror",
+                    "econnreset",
+                    "etimedout",
+                    "enotfound",
+                    "503",
+                    "502",
+                    "429",
+                    "ddos"
+                ])
+                if attempt < max_attempts and transient:
+                    time.sleep(0.6 * attempt)
+                    continue
+                break
+
+        if last_error is not None:
+            raise last_error
+    except Exception as e:
+        error_msg = str(e)
+        print(f"⚠️ Ошибка fetch_ohlcv для {symbol} с timeframe {timeframe}:", error_msg)
+        # Проверяем тип ошибки и предоставляем более понятное сообщение
+        if "getaddrinfo failed" in error_msg or "Failed to resolve" in error_msg:
+            raise ConnectionError(f"Не удалось подключиться к Binance API. Проверьте интернет-соединение. ({error_msg})")
+        elif "NetworkError" in error_msg or "ConnectionError" in error_msg:
+            raise ConnectionError(f"Ошибка подключения к Binance API. Сервер недоступен. ({error_msg})")
+        else:
+            raise
+    return chunk or []
+
+
+def _fetch_ohlcv_sequential(client, symbol, timeframe, since_ms, now_ms, until_ms=None, allow_latest=True):
+    """Последовательная постраничная загрузка: каждая страница начинается после последнего бара предыдущей."""
+    all_bars = []
+    while True:
+        chunk = _fetch_ohlcv_page(client, symbol, timeframe, since_ms, allow_latest=allow_latest)
+        if not chunk:
+            break
+        if until_ms is not None:
+            all_bars.extend(bar for bar in chunk if bar[0] <= until_ms)
+            if chunk[-1][0] >= until_ms:
+                break
+        else:
+            all_bars.extend(chunk)
+        since_ms = chunk[-1][0] + 1
+        if len(chunk) < OHLCV_PAGE_LIMIT or since_ms >= now_ms:
+            break
+    return all_bars
+
+
+class _RequestSpacer:
+    """Минимальный интервал между стартами запросов из нескольких потоков (лимит биржи)."""
+
+    def __init__(self, interval_sec):
+        self.interval_sec = max(0.0, interval_sec)
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval_sec:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self.interval_sec
+        if start_at > now:
+            time.sleep(start_at - now)
+
+
+def _fetch_ohlcv_parallel(client, symbol, timeframe, since_ms, now_ms, until_ms, tf_ms, workers):
+    """
+    Параллельная загрузка: границы страниц известны заранее (since + k * 1000 баров),
+    поэтому страницы запрашиваются одновременно, затем склеиваются без дублей.
+    Пропуски в склеенной последовательности перезапрашиваются последовательно.
+
+    Возвращает:
+    - Список баров, отсортированный по ts
+    """
+    end_ms = now_ms if until_ms is None else min(until_ms, now_ms)
+    page_span = OHLCV_PAGE_LIMIT * tf_ms
+    starts = list(range(int(since_ms), int(end_ms) + 1, page_span))
+    rate_limit_ms = getattr(client, "rateLimit", 0) if getattr(client, "enableRateLimit", False) else 0
+    spacer = _RequestSpacer((rate_limit_ms or 0) / 1000)
+
+    def load_page(start):
+        spacer.wait()
+        chunk = _fetch_ohlcv_page(client, symbol, timeframe, start, allow_latest=False)
+        stop = min(start + page_span - 1, end_ms)
+        return [bar for bar in chunk if start <= bar[0] <= stop]
+
+    bars = {}
+    with ThreadPoolExecutor(max_workers=min(workers, len(starts))) as pool:
+        futures = [pool.submit(load_page, start) for start in starts]
+        try:
+            for future in as_completed(futures):
+                for bar in future.result():
+                    bars[bar[0]] = bar
+        except Exception as e:
+            for future in futures:
+                future.cancel()
+            print(f"⚠️ Параллельная загрузка {symbol} {timeframe} не удалась ({e}), загружаем последовательно")
+            bars = None
+    if bars is None:
+        return _fetch_ohlcv_sequential(client, symbol, timeframe, since_ms, now_ms, until_ms)
+
+    # Пропуски между соседними барами (страница вернулась неполной) - перезапрашиваем,
+    # кроме диапазонов, где биржа уже подтвердила отсутствие свечей (пауза торгов)
+    exchange_id = exchange_id_of(client)
+    ordered = sorted(bars)
+    gaps = [(a + tf_ms, b - 1) for a, b in zip(ordered, ordered[1:]) if b - a > tf_ms]
+    if gaps and CANDLE_STORE is not None:
+        try:
+            gaps = [(gap_start, gap_end) for gap_start, gap_end in gaps
+                    if (CANDLE_STORE.empty_until(exchange_id, symbol, timeframe, gap_start) or -1) < gap_end]
+        except sqlite3.Error:
+            pass
+    for gap_start, gap_end in gaps:
+        found = _fetch_ohlcv_sequential(client, symbol, timeframe, gap_start, now_ms, until_ms=gap_end, allow_latest=False)
+        for bar in found:
+            bars[bar[0]] = bar
+        if CANDLE_STORE is not None:
+            # Что осталось пустым после перезапроса - пустое на бирже (пропуск между двумя барами уже закрыт)
+            try:
+                edges = [gap_start - tf_ms] + sorted(bar[0] for bar in found if gap_start <= bar[0] <= gap_end) + [gap_end + 1]
+                for a, b in zip(edges, edges[1:]):
+                    if b - a > tf_ms:
+                        CANDLE_STORE.mark_empty(exchange_id, symbol, timeframe, a + tf_ms, b - 1)
+            except sqlite3.Error:
+                pass
+    if gaps:
+        print(f"⚠️ {symbol} {timeframe}: перезапрошено пропусков в истории: {len(gaps)}")
+    return [bars[ts] for ts in sorted(bars)]
+
+
+def _fetch_ohlcv_range(client, symbol, timeframe, since_ms, now_ms, until_ms=None):
+    """Постраничная загрузка баров с биржи начиная с since_ms (до until_ms включительно, если задан)."""
+    tf_ms = timeframe_to_ms(timeframe)
+    end_ms = now_ms if until_ms is None else min(until_ms, now_ms)
+    # Месячные свечи разной длины - границы страниц заранее не вычислить
+    if (OHLCV_FETCH_WORKERS > 1 and tf_ms and not timeframe.endswith("M")
+            and end_ms - since_ms > OHLCV_PAGE_LIMIT * tf_ms):
+        return _fetch_ohlcv_parallel(client, symbol, timeframe, since_ms, now_ms, until_ms, tf_ms, OHLCV_FETCH_WORKERS)
+    return _fetch_ohlcv_sequential(client, symbol, timeframe, since_ms, now_ms, until_ms)
+
+
+def fetch_ohlcv(symbol, timeframe, history_days=30, client=None):
     if not timeframe:
         timeframe = '1h'  # Значение по умолчанию
-    
+    if client is None:
+        client = exchange
+
     since_dt = datetime.utcnow() - timedelta(days=history_days)
     since_ms = int(since_dt.timestamp() * 1000)
-    all_bars = []
     now_ms = int(datetime.utcnow().timestamp() * 1000)
 
     # ✅ Защита от неверных часов системы: startTime не должен быть в будущем
     if since_ms > now_ms:
         since_ms = now_ms - int(history_days * 24 * 60 * 60 * 1000)
 
-    while True:
+    all_bars = None
+    if KLINE_STREAM is not None:
+        # ✅ Поток свечей: история из хранилища + текущая свеча из памяти, без запроса к бирже
         try:
-            # Исправляем вызов API - передаем timeframe как позиционный аргумент
-            max_attempts = 3
-            chunk = None
-            last_error = None
-            for attempt in range(1, max_attempts + 1):
-                try:
-                    chunk = exchange.fetch_ohlcv(symbol, timeframe, since=since_ms, limit=1000)
-                    last_error = None
-                    break
-                except Exception as inner_e:
-                    last_error = inner_e
-                    msg = str(inner_e)
-
-                    # Если проблема со startTime — пробуем запросить без since
-                    if "startTime" in msg or "Invalid" in msg or "-1021" in msg or "recvWindow" in msg:
-                        try:
-                            chunk = exchange.fetch_ohlcv(symbol, timeframe, since=None, limit=1000)
-                            last_error = None
-                            break
-                        except Exception as inner_e2:
-                            last_error = inner_e2
-                            msg = str(inner_e2)
-
-                    # Ретрай только для сетевых/временных ошибок
-                    low = msg.lower()
-                    transient = any(k in low for k in [
-                        "requesttimeout",
-                        "timeout",
-                        "exchangenotavailable",
-                        "networkerror",
-                        "connectionerror",
-                        "econnreset",
-                        "etimedout",
-                        "enotfound",
-                        "503",
-                        "502",
-                        "429",
-                        "ddos"
-                    ])
-                    if attempt < max_attempts and transient:
-                        time.sleep(0.6 * attempt)
-                        continue
-                    break
-
-            if last_error is not None:
-                raise last_error
-        except Exception as e:
-            error_msg = str(e)
-            print(f"⚠️ Ошибка fetch_ohlcv для {symbol} с timeframe {timeframe}:", error_msg)
-            # Проверяем тип ошибки и предоставляем более понятное сообщение
-            if "getaddrinfo failed" in error_msg or "Failed to resolve" in error_msg:
-                raise ConnectionError(f"Не удалось подключиться к Binance API. Проверьте интернет-соединение. ({error_msg})")
-            elif "NetworkError" in error_msg or "ConnectionError" in error_msg:
-                raise ConnectionError(f"Ошибка подключения к Binance API. Сервер недоступен. ({error_msg})")
-            else:
-                raise
-        if not chunk:
-            break
-        all_bars.extend(chunk)
-        since_ms = chunk[-1][0] + 1
-        if len(chunk) < 1000 or since_ms >= now_ms:
-            break
+            all_bars = KLINE_STREAM.bars_since(exchange_id_of(client), symbol, timeframe, since_ms)
+        except sqlite3.Error:
+            all_bars = None
+    if all_bars is None and CANDLE_STORE is not None:
+        # ✅ Локальное хранилище: с биржи докачивается только недостающий хвост
+        try:
+            all_bars = CANDLE_STORE.sync(client, symbol, timeframe, since_ms, now_ms, _fetch_ohlcv_range)
+            if KLINE_STREAM is not None:
+                KLINE_STREAM.note_synced(exchange_id_of(client), symbol, timeframe, now_ms)
+        except sqlite3.Error as e:
+            print(f"⚠️ Хранилище свечей недоступно, загружаем с биржи напрямую: {e}")
+    if all_bars is None:
+        all_bars = _fetch_ohlcv_range(client, symbol, timeframe, since_ms, now_ms)
 
     if not all_bars:
         return pd.DataFrame()
@@ -1540,6 +1790,209 @@ def fetch_ohlcv(symbol, timeframe, history_days=30):
         df = df[df.index.date < datetime.now(LOCAL_TZ).date()]
     return df
 
+def parse_stream_subscriptions(value):
+    """"BTC/USDT:1h, ETH/USDT:5m" -> [("BTC/USDT", "1h"), ("ETH/USDT", "5m")]."""
+    subscriptions = []
+    for item in (value or "").split(","):
+        symbol, _, timeframe = item.strip().rpartition(":")
+        if symbol and timeframe:
+            subscriptions.append((symbol.strip().upper(), timeframe.strip()))
+    return subscriptions
+
+
+def start_kline_stream(subscriptions, source=None):
+    """
+    Запускает (один раз на процесс) сервис потоковых свечей и подписывает его на рынки.
+
+    Параметры:
+    - subscriptions: список (symbol, timeframe); повторные подписки игнорируются
+    - source: KlineSource (по умолчанию WebSocket Binance, нужен пакет websocket-client)
+
+    Возвращает:
+    - KlineStreamService или None, если поток недоступен
+    """
+    global KLINE_STREAM
+    if KLINE_STREAM is None:
+        if CANDLE_STORE is None:
+            print("⚠️ Поток свечей требует локального хранилища свечей (CANDLE_STORE)")
+            return None
+        try:
+            source = source or BinanceWebSocketSource()
+        except ImportError as e:
+            print(f"⚠️ Поток свечей недоступен: {e}")
+            return None
+        service = KlineStreamService(
+            CANDLE_STORE, source, exchange_id=exchange_id_of(exchange),
+            stale_after=float(os.getenv("KLINE_STREAM_STALE_AFTER", "10")),
+        )
+        for symbol, timeframe in subscriptions:
+            service.subscribe(symbol, timeframe)
+        service.start()
+        KLINE_STREAM = service
+        print(f"✅ Поток свечей запущен: {len(subscriptions)} подписок")
+    else:
+        for symbol, timeframe in subscriptions:
+            KLINE_STREAM.subscribe(symbol, timeframe)
+    return KLINE_STREAM
+
+
+def live_indicators(symbol, timeframe, history_days=30, include_forming=False):
+    """
+    Последняя строка индикаторов рынка из потока свечей без пересчета всего кадра.
+
+    При первом вызове история рынка синхронизируется в хранилище и по ней строится
+    инкрементальное состояние; дальше каждая закрытая свеча потока продвигает его за O(1).
+
+    Возвращает:
+    - dict с колонками build_indicator_frame или None, если поток по рынку не запущен
+    """
+    if KLINE_STREAM is None:
+        return None
+    if not KLINE_STREAM.is_tracking(symbol, timeframe):
+        KLINE_STREAM.subscribe(symbol, timeframe)
+        since_ms = int((datetime.utcnow() - timedelta(days=history_days)).timestamp() * 1000)
+        try:
+            fetch_ohlcv(symbol, timeframe, history_days)
+            if not KLINE_STREAM.track_indicators(symbol, timeframe, since_ms):
+                return None
+        except Exception as e:
+            print(f"⚠️ Не удалось подготовить индикаторы {symbol} {timeframe}: {e}")
+            return None
+    return KLINE_STREAM.indicators(symbol, timeframe, include_forming=include_forming)
+
+
+def _supertrend_recursion(upperband, lowerband, close, final_upper, final_lower, supertrend, supertrend_dir):
+    """
+    Рекурсия финальных полос и направления Supertrend (заполняет выходные массивы на месте).
+    final_upper/final_lower на входе - копии upperband/lowerband.
+    Сравнение x != x - проверка на NaN, одинаково работающая в Python и numba.
+    """
+    n = len(close)
+    for i in range(1, n):
+        if final_upper[i - 1] != final_upper[i - 1]:
+            final_upper[i - 1] = upperband[i - 1]
+        if final_lower[i - 1] != final_lower[i - 1]:
+            final_lower[i - 1] = lowerband[i - 1]
+
+        if upperband[i] < final_upper[i - 1] or close[i - 1] > final_upper[i - 1]:
+            final_upper[i] = upperband[i]
+        else:
+            final_upper[i] = final_upper[i - 1]
+
+        if lowerband[i] > final_lower[i - 1] or close[i - 1] < final_lower[i - 1]:
+            final_lower[i] = lowerband[i]
+        else:
+            final_lower[i] = final_lower[i - 1]
+
+    if n:
+        supertrend[0] = final_upper[0]
+        supertrend_dir[0] = -1.0
+    for i in range(1, n):
+        if supertrend[i - 1] == final_upper[i - 1]:
+            if close[i] <= final_upper[i]:
+                supertrend[i] = final_upper[i]
+                supertrend_dir[i] = -1.0
+            else:
+                supertrend[i] = final_lower[i]
+                supertrend_dir[i] = 1.0
+        else:
+            if close[i] >= final_lower[i]:
+                supertrend[i] = final_lower[i]
+                supertrend_dir[i] = 1.0
+            else:
+                supertrend[i] = final_upper[i]
+                supertrend_dir[i] = -1.0
+
+
+# numba (если установлен) компилирует рекурсию в машинный код; без него цикл идет по спискам Python
+try:
+    import numba
+    _supertrend_recursion_jit = numba.njit(_supertrend_recursion)
+except Exception:
+    _supertrend_recursion_jit = None
+
+
+def _supertrend_bands(upperband, lowerband, close):
+    """
+    Финальные полосы, линия и направление Supertrend по массивам NumPy.
+
+    Возвращает:
+    - (final_upper, final_lower, supertrend, supertrend_dir) - массивы float64
+    """
+    n = len(close)
+    if _supertrend_recursion_jit is not None:
+        final_upper = upperband.copy()
+        final_lower = lowerband.copy()
+        supertrend = np.full(n, np.nan)
+        supertrend_dir = np.full(n, np.nan)
+        try:
+            _supertrend_recursion_jit(upperband, lowerband, close, final_upper, final_lower, supertrend, supertrend_dir)
+            return final_upper, final_lower, supertrend, supertrend_dir
+        except Exception:
+            print("⚠️ numba Supertrend недоступен, используем Python-версию:", traceback.format_exc())
+
+    # Поэлементный доступ к спискам Python в разы быстрее, чем к массивам NumPy или .iat
+    final_upper = upperband.tolist()
+    final_lower = lowerband.tolist()
+    supertrend = [np.nan] * n
+    supertrend_dir = [np.nan] * n
+    _supertrend_recursion(upperband.tolist(), lowerband.tolist(), close.tolist(),
+                          final_upper, final_lower, supertrend, supertrend_dir)
+    return (np.array(final_upper, dtype=float), np.array(final_lower, dtype=float),
+            np.array(supertrend, dtype=float), np.array(supertrend_dir, dtype=float))
+
+
+def _pivot_masks(df, n=2):
+    """
+    Маски локальных минимумов/максимумов: Low/High строго ниже/выше n свечей слева и справа.
+
+    Возвращает:
+    - (pivot_low, pivot_high) - булевы массивы NumPy
+    """
+    low = df["Low"]
+    high = df["High"]
+    pivot_low = pd.Series(True, index=df.index)
+    pivot_high = pd.Series(True, index=df.index)
+    for k in range(1, n + 1):
+        pivot_low &= (low < low.shift(k)) & (low < low.shift(-k))
+        pivot_high &= (high > high.shift(k)) & (high > high.shift(-k))
+    return pivot_low.to_numpy(dtype=bool), pivot_high.to_numpy(dtype=bool)
+
+
+def _last_two_pivots(values, mask):
+    """
+    Для каждой строки - значения последней и предпоследней точки разворота (forward-fill).
+
+    Возвращает:
+    - (last, prev) - массивы float, NaN пока точек разворота недостаточно
+    """
+    n = len(values)
+    last = np.full(n, np.nan)
+    prev = np.full(n, np.nan)
+    pivot_values = values[mask]
+    if len(pivot_values) == 0:
+        return last, prev
+    count = np.cumsum(mask)
+    has_last = count >= 1
+    has_prev = count >= 2
+    last[has_last] = pivot_values[count[has_last] - 1]
+    prev[has_prev] = pivot_values[count[has_prev] - 2]
+    return last, prev
+
+
+def _market_structure(high, low, trend_up, pivot_high, pivot_low):
+    """
+    Структура рынка (MSTRUCT): в восходящем тренде - повышающиеся максимумы и минимумы,
+    в нисходящем - понижающиеся. False, пока нет двух максимумов и двух минимумов.
+    """
+    last_ph, prev_ph = _last_two_pivots(high, pivot_high)
+    last_pl, prev_pl = _last_two_pivots(low, pivot_low)
+    higher = (last_ph > prev_ph) & (last_pl > prev_pl)
+    lower = (last_ph < prev_ph) & (last_pl < prev_pl)
+    # Сравнения с NaN дают False, поэтому строки без двух точек разворота остаются False
+    return np.where(trend_up, higher, lower)
+
+
 def add_indicators(df):
     df = df.copy()
     df["EMA_20"] = df["Close"].ewm(span=20).mean()
@@ -1572,26 +2025,15 @@ def add_indicators(df):
     except Exception:
         df["VWAP"] = np.nan
 
-    try:
-        n = 2
-        pivot_low = (
-            (df["Low"] < df["Low"].shift(1)) &
-            (df["Low"] < df["Low"].shift(2)) &
-            (df["Low"] < df["Low"].shift(-1)) &
-            (df["Low"] < df["Low"].shift(-2))
-        )
-        pivot_high = (
-            (df["High"] > df["High"].shift(1)) &
-            (df["High"] > df["High"].shift(2)) &
-            (df["High"] > df["High"].shift(-1)) &
-            (df["High"] > df["High"].shift(-2))
-        )
+    # Точки разворота (по 2 свечи с каждой стороны) - общие для AVWAP и MSTRUCT
+    pivot_low, pivot_high = _pivot_masks(df)
 
+    try:
         trend_last = df["Trend"].iloc[-1] if len(df) else "Uptrend"
         if trend_last == "Uptrend":
-            pivots = np.where(pivot_low.fillna(False).values)[0]
+            pivots = np.flatnonzero(pivot_low)
         else:
-            pivots = np.where(pivot_high.fillna(False).values)[0]
+            pivots = np.flatnonzero(pivot_high)
 
         anchor_pos = int(pivots[-1]) if len(pivots) else 0
         avwap = pd.Series(index=df.index, dtype=float)
@@ -1635,47 +2077,11 @@ def add_indicators(df):
         upperband = hl2 + st_mult * atr_st
         lowerband = hl2 - st_mult * atr_st
 
-        final_upper = upperband.copy()
-        final_lower = lowerband.copy()
-        close = df["Close"].values
-
-        for i in range(1, len(df)):
-            if np.isnan(final_upper.iat[i - 1]):
-                final_upper.iat[i - 1] = upperband.iat[i - 1]
-            if np.isnan(final_lower.iat[i - 1]):
-                final_lower.iat[i - 1] = lowerband.iat[i - 1]
-
-            if upperband.iat[i] < final_upper.iat[i - 1] or close[i - 1] > final_upper.iat[i - 1]:
-                final_upper.iat[i] = upperband.iat[i]
-            else:
-                final_upper.iat[i] = final_upper.iat[i - 1]
-
-            if lowerband.iat[i] > final_lower.iat[i - 1] or close[i - 1] < final_lower.iat[i - 1]:
-                final_lower.iat[i] = lowerband.iat[i]
-            else:
-                final_lower.iat[i] = final_lower.iat[i - 1]
-
-        supertrend = pd.Series(index=df.index, dtype=float)
-        supertrend_dir = pd.Series(index=df.index, dtype=float)
-        if len(df):
-            supertrend.iat[0] = final_upper.iat[0]
-            supertrend_dir.iat[0] = -1.0
-        for i in range(1, len(df)):
-            prev_st = supertrend.iat[i - 1]
-            if prev_st == final_upper.iat[i - 1]:
-                if close[i] <= final_upper.iat[i]:
-                    supertrend.iat[i] = final_upper.iat[i]
-                    supertrend_dir.iat[i] = -1.0
-                else:
-                    supertrend.iat[i] = final_lower.iat[i]
-                    supertrend_dir.iat[i] = 1.0
-            else:
-                if close[i] >= final_lower.iat[i]:
-                    supertrend.iat[i] = final_lower.iat[i]
-                    supertrend_dir.iat[i] = 1.0
-                else:
-                    supertrend.iat[i] = final_upper.iat[i]
-                    supertrend_dir.iat[i] = -1.0
+        final_upper, final_lower, supertrend, supertrend_dir = _supertrend_bands(
+            upperband.to_numpy(dtype=float), lowerband.to_numpy(dtype=float), df["Close"].to_numpy(dtype=float)
+        )
+        supertrend = pd.Series(supertrend, index=df.index)
+        supertrend_dir = pd.Series(supertrend_dir, index=df.index)
 
         df["SUPERTREND"] = supertrend
         df["SUPERTREND_DIR"] = supertrend_dir
@@ -1684,39 +2090,13 @@ def add_indicators(df):
         df["SUPERTREND_DIR"] = np.nan
 
     try:
-        pivot_low = (
-            (df["Low"] < df["Low"].shift(1)) &
-            (df["Low"] < df["Low"].shift(2)) &
-            (df["Low"] < df["Low"].shift(-1)) &
-            (df["Low"] < df["Low"].shift(-2))
-        ).fillna(False).values
-        pivot_high = (
-            (df["High"] > df["High"].shift(1)) &
-            (df["High"] > df["High"].shift(2)) &
-            (df["High"] > df["High"].shift(-1)) &
-            (df["High"] > df["High"].shift(-2))
-        ).fillna(False).values
-
-        last_ph = None
-        prev_ph = None
-        last_pl = None
-        prev_pl = None
-        mstruct = np.zeros(len(df), dtype=bool)
-        for i in range(len(df)):
-            if pivot_high[i]:
-                prev_ph = last_ph
-                last_ph = float(df["High"].iat[i])
-            if pivot_low[i]:
-                prev_pl = last_pl
-                last_pl = float(df["Low"].iat[i])
-
-            trend_i = df["Trend"].iat[i]
-            if prev_ph is None or prev_pl is None or last_ph is None or last_pl is None:
-                mstruct[i] = False
-            elif trend_i == "Uptrend":
-                mstruct[i] = (last_ph > prev_ph) and (last_pl > prev_pl)
-            else:
-                mstruct[i] = (last_ph < prev_ph) and (last_pl < prev_pl)
+        mstruct = _market_structure(
+            df["High"].to_numpy(dtype=float),
+            df["Low"].to_numpy(dtype=float),
+            (df["Trend"] == "Uptrend").to_numpy(),
+            pivot_high,
+            pivot_low,
+        )
         df["MSTRUCT"] = mstruct
     except Exception:
         df["MSTRUCT"] = False
@@ -1762,6 +2142,72 @@ def compute_adx(df, period=14):
         print("⚠️ compute_adx failed:", traceback.format_exc())
         return pd.Series(0, index=df.index)
 
+def build_indicator_frame(df, symbol=None, timeframe=None):
+    """
+    Полный набор индикаторов для анализа: add_indicators + VWMA/Bollinger + ADX.
+
+    Если переданы symbol и timeframe, результат кэшируется по ключу
+    (символ, таймфрейм, время последней свечи, количество строк), и повторный
+    запрос того же рынка в пределах свечи не пересчитывает индикаторы.
+    Всегда возвращает собственную копию кадра - вызывающий код может ее изменять.
+    """
+    key = None
+    if symbol and timeframe and not df.empty:
+        key = (symbol, timeframe, df.index[-1], len(df))
+        cached = INDICATOR_CACHE.get(key)
+        if cached is not None:
+            return cached.copy()
+
+    df = add_indicators(df)
+    df["VWMA_20"] = (df["Close"] * df["Volume"]).rolling(20).sum() / df["Volume"].rolling(20).sum()
+    df["BB_middle"] = df["Close"].rolling(20).mean()
+    df["BB_std"] = df["Close"].rolling(20).std()
+    df["BB_upper"] = df["BB_middle"] + 2 * df["BB_std"]
+    df["BB_lower"] = df["BB_middle"] - 2 * df["BB_std"]
+    df["ADX"] = compute_adx(df).fillna(0)
+
+    if key is not None:
+        INDICATOR_CACHE.put(key, df)
+        return df.copy()
+    return df
+
+def market_params(trading_type, timeframe=None, range_days=None):
+    """
+    Таймфрейм и глубина истории, с которыми run_analysis загрузит рынок.
+
+    Возвращает:
+    - (timeframe, range_days)
+    """
+    if timeframe is None:
+        timeframe = DEFAULT_TIMEFRAMES.get(trading_type, "1d")
+    if range_days is None:
+        range_days = TRADING_HISTORY_DAYS.get(trading_type, 30)
+    return timeframe, range_days
+
+
+def prepare_market_frame(symbol, timeframe, history_days):
+    """
+    Загружает свечи и считает индикаторы один раз для группы анализов одного рынка.
+    Результат передается в run_analysis(..., market_df=...), каждый анализ работает с копией.
+
+    Возвращает:
+    - DataFrame с индикаторами или None, если данных нет
+    """
+    df = fetch_ohlcv(symbol, timeframe, history_days=history_days)
+    if df is None or df.empty:
+        return None
+    return build_indicator_frame(df, symbol, timeframe)
+
+
+def get_indicator_cache_stats():
+    """Счетчики попаданий/промахов кэша индикаторов."""
+    return INDICATOR_CACHE.stats()
+
+
+def get_rate_limit_stats():
+    """Запросы к бирже этого процесса: вес, число и длительность ожиданий общего лимита."""
+    return RATE_LIMITER.stats() if RATE_LIMITER is not None else None
+
 def dynamic_risk(risk_pct, rsi, trend, adx=None, reliability_rating=None):
     """
     Динамически корректирует риск на основе рыночных условий.
@@ -1922,8 +2368,15 @@ def dynamic_rr(entry, sl, atr, adx, trend_dir):
     rr = abs(tp - entry) / sl_dist
     return round(rr, 2)
 
-def check_confirmations(row, selected, prev_row=None, language="ru"):
-    indicators_map = {
+# Индикаторы-подтверждения (порядок строк отчета и колонок confirmation_matrix)
+CONFIRMATION_INDICATORS = [
+    "EMA", "RSI", "MACD", "ADX", "VWMA", "VWAP", "AVWAP",
+    "SUPERTREND", "STOCHRSI", "OBV", "MSTRUCT", "BB",
+]
+
+def _row_confirmations(row, prev_row=None):
+    """Условия подтверждений для одной строки (векторный аналог - confirmation_matrix)."""
+    return {
         "EMA": row["EMA_50"] > row["EMA_200"],
         "RSI": row["RSI_14"] > 50,
         "MACD": row["MACD"] > row["Signal_Line"],
@@ -1953,8 +2406,18 @@ def check_confirmations(row, selected, prev_row=None, language="ru"):
             )
         ),
     }
+
+def check_confirmations(row, selected, prev_row=None, language="ru", flags=None):
+    """
+    Проверка выбранных подтверждений для одной строки.
+    flags - строка confirmation_matrix для этой свечи: если передана, условия берутся из нее.
+    """
+    if flags is not None:
+        indicators_map = {name: bool(flags[name]) for name in CONFIRMATION_INDICATORS}
+    else:
+        indicators_map = _row_confirmations(row, prev_row)
     t = lambda key: get_report_translation(key, language)
-    
+
     if not selected:
         return t("no_confirmations"), 0, 0, 0.0
 
@@ -2017,13 +2480,7 @@ def smart_combine_indicators(symbol, trading_type="Дейтрейдинг", time
             t = lambda key: get_report_translation(key, language, default=key)
             return ["EMA", "RSI"], t("error_insufficient_data")
         
-        df = add_indicators(df)
-        df["VWMA_20"] = (df["Close"] * df["Volume"]).rolling(20).sum() / df["Volume"].rolling(20).sum()
-        df["BB_middle"] = df["Close"].rolling(20).mean()
-        df["BB_std"] = df["Close"].rolling(20).std()
-        df["BB_upper"] = df["BB_middle"] + 2 * df["BB_std"]
-        df["BB_lower"] = df["BB_middle"] - 2 * df["BB_std"]
-        df["ADX"] = compute_adx(df).fillna(0)
+        df = build_indicator_frame(df, symbol, timeframe)
         
         # Отбираем строки с валидными Close и ATR_14
         df_valid = df.dropna(subset=["Close", "ATR_14"])
@@ -2114,470 +2571,921 @@ def smart_combine_indicators(symbol, trading_type="Дейтрейдинг", time
         t = lambda key: get_report_translation(key, language, default=key)
         return ["EMA", "RSI"], t("error_analysis")
 
-def backtest_strategy(df, strategy, trading_type, confirmation, capital=10000, risk=0.01, commission=0.001, spread=0.0):
+def _parse_confirmation(confirmation):
+    """Список выбранных подтверждений (в верхнем регистре) из строки "EMA+RSI", списка или "ALL"."""
+    user_selected = []
+    if isinstance(confirmation, str):
+        conf_str = confirmation.strip()
+        if conf_str.upper() in ("NONE", "", "N/A"):
+            user_selected = []
+        elif conf_str.upper() == "ALL":
+            user_selected = ["ALL"]
+        else:
+            user_selected = [s.strip().upper() for s in conf_str.split("+") if s.strip()]
+    elif isinstance(confirmation, (list, tuple)):
+        user_selected = [str(c).strip().upper() for c in confirmation if str(c).strip()]
+    elif confirmation is not None:
+        user_selected = [str(confirmation).strip().upper()]
+    return user_selected
+
+
+def _column_or(df, column, default):
+    """Колонка как массив float или массив-заполнитель (аналог row.get(column, default))."""
+    if column in df.columns:
+        return df[column].to_numpy(dtype=float)
+    return np.full(len(df), float(default))
+
+
+def confirmation_matrix(df):
     """
-    Бэктестинг стратегии на исторических данных.
-    
+    Условия check_confirmations для всех строк кадра за один векторный проход
+    (prev_row для каждой строки - предыдущая строка кадра).
+
+    Возвращает:
+    - DataFrame (строки × CONFIRMATION_INDICATORS) с булевыми значениями
+    """
+    close = df["Close"].to_numpy(dtype=float)
+    bb_lower = _column_or(df, "BB_lower", 0)
+    bb_upper = _column_or(df, "BB_upper", 0)
+    prev_close = np.r_[np.nan, close[:-1]]
+    prev_bb_lower = np.r_[np.nan, bb_lower[:-1]]
+    prev_bb_upper = np.r_[np.nan, bb_upper[:-1]]
+    bb = (
+        ((prev_close < prev_bb_lower) & (close >= bb_lower)) |
+        ((prev_close > prev_bb_upper) & (close <= bb_upper))
+    )
+    if len(bb):
+        # Для первой строки нет prev_row - просто "внутри полос"
+        bb[0] = (close[0] >= bb_lower[0]) and (close[0] <= bb_upper[0])
+
+    if "MSTRUCT" in df.columns:
+        mstruct = df["MSTRUCT"].astype(bool).to_numpy()
+    else:
+        mstruct = np.zeros(len(df), dtype=bool)
+
+    flags = {
+        "EMA": df["EMA_50"].to_numpy(dtype=float) > df["EMA_200"].to_numpy(dtype=float),
+        "RSI": df["RSI_14"].to_numpy(dtype=float) > 50,
+        "MACD": df["MACD"].to_numpy(dtype=float) > df["Signal_Line"].to_numpy(dtype=float),
+        "ADX": df["ADX"].to_numpy(dtype=float) > 25,
+        "VWMA": close > _column_or(df, "VWMA_20", 0),
+        "VWAP": close > _column_or(df, "VWAP", 0),
+        "AVWAP": close > _column_or(df, "AVWAP", 0),
+        "SUPERTREND": close > _column_or(df, "SUPERTREND", 0),
+        "STOCHRSI": _column_or(df, "STOCHRSI_K", 0) > 50,
+        "OBV": _column_or(df, "OBV", 0) > _column_or(df, "OBV_EMA_20", 0),
+        "MSTRUCT": mstruct,
+        "BB": bb,
+    }
+    return pd.DataFrame({name: flags[name] for name in CONFIRMATION_INDICATORS}, index=df.index)
+
+
+def check_confirmations_matrix(df, selected):
+    """
+    Векторный аналог check_confirmations для всего кадра.
+
     Параметры:
-    - df: DataFrame с историческими данными и индикаторами
-    - strategy: название стратегии
-    - trading_type: тип торговли
-    - confirmation: список подтверждений
-    - capital: начальный капитал
-    - risk: риск на сделку (%)
-    - commission: комиссия биржи (0.1% = 0.001)
-    
+    - df: DataFrame с индикаторами
+    - selected: список подтверждений (как в check_confirmations) или строка "EMA+RSI"/"ALL"
+
     Возвращает:
-    - total_trades: общее количество сделок
-    - winning_trades: количество прибыльных
-    - losing_trades: количество убыточных
-    - win_rate: процент прибыльных сделок
-    - total_profit_pct: общая прибыль (%)
-    - max_drawdown: максимальная просадка (%)
-    - avg_rr: средний R:R
-    - equity_curve: список значений капитала (для графика)
+    - (matrix, passed_count, total_count, reliability): матрица условий, массив пройденных
+      подтверждений по строкам, общее число подтверждений и массив рейтинга надежности (0-100%)
     """
-    try:
-        if df.empty or len(df) < 100:
-            return None
-        
-        strat = STRATEGIES.get(strategy, STRATEGIES["Сбалансированная"])
-        current_capital = capital
-        max_capital = capital
-        equity_curve = [capital]
-        trades = []
-        
-        # ✅ Добавляем VWMA и BB для использования в гибридном подходе
-        df["VWMA_20"] = (df["Close"] * df["Volume"]).rolling(20).sum() / df["Volume"].rolling(20).sum()
-        df["BB_middle"] = df["Close"].rolling(20).mean()
-        df["BB_std"] = df["Close"].rolling(20).std()
-        df["BB_upper"] = df["BB_middle"] + 2 * df["BB_std"]
-        df["BB_lower"] = df["BB_middle"] - 2 * df["BB_std"]
-        df["ADX"] = compute_adx(df).fillna(0)
-        
-        # Парсим подтверждения
-        user_selected = []
-        if isinstance(confirmation, str):
-            conf_str = confirmation.strip()
-            if conf_str.upper() in ("NONE", "", "N/A"):
-                user_selected = []
-            elif conf_str.upper() == "ALL":
-                user_selected = ["ALL"]
-            else:
-                user_selected = [s.strip().upper() for s in conf_str.split("+") if s.strip()]
-        elif isinstance(confirmation, (list, tuple)):
-            user_selected = [str(c).strip().upper() for c in confirmation if str(c).strip()]
-        elif confirmation is not None:
-            user_selected = [str(confirmation).strip().upper()]
-        
-        # ✅ ИСПРАВЛЕНО: Добавляем счетчики для отладки
-        trades_found = 0
-        trades_skipped_no_conf = 0
-        trades_skipped_no_entry = 0
-        
-        # Проходим по истории и ищем сигналы
-        for i in range(100, len(df) - 1):  # Пропускаем первые 100 свечей для индикаторов
-            row = df.iloc[i]
-            prev_row = df.iloc[i-1] if i > 0 else None
-            
-            # Проверяем подтверждения
-            conf_result, passed_count, total_count, _ = check_confirmations(row, user_selected, prev_row=prev_row, language="ru")
-            
-            # Если подтверждения не пройдены, пропускаем
-            if not user_selected or passed_count == 0:
-                trades_skipped_no_conf += 1
-                continue
-            
-            # Определяем направление
-            trend = row.get("Trend", "Uptrend")
-            direction = "long" if trend == "Uptrend" else "short"
-            
-            # ✅ ГИБРИДНЫЙ ПОДХОД: Вычисляем уровни входа/выхода с учетом индикаторов
-            atr = row.get("ATR_14", np.nan)
-            current_price = row.get("Close", 0)
-            
-            # ✅ FALLBACK для ATR: если ATR нулевой или слишком мал, используем минимальный ATR (0.1% от цены)
-            if pd.isna(atr) or atr == 0 or atr < current_price * 0.001:
-                atr = current_price * 0.001  # Минимальный ATR = 0.1% от цены
-            
-            ema20 = row.get("EMA_20", 0)
-            ema50 = row.get("EMA_50", 0)
-            ema200 = row.get("EMA_200", 0)
-            
-            # Получаем значения индикаторов для корректировки
-            macd = row.get("MACD", 0)
-            signal_line = row.get("Signal_Line", 0)
-            adx = row.get("ADX", 0)
-            vwma = row.get("VWMA_20", None)
-            bb_upper = row.get("BB_upper", None)
-            bb_lower = row.get("BB_lower", None)
-            current_price = row.get("Close", 0)
-            
-            # ✅ Используем calculate_entry для согласованности с run_analysis
-            base_entry = calculate_entry(row, strat, direction)
-            
-            # ✅ MACD: влияет на момент входа (смещение)
-            macd_offset = 0
-            if not pd.isna(macd) and not pd.isna(signal_line):
-                if macd > signal_line:
-                    # Бычий MACD - более агрессивный вход (ближе к цене)
-                    macd_offset = atr * 0.05  # Смещение на 5% от ATR
-                else:
-                    # Медвежий MACD - более консервативный вход
-                    macd_offset = -atr * 0.05
-            
-            # ✅ VWMA: влияет на уровень входа (смещение к VWMA)
-            vwma_weight = 0.0  # По умолчанию не влияет
-            if vwma is not None and not pd.isna(vwma) and "VWMA" in user_selected:
-                vwma_weight = 0.3  # 30% веса VWMA
-                if direction == "long":
-                    # Для лонга: смещаем вход к VWMA, если она выше
-                    entry = base_entry * (1 - vwma_weight) + vwma * vwma_weight
-                else:
-                    # Для шорта: смещаем вход к VWMA, если она ниже
-                    entry = base_entry * (1 - vwma_weight) + vwma * vwma_weight
-            else:
-                entry = base_entry
-            
-            # Применяем MACD смещение
-            entry = entry + macd_offset
-            
-            # Базовые уровни TP/SL
-            if direction == "long":
-                base_stop_loss = entry - strat["atr_sl"] * atr
-                base_take_profit = entry + strat["atr_tp"] * atr
-            else:
-                base_stop_loss = entry + strat["atr_sl"] * atr
-                base_take_profit = entry - strat["atr_tp"] * atr
-            
-            # ✅ BB: влияет на TP/SL (корректировка при близости к границам)
-            tp_multiplier = 1.0
-            sl_multiplier = 1.0
-            if bb_upper is not None and bb_lower is not None and not pd.isna(bb_upper) and not pd.isna(bb_lower) and "BB" in user_selected:
-                bb_range = bb_upper - bb_lower
-                if bb_range > 0:
-                    if direction == "long":
-                        # Для лонга: если цена близко к верхней границе BB, более консервативный TP
-                        distance_to_upper = (bb_upper - current_price) / bb_range
-                        if distance_to_upper < 0.2:  # В пределах 20% от верхней границы
-                            tp_multiplier = 0.85  # Уменьшаем TP на 15%
-                        # Если цена близко к нижней границе, более консервативный SL
-                        distance_to_lower = (current_price - bb_lower) / bb_range
-                        if distance_to_lower < 0.2:  # В пределах 20% от нижней границы
-                            sl_multiplier = 0.9  # Уменьшаем SL на 10%
-                    else:  # short
-                        # Для шорта: если цена близко к нижней границе BB, более консервативный TP
-                        distance_to_lower = (current_price - bb_lower) / bb_range
-                        if distance_to_lower < 0.2:  # В пределах 20% от нижней границы
-                            tp_multiplier = 0.85  # Уменьшаем TP на 15%
-                        # Если цена близко к верхней границе, более консервативный SL
-                        distance_to_upper = (bb_upper - current_price) / bb_range
-                        if distance_to_upper < 0.2:  # В пределах 20% от верхней границы
-                            sl_multiplier = 0.9  # Уменьшаем SL на 10%
-            
-            # Применяем множители к TP/SL
-            if direction == "long":
-                stop_loss_price = entry - (strat["atr_sl"] * atr * sl_multiplier)
-                take_profit_price = entry + (strat["atr_tp"] * atr * tp_multiplier)
-            else:
-                stop_loss_price = entry + (strat["atr_sl"] * atr * sl_multiplier)
-                take_profit_price = entry - (strat["atr_tp"] * atr * tp_multiplier)
-            
-            # ✅ ГИБРИДНЫЙ ПОДХОД: Проверяем, был бы вход исполнен (touch-based)
-            # Цена должна коснуться уровня входа в текущей или следующих свечах
-            entry_touched = False
-            actual_entry_bar = i
-            max_entry_check_bars = 3  # Проверяем текущую свечу и 2 следующие
-            
-            for check_bar in range(i, min(i + max_entry_check_bars, len(df))):
-                check_row = df.iloc[check_bar]
-                if direction == "long":
-                    # Для лонга: вход исполняется, если Low коснулся или пересек уровень входа
-                    if check_row["Low"] <= entry:
-                        entry_touched = True
-                        actual_entry_bar = check_bar
-                        break
-                else:  # short
-                    # Для шорта: вход исполняется, если High коснулся или пересек уровень входа
-                    if check_row["High"] >= entry:
-                        entry_touched = True
-                        actual_entry_bar = check_bar
-                        break
-            
-            # Пропускаем сделку, если вход не был бы исполнен
-            if not entry_touched:
-                trades_skipped_no_entry += 1
-                continue
-            
-            trades_found += 1
-            
-            # ✅ ГИБРИДНЫЙ ПОДХОД: Вычисляем размер позиции с учетом ADX
-            # Передаем ADX и reliability_rating для возможности увеличения риска
-            reliability_rating = None
-            if passed_count > 0 and total_count > 0:
-                reliability_rating = (passed_count / total_count) * 100
-            risk_adj = dynamic_risk(risk, row.get("RSI_14", 50), trend, adx=adx, reliability_rating=reliability_rating)
-            
-            # ✅ Защита от None
-            if risk_adj is None:
-                risk_adj = risk  # Fallback на базовый риск
-            
-            # ✅ ADX: дополнительно влияет на размер позиции
-            adx_multiplier = 1.0
-            if not pd.isna(adx) and "ADX" in user_selected:
-                if adx > 25:
-                    # Сильный тренд - увеличиваем позицию на 10%
-                    adx_multiplier = 1.1
-                elif adx < 20:
-                    # Слабый тренд - уменьшаем позицию на 10%
-                    adx_multiplier = 0.9
-            
-            risk_adj = risk_adj * adx_multiplier
-            risk_usd = current_capital * risk_adj
-            sl_dist = abs(entry - stop_loss_price)
-            if sl_dist <= 1e-9:
-                continue
-            
-            units = risk_usd / sl_dist
-            position_value = units * entry
-            
-            # Защита: размер позиции не может превышать доступный капитал
-            if position_value > current_capital:
-                position_value = current_capital
-                units = position_value / entry
-            
-            # Защита от отрицательного капитала
-            if current_capital <= 0:
-                break
-            
-            # Симулируем сделку - проверяем, достигнут ли TP или SL
-            # Начинаем проверку с момента фактического входа (actual_entry_bar)
-            entry_bar = actual_entry_bar
-            exit_bar = None
-            exit_price = None
-            profit_pct = 0
-            success = False
-            
-            # Проверяем TP/SL начиная со свечи после входа
-            for j in range(actual_entry_bar + 1, min(actual_entry_bar + 200, len(df))):  # Проверяем следующие 200 свечей после входа
-                future_row = df.iloc[j]
-                high = future_row["High"]
-                low = future_row["Low"]
-                
-                if direction == "long":
-                    if high >= take_profit_price:
-                        exit_price = take_profit_price
-                        exit_bar = j
-                        profit_pct = ((take_profit_price - entry) / entry) * 100
-                        success = True
-                        break
-                    elif low <= stop_loss_price:
-                        exit_price = stop_loss_price
-                        exit_bar = j
-                        profit_pct = ((stop_loss_price - entry) / entry) * 100
-                        success = False
-                        break
-                else:  # short
-                    if low <= take_profit_price:
-                        exit_price = take_profit_price
-                        exit_bar = j
-                        profit_pct = ((entry - take_profit_price) / entry) * 100
-                        success = True
-                        break
-                    elif high >= stop_loss_price:
-                        exit_price = stop_loss_price
-                        exit_bar = j
-                        profit_pct = ((entry - stop_loss_price) / entry) * 100
-                        success = False
-                        break
-            
-            # Если не достигнут ни TP, ни SL - закрываем по текущей цене
-            closed_by_time = False
-            if exit_price is None:
-                # Используем actual_entry_bar для корректного расчета времени удержания
-                final_row = df.iloc[min(actual_entry_bar + 200, len(df) - 1)]
-                exit_price = final_row["Close"]
-                exit_bar = min(actual_entry_bar + 200, len(df) - 1)
-                if direction == "long":
-                    profit_pct = ((exit_price - entry) / entry) * 100
-                else:
-                    profit_pct = ((entry - exit_price) / entry) * 100
-                success = profit_pct > 0
-                closed_by_time = True
-            
-            # Вычисляем прибыль/убыток с учётом комиссии
-            # Правильный расчёт: прибыль/убыток от размера риска, а не от всей позиции
-            tp_dist = abs(take_profit_price - entry)
-            sl_dist_actual = abs(entry - stop_loss_price)
-            
-            if closed_by_time:
-                # Если закрыто по времени, рассчитываем прибыль пропорционально фактическому движению
-                if sl_dist_actual > 0:
-                    if direction == "long":
-                        signed_move = exit_price - entry
-                    else:
-                        signed_move = entry - exit_price
-                    rr_actual = tp_dist / sl_dist_actual if sl_dist_actual > 0 else 0
-                    profit_usd = risk_usd * (signed_move / sl_dist_actual)
-                    max_profit_usd = risk_usd * rr_actual
-                    if profit_usd > max_profit_usd:
-                        profit_usd = max_profit_usd
-                    if profit_usd < -risk_usd:
-                        profit_usd = -risk_usd
-                else:
-                    profit_usd = -risk_usd  # Если SL расстояние = 0, считаем убытком
-            elif success:
-                # Прибыльная сделка (достигнут TP): получаем risk_usd * R:R
+    if isinstance(selected, str):
+        selected = _parse_confirmation(selected)
+    matrix = confirmation_matrix(df)
+    passed_count, total_count = _passed_counts(matrix, selected)
+    if total_count > 0:
+        reliability = passed_count / total_count * 100
+    else:
+        reliability = np.zeros(len(df))
+    return matrix, passed_count, total_count, reliability
+
+
+def _entry_prices(close, high, low, ema20, ema50, strat, is_long):
+    """Векторная версия calculate_entry: уровень входа для каждой строки."""
+    entry_type = strat.get("entry_type", "ema20")
+    ema_buffer = strat.get("ema_buffer", 0)
+    if entry_type == "close":
+        entry = close.copy()
+    else:
+        ema = ema50 if entry_type == "ema50" else ema20
+        entry = np.where(is_long, ema * (1 + ema_buffer), ema * (1 - ema_buffer))
+    # ✅ ВАЛИДАЦИЯ: вход в пределах High/Low свечи
+    entry = np.where(is_long & (entry > high), np.minimum(close, high), entry)
+    entry = np.where(~is_long & (entry < low), np.maximum(close, low), entry)
+    return entry
+
+
+def _first_hit(values, starts, width, thresholds, above, chunk_size=4096):
+    """
+    Для каждой позиции starts[k] - смещение первой свечи в окне [starts[k], starts[k] + width),
+    где values >= thresholds[k] (above=True) или values <= thresholds[k] (above=False).
+    above может быть массивом (направление для каждой позиции).
+
+    Возвращает:
+    - массив смещений; width, если касания в окне не было
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    result = np.full(len(starts), width, dtype=np.int64)
+    if len(starts) == 0:
+        return result
+    # NaN в хвосте - окна у конца истории просто короче
+    padded = np.concatenate([values.astype(float), np.full(width, np.nan)])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, width)
+    above = np.broadcast_to(np.asarray(above, dtype=bool), starts.shape)
+    for pos in range(0, len(starts), chunk_size):
+        sl = slice(pos, pos + chunk_size)
+        window = windows[starts[sl]]
+        thr = thresholds[sl][:, None]
+        hit = np.where(above[sl][:, None], window >= thr, window <= thr)
+        found = hit.any(axis=1)
+        result[sl] = np.where(found, hit.argmax(axis=1), width)
+    return result
+
+
+def _backtest_arrays(df):
+    """Колонки кадра, нужные движку бэктеста, в виде массивов NumPy (+ маски подтверждений)."""
+    arrays = {
+        "Open": df["Open"].to_numpy(dtype=float),
+        "High": df["High"].to_numpy(dtype=float),
+        "Low": df["Low"].to_numpy(dtype=float),
+        "Close": df["Close"].to_numpy(dtype=float),
+        "ATR_14": _column_or(df, "ATR_14", np.nan),
+        "EMA_20": _column_or(df, "EMA_20", np.nan),
+        "EMA_50": _column_or(df, "EMA_50", np.nan),
+        "RSI_14": _column_or(df, "RSI_14", 50),
+        "MACD": _column_or(df, "MACD", 0),
+        "Signal_Line": _column_or(df, "Signal_Line", 0),
+        "ADX": _column_or(df, "ADX", 0),
+        "VWMA_20": _column_or(df, "VWMA_20", np.nan),
+        "BB_upper": _column_or(df, "BB_upper", np.nan),
+        "BB_lower": _column_or(df, "BB_lower", np.nan),
+        "trend_up": (df["Trend"] == "Uptrend").to_numpy() if "Trend" in df.columns else np.ones(len(df), dtype=bool),
+        "confirmations": confirmation_matrix(df),
+    }
+    arrays["n"] = len(df)
+    return arrays
+
+
+def _passed_counts(matrix, user_selected):
+    """Количество пройденных подтверждений по строкам матрицы и их общее число (как в check_confirmations)."""
+    n = len(matrix)
+    if not user_selected:
+        return np.zeros(n, dtype=np.int64), 0
+    if "ALL" in user_selected:
+        names = CONFIRMATION_INDICATORS
+    else:
+        names = [ind.upper() for ind in user_selected]
+    passed = np.zeros(n, dtype=np.int64)
+    for name in names:
+        if name in matrix.columns:
+            passed += matrix[name].to_numpy()
+    return passed, len(names)
+
+
+def _run_backtest(arrays, strat, user_selected, capital=10000, risk=0.01, commission=0.001, spread=0.0,
+                  start=100, stop=None, curve_points=100, return_trades=False, capital_cap=None, verbose=True):
+    """
+    Движок бэктеста: сигналы, уровни и выходы считаются массивами,
+    в цикле остается только цепочка капитала по найденным сделкам.
+    Сигналы ищутся на свечах [start, stop).
+    curve_points - сколько последних точек кривой капитала вернуть (None - всю кривую).
+    return_trades - добавить в результат список сделок (для Монте-Карло).
+    capital_cap - потолок капитала (по умолчанию 11x от capital); walk-forward передает
+    капитал на начало окна и потолок от стартового капитала всего бэктеста.
+    verbose=False - без печати первых сделок и итогов (перебор параметров в strategy_optimizer).
+    """
+    n = arrays["n"]
+    if stop is None:
+        stop = n - 1
+    max_reasonable_capital = capital * 11 if capital_cap is None else capital_cap  # Максимум 10x + небольшой запас
+    current_capital = capital
+    max_capital = capital
+    equity_curve = [capital]
+    trades = []
+
+    passed_all, total_count = _passed_counts(arrays["confirmations"], user_selected)
+    candidates = np.arange(start, max(start, stop))
+
+    # Если подтверждения не пройдены, свеча пропускается
+    signal = passed_all[candidates] > 0 if user_selected else np.zeros(len(candidates), dtype=bool)
+    trades_skipped_no_conf = int((~signal).sum())
+    idx = candidates[signal]
+
+    close = arrays["Close"][idx]
+    high = arrays["High"][idx]
+    low = arrays["Low"][idx]
+    is_long = arrays["trend_up"][idx]
+
+    # ✅ FALLBACK для ATR: минимальный ATR = 0.1% от цены
+    atr = arrays["ATR_14"][idx]
+    atr = np.where(np.isnan(atr) | (atr == 0) | (atr < close * 0.001), close * 0.001, atr)
+
+    base_entry = _entry_prices(close, high, low, arrays["EMA_20"][idx], arrays["EMA_50"][idx], strat, is_long)
+
+    # ✅ MACD: смещение входа на 5% ATR
+    macd = arrays["MACD"][idx]
+    signal_line = arrays["Signal_Line"][idx]
+    macd_offset = np.where(np.isnan(macd) | np.isnan(signal_line), 0.0,
+                           np.where(macd > signal_line, atr * 0.05, -atr * 0.05))
+
+    # ✅ VWMA: смещение входа к VWMA (30% веса)
+    vwma = arrays["VWMA_20"][idx]
+    entry = base_entry
+    if "VWMA" in user_selected:
+        vwma_weight = 0.3
+        entry = np.where(np.isnan(vwma), base_entry, base_entry * (1 - vwma_weight) + vwma * vwma_weight)
+    entry = entry + macd_offset
+
+    # ✅ BB: корректировка TP/SL у границ полос
+    tp_multiplier = np.ones(len(idx))
+    sl_multiplier = np.ones(len(idx))
+    if "BB" in user_selected:
+        bb_upper = arrays["BB_upper"][idx]
+        bb_lower = arrays["BB_lower"][idx]
+        bb_range = bb_upper - bb_lower
+        with np.errstate(divide="ignore", invalid="ignore"):
+            near_upper = (bb_upper - close) / bb_range < 0.2
+            near_lower = (close - bb_lower) / bb_range < 0.2
+        valid = ~np.isnan(bb_upper) & ~np.isnan(bb_lower) & (bb_range > 0)
+        tp_multiplier = np.where(valid & np.where(is_long, near_upper, near_lower), 0.85, tp_multiplier)
+        sl_multiplier = np.where(valid & np.where(is_long, near_lower, near_upper), 0.9, sl_multiplier)
+
+    stop_loss_price = np.where(is_long,
+                               entry - (strat["atr_sl"] * atr * sl_multiplier),
+                               entry + (strat["atr_sl"] * atr * sl_multiplier))
+    take_profit_price = np.where(is_long,
+                                 entry + (strat["atr_tp"] * atr * tp_multiplier),
+                                 entry - (strat["atr_tp"] * atr * tp_multiplier))
+
+    # ✅ Вход по касанию: текущая свеча и 2 следующие
+    max_entry_check_bars = 3
+    touch_long = _first_hit(arrays["Low"], idx, max_entry_check_bars, entry, above=False)
+    touch_short = _first_hit(arrays["High"], idx, max_entry_check_bars, entry, above=True)
+    touch = np.where(is_long, touch_long, touch_short)
+    touched = touch < max_entry_check_bars
+    trades_skipped_no_entry = int((~touched).sum())
+
+    idx = idx[touched]
+    is_long = is_long[touched]
+    entry = entry[touched]
+    stop_loss_price = stop_loss_price[touched]
+    take_profit_price = take_profit_price[touched]
+    actual_entry_bar = idx + touch[touched]
+
+    # Выход: первые касания TP и SL в 199 свечах после входа (TP проверяется первым)
+    hold_bars = 199
+    first_bar = actual_entry_bar + 1
+    tp_hit = np.where(
+        is_long,
+        _first_hit(arrays["High"], first_bar, hold_bars, take_profit_price, above=True),
+        _first_hit(arrays["Low"], first_bar, hold_bars, take_profit_price, above=False),
+    )
+    sl_hit = np.where(
+        is_long,
+        _first_hit(arrays["Low"], first_bar, hold_bars, stop_loss_price, above=False),
+        _first_hit(arrays["High"], first_bar, hold_bars, stop_loss_price, above=True),
+    )
+    hit_tp = (tp_hit < hold_bars) & (tp_hit <= sl_hit)
+    hit_sl = (sl_hit < hold_bars) & ~hit_tp
+    closed_by_time = ~(hit_tp | hit_sl)
+    time_exit_bar = np.minimum(actual_entry_bar + 200, n - 1)
+    exit_price = np.where(hit_tp, take_profit_price,
+                          np.where(hit_sl, stop_loss_price, arrays["Close"][time_exit_bar]))
+    profit_pct = np.where(is_long, ((exit_price - entry) / entry) * 100, ((entry - exit_price) / entry) * 100)
+    success = np.where(closed_by_time, profit_pct > 0, hit_tp)
+
+    rsi = arrays["RSI_14"][idx]
+    adx = arrays["ADX"][idx]
+    reliability = passed_all[idx] / total_count * 100 if total_count > 0 else np.zeros(len(idx))
+    trades_found = len(idx)
+
+    # Цепочка капитала: размер позиции зависит от капитала после предыдущих сделок
+    for k in range(len(idx)):
+        trend = "Uptrend" if is_long[k] else "Downtrend"
+        entry_k = float(entry[k])
+        sl_k = float(stop_loss_price[k])
+        tp_k = float(take_profit_price[k])
+        exit_k = float(exit_price[k])
+        adx_k = float(adx[k])
+
+        reliability_rating = float(reliability[k]) if passed_all[idx[k]] > 0 and total_count > 0 else None
+        risk_adj = dynamic_risk(risk, float(rsi[k]), trend, adx=adx_k, reliability_rating=reliability_rating)
+        if risk_adj is None:
+            risk_adj = risk  # Fallback на базовый риск
+
+        # ✅ ADX: дополнительно влияет на размер позиции
+        adx_multiplier = 1.0
+        if not pd.isna(adx_k) and "ADX" in user_selected:
+            if adx_k > 25:
+                adx_multiplier = 1.1
+            elif adx_k < 20:
+                adx_multiplier = 0.9
+
+        risk_adj = risk_adj * adx_multiplier
+        risk_usd = current_capital * risk_adj
+        sl_dist = abs(entry_k - sl_k)
+        if sl_dist <= 1e-9:
+            continue
+
+        units = risk_usd / sl_dist
+        position_value = units * entry_k
+        if position_value > current_capital:
+            position_value = current_capital
+            units = position_value / entry_k
+
+        if current_capital <= 0:
+            break
+
+        tp_dist = abs(tp_k - entry_k)
+        sl_dist_actual = abs(entry_k - sl_k)
+        if closed_by_time[k]:
+            # Закрыто по времени: прибыль пропорциональна фактическому движению
+            if sl_dist_actual > 0:
+                signed_move = exit_k - entry_k if is_long[k] else entry_k - exit_k
                 rr_actual = tp_dist / sl_dist_actual if sl_dist_actual > 0 else 0
-                profit_usd = risk_usd * rr_actual
+                profit_usd = risk_usd * (signed_move / sl_dist_actual)
+                max_profit_usd = risk_usd * rr_actual
+                if profit_usd > max_profit_usd:
+                    profit_usd = max_profit_usd
+                if profit_usd < -risk_usd:
+                    profit_usd = -risk_usd
             else:
-                # Убыточная сделка (достигнут SL): теряем risk_usd
                 profit_usd = -risk_usd
-            
-            # Комиссия рассчитывается от реальной стоимости позиции
-            commission_entry = position_value * commission
-            exit_position_value = abs(units * exit_price)
-            commission_exit = exit_position_value * commission
-            total_commission = commission_entry + commission_exit
-            
-            # Вычитаем комиссию из прибыли
-            profit_usd -= total_commission
-            
-            # ✅ Учитываем спред биржи (спред применяется при входе и выходе)
-            # Спред в процентах (например, 0.1 = 0.1%)
-            if spread > 0:
-                spread_amount = position_value * (spread / 100) * 2  # Спред при входе и выходе
-                profit_usd -= spread_amount
-            
-            # Защита: прибыль не может превышать разумные пределы
-            # Ограничиваем максимум 1000% от риска (для очень больших R:R)
-            max_profit_from_risk = risk_usd * 10
-            if profit_usd > max_profit_from_risk:
-                profit_usd = max_profit_from_risk
-            
-            # Дополнительная защита: прибыль не может превышать текущий капитал
-            # Это предотвращает экспоненциальный рост
-            if profit_usd > current_capital * 0.5:
-                profit_usd = current_capital * 0.5  # Максимум 50% от текущего капитала
-            
-            current_capital += profit_usd
-            
-            # Защита от отрицательного капитала
-            if current_capital < 0:
-                current_capital = 0
-            
-            # Защита от аномального роста капитала (максимум 10x от начального)
-            max_reasonable_capital = capital * 11  # Максимум 10x + небольшой запас
-            if current_capital > max_reasonable_capital:
-                current_capital = max_reasonable_capital
-            
-            # Обновляем максимальный капитал для просадки
-            if current_capital > max_capital:
-                max_capital = current_capital
-            
-            # Сохраняем сделку
-            trades.append({
-                "entry": entry,
-                "exit": exit_price,
-                "profit_pct": profit_pct,
-                "profit_usd": profit_usd,
-                "success": success,
-                "capital_after": current_capital
-            })
-            
-            equity_curve.append(current_capital)
-            
-            # ✅ ИСПРАВЛЕНО: Логирование первых 5 сделок для отладки
-            if len(trades) <= 5:
-                print(f"📊 Бэктест сделка {len(trades)}: entry={entry:.2f}, exit={exit_price:.2f}, profit_usd={profit_usd:.2f}, capital={current_capital:.2f}, success={success}")
-        
-        # ✅ ИСПРАВЛЕНО: Улучшенная обработка случая без сделок
-        if not trades:
+        elif success[k]:
+            rr_actual = tp_dist / sl_dist_actual if sl_dist_actual > 0 else 0
+            profit_usd = risk_usd * rr_actual
+        else:
+            profit_usd = -risk_usd
+
+        # Комиссия от реальной стоимости позиции при входе и выходе
+        commission_entry = position_value * commission
+        exit_position_value = abs(units * exit_k)
+        commission_exit = exit_position_value * commission
+        profit_usd -= commission_entry + commission_exit
+
+        # ✅ Спред биржи (при входе и выходе)
+        if spread > 0:
+            profit_usd -= position_value * (spread / 100) * 2
+
+        # Ограничения: не более 1000% от риска и 50% текущего капитала
+        max_profit_from_risk = risk_usd * 10
+        if profit_usd > max_profit_from_risk:
+            profit_usd = max_profit_from_risk
+        if profit_usd > current_capital * 0.5:
+            profit_usd = current_capital * 0.5
+
+        capital_before = current_capital
+        current_capital += profit_usd
+        if current_capital < 0:
+            current_capital = 0
+        if current_capital > max_reasonable_capital:
+            current_capital = max_reasonable_capital
+        if current_capital > max_capital:
+            max_capital = current_capital
+
+        trades.append({
+            "entry": entry_k,
+            "exit": exit_k,
+            "profit_pct": float(profit_pct[k]),
+            "profit_usd": profit_usd,
+            "success": bool(success[k]),
+            "capital_before": capital_before,
+            "position_value": position_value,
+            "capital_after": current_capital
+        })
+        equity_curve.append(current_capital)
+
+        if verbose and len(trades) <= 5:
+            print(f"📊 Бэктест сделка {len(trades)}: entry={entry_k:.2f}, exit={exit_k:.2f}, profit_usd={profit_usd:.2f}, capital={current_capital:.2f}, success={bool(success[k])}")
+
+    if not trades:
+        if verbose:
             print(f"⚠️ Бэктест: не найдено сделок. Пропущено без подтверждений: {trades_skipped_no_conf}, без входа: {trades_skipped_no_entry}")
-            return {
-                "total_trades": 0,
-                "winning_trades": 0,
-                "losing_trades": 0,
-                "win_rate": 0,
-                "total_profit_pct": 0,
-                "max_drawdown": 0,
-                "avg_rr": 0,
-                "final_capital": capital,
-                "equity_curve": [capital]
-            }
-        
+        result = {
+            "total_trades": 0,
+            "winning_trades": 0,
+            "losing_trades": 0,
+            "win_rate": 0,
+            "total_profit_pct": 0,
+            "max_drawdown": 0,
+            "avg_rr": 0,
+            "final_capital": capital,
+            "equity_curve": [capital]
+        }
+        if return_trades:
+            result["trades"] = []
+        return result
+
+    if verbose:
         print(f"✅ Бэктест: найдено {len(trades)} сделок, прибыльных: {sum(1 for t in trades if t['success'])}, финальный капитал: {current_capital:.2f}")
         print(f"📊 Статистика бэктеста: пропущено без подтверждений: {trades_skipped_no_conf}, пропущено без входа: {trades_skipped_no_entry}, найдено сделок: {trades_found}")
+
+    total_trades = len(trades)
+    winning_trades = sum(1 for t in trades if t["success"])
+    losing_trades = total_trades - winning_trades
+    win_rate = (winning_trades / total_trades * 100) if total_trades > 0 else 0
+
+    if current_capital > max_reasonable_capital:
+        current_capital = max_reasonable_capital
+
+    # Общая прибыль в процентах от начального капитала
+    if capital > 0 and current_capital > 0:
+        total_profit_pct = ((current_capital - capital) / capital) * 100
+    elif capital > 0:
+        total_profit_pct = -100.0
+    else:
+        total_profit_pct = 0.0
+
+    # Ограничиваем разумными пределами: от -100% до +1000% (10x)
+    if total_profit_pct < -100:
+        total_profit_pct = -100.0
+    if total_profit_pct > 1000:
+        total_profit_pct = 1000.0
+
+    # Максимальная просадка
+    max_drawdown = 0
+    peak = capital
+    for equity in equity_curve:
+        if equity > peak:
+            peak = equity
+        drawdown = ((peak - equity) / peak) * 100
+        if drawdown > max_drawdown:
+            max_drawdown = drawdown
+
+    # Средний R:R (упрощенно: риск 1% от цены входа)
+    rr_values = []
+    for t in trades:
+        if t["success"]:
+            risk_amount = t["entry"] * 0.01
+            if risk_amount > 0:
+                rr_values.append(abs(t["exit"] - t["entry"]) / risk_amount)
+    avg_rr = np.mean(rr_values) if rr_values else 0
+
+    result = {
+        "total_trades": total_trades,
+        "winning_trades": winning_trades,
+        "losing_trades": losing_trades,
+        "win_rate": win_rate,
+        "total_profit_pct": round(total_profit_pct, 2),
+        "max_drawdown": round(max_drawdown, 2),
+        "avg_rr": round(avg_rr, 2),
+        "final_capital": round(max(current_capital, 0), 2),  # Не показываем отрицательный капитал
+        "equity_curve": equity_curve[-curve_points:] if curve_points and len(equity_curve) > curve_points else equity_curve
+    }
+    if return_trades:
+        result["trades"] = trades
+    return result
+
+
+def _slice_arrays(arrays, stop):
+    """
+    Массивы бэктеста, обрезанные до свечи stop (не включая): срезы NumPy - представления
+    без копирования, поэтому окна walk-forward не видят свечи после своего конца.
+    """
+    sliced = {}
+    for key, value in arrays.items():
+        if key == "n":
+            continue
+        sliced[key] = value.iloc[:stop] if isinstance(value, pd.DataFrame) else value[:stop]
+    sliced["n"] = min(stop, arrays["n"])
+    return sliced
+
+
+def walk_forward_windows(n, train_bars, test_bars, step=None, start=100, anchored=False):
+    """
+    Окна walk-forward по свечам [start, n - 1).
+
+    Параметры:
+    - train_bars, test_bars: длина обучающего и тестового окна в свечах
+    - step: сдвиг между окнами (по умолчанию test_bars - тестовые окна не пересекаются)
+    - anchored: обучающее окно всегда начинается со start (растущее), иначе скользящее
+
+    Возвращает:
+    - список (train_start, train_stop, test_start, test_stop)
+    """
+    step = step or test_bars
+    last = n - 1
+    windows = []
+    train_start = start
+    while train_start + train_bars + test_bars <= last:
+        train_stop = train_start + train_bars
+        windows.append((start if anchored else train_start, train_stop, train_stop, train_stop + test_bars))
+        train_start += step
+    return windows
+
+
+def walk_forward_split(n, folds, train_ratio=0.7, start=100, anchored=False):
+    """
+    folds тестовых окон подряд после первого обучающего окна, покрывающие свечи [start, n - 1).
+    Обучающее окно занимает долю train_ratio пары "обучение + тест".
+
+    Возвращает:
+    - список окон как у walk_forward_windows (пустой, если истории не хватает)
+    """
+    if not folds or not 0 < train_ratio < 1:
+        return []
+    usable = n - 1 - start
+    test_bars = int(usable / (train_ratio / (1 - train_ratio) + folds))
+    train_bars = int(test_bars * train_ratio / (1 - train_ratio))
+    if test_bars <= 0 or train_bars <= 0:
+        return []
+    return walk_forward_windows(n, train_bars, test_bars, start=start, anchored=anchored)[:folds]
+
+
+WALK_FORWARD_WORKERS = int(os.getenv("WALK_FORWARD_WORKERS", "4"))
+
+
+def _add_backtest_columns(df):
+    """VWMA, Bollinger и ADX для гибридного подхода бэктеста (кадр меняется на месте)."""
+    df["VWMA_20"] = (df["Close"] * df["Volume"]).rolling(20).sum() / df["Volume"].rolling(20).sum()
+    df["BB_middle"] = df["Close"].rolling(20).mean()
+    df["BB_std"] = df["Close"].rolling(20).std()
+    df["BB_upper"] = df["BB_middle"] + 2 * df["BB_std"]
+    df["BB_lower"] = df["BB_middle"] - 2 * df["BB_std"]
+    df["ADX"] = compute_adx(df).fillna(0)
+
+
+def _curve_drawdown(curve):
+    """Максимальная просадка кривой капитала, %."""
+    max_drawdown = 0
+    peak = curve[0] if curve else 0
+    for equity in curve:
+        if equity > peak:
+            peak = equity
+        if peak > 0:
+            max_drawdown = max(max_drawdown, (peak - equity) / peak * 100)
+    return max_drawdown
+
+
+def walk_forward_backtest(df, strat, user_selected, capital=10000, risk=0.01, commission=0.001, spread=0.0,
+                          folds=4, train_ratio=0.7, anchored=False, max_workers=None, return_trades=False):
+    """
+    Walk-forward бэктест: скользящие окна "обучение + тест", метрики по окнам
+    и общая кривая капитала только по тестовым (out-of-sample) окнам.
+
+    Обучающие окна считаются параллельно в потоках над одними и теми же массивами:
+    окно - срез-представление без копирования, кадр не перечитывается.
+    Тестовые окна идут последовательно (пока потоки считают обучение): каждое
+    начинается с капитала на конец предыдущего, с общим потолком 11x от стартового
+    капитала, поэтому склеенная кривая совпадает с последовательным проходом по окнам.
+
+    Возвращает:
+    - dict с ключами как у backtest_strategy (метрики out-of-sample) +
+      mode, windows (обучение/тест по каждому окну) и in_sample (средние метрики обучения)
+      или None, если истории не хватает на окна;
+      с return_trades=True еще и trades - сделки всех тестовых окон подряд
+    """
+    arrays = _backtest_arrays(df)
+    windows = walk_forward_split(arrays["n"], folds, train_ratio, start=100, anchored=anchored)
+    if not windows:
+        return None
+
+    def run_train(window):
+        train_start, train_stop, _, _ = window
+        return _run_backtest(_slice_arrays(arrays, train_stop), strat, user_selected, capital, risk,
+                             commission, spread, start=train_start, stop=train_stop - 1)
+
+    max_reasonable_capital = capital * 11  # Тот же предел, что и в одном проходе бэктеста
+    workers = max(1, min(int(max_workers or WALK_FORWARD_WORKERS), len(windows)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="walk-forward") as pool:
+        train_futures = [pool.submit(run_train, window) for window in windows]
+        tests = []
+        window_capital = capital
+        for _, _, test_start, test_stop in windows:
+            test = _run_backtest(arrays, strat, user_selected, window_capital, risk, commission, spread,
+                                 start=test_start, stop=test_stop, curve_points=None,
+                                 return_trades=return_trades, capital_cap=max_reasonable_capital)
+            tests.append(test)
+            window_capital = test["equity_curve"][-1]
+        results = [(future.result(), test) for future, test in zip(train_futures, tests)]
+
+    index = df.index
+    window_rows = []
+    curve = [capital]
+    winning = losing = 0
+    rr_weighted = 0.0
+    for (train_start, train_stop, test_start, test_stop), (train, test) in zip(windows, results):
+        curve.extend(test["equity_curve"][1:])
+        winning += test["winning_trades"]
+        losing += test["losing_trades"]
+        rr_weighted += test["avg_rr"] * test["winning_trades"]
+        window_rows.append({
+            "train_range": [str(index[train_start]), str(index[train_stop - 1])],
+            "test_range": [str(index[test_start]), str(index[min(test_stop, len(index)) - 1])],
+            "train": {k: train[k] for k in ("total_trades", "win_rate", "total_profit_pct", "max_drawdown")},
+            "test": {k: test[k] for k in ("total_trades", "win_rate", "total_profit_pct", "max_drawdown")},
+        })
+
+    total_trades = winning + losing
+    final_capital = curve[-1]
+    total_profit_pct = (final_capital - capital) / capital * 100 if capital > 0 else 0.0
+    trains = [train for train, _ in results]
+    result = {
+        "mode": "walk_forward",
+        "total_trades": total_trades,
+        "winning_trades": winning,
+        "losing_trades": losing,
+        "win_rate": (winning / total_trades * 100) if total_trades else 0,
+        "total_profit_pct": round(min(max(total_profit_pct, -100.0), 1000.0), 2),
+        "max_drawdown": round(_curve_drawdown(curve), 2),
+        "avg_rr": round(float(rr_weighted) / winning, 2) if winning else 0,
+        "final_capital": round(max(final_capital, 0), 2),
+        "equity_curve": curve[-100:] if len(curve) > 100 else curve,
+        "windows": window_rows,
+        "in_sample": {
+            "win_rate": round(float(np.mean([t["win_rate"] for t in trains])), 2),
+            "total_profit_pct": round(float(np.mean([t["total_profit_pct"] for t in trains])), 2),
+        },
+    }
+    if return_trades:
+        result["trades"] = [trade for _, test in results for trade in test["trades"]]
+    return result
+
+
+MONTE_CARLO_SIMULATIONS = int(os.getenv("MONTE_CARLO_SIMULATIONS", "2000"))
+MONTE_CARLO_MAX_SIMULATIONS = 20000
+MONTE_CARLO_METHODS = ("bootstrap", "shuffle")
+MONTE_CARLO_BATCH_CELLS = 1_000_000  # Сделок x симуляций в одной пачке (~8 МБ на матрицу float64)
+
+
+def monte_carlo_trades(trades, capital=10000, spread=0.0, simulations=None, method="bootstrap",
+                       slippage_pct=0.02, spread_jitter=0.25, ruin_pct=50, seed=None):
+    """
+    Монте-Карло по списку сделок бэктеста: насколько результат зависит от порядка
+    сделок и от издержек исполнения.
+
+    Каждая сделка сводится к доходности относительно капитала перед ней (размер позиции
+    в движке пропорционален капиталу). Затем во всех симуляциях сразу (матрица
+    simulations x сделки) сделки перемешиваются или выбираются с возвращением,
+    спред биржи случайно отклоняется от заданного, а к каждой сделке добавляется
+    проскальзывание. Кривые капитала считаются в логарифмах одним cumsum,
+    с тем же потолком 11x от стартового капитала, что и в бэктесте.
+
+    Параметры:
+    - trades: сделки из _run_backtest(..., return_trades=True)
+    - capital: начальный капитал
+    - spread: спред биржи пользователя, % (в бэктесте он уже вычтен из сделок)
+    - simulations: количество симуляций (по умолчанию MONTE_CARLO_SIMULATIONS)
+    - method: "bootstrap" - выборка с возвращением, "shuffle" - перестановка сделок
+    - slippage_pct: масштаб проскальзывания на вход и выход, % от объема позиции
+    - spread_jitter: относительный разброс спреда между симуляциями (0.25 = ±25%)
+    - ruin_pct: просадка от стартового капитала, которая считается разорением, %
+    - seed: зерно генератора (для воспроизводимости)
+
+    Возвращает:
+    - dict с перцентилями итоговой доходности и максимальной просадки,
+      вероятностями убытка и разорения (в %) или None, если сделок нет
+    """
+    if method not in MONTE_CARLO_METHODS:
+        raise ValueError(f"method должен быть одним из {MONTE_CARLO_METHODS}")
+    started = time.perf_counter()
+    before = np.array([t.get("capital_before", 0) for t in trades], dtype=float)
+    valid = before > 0
+    if capital <= 0 or not valid.any():
+        return None
+    before = before[valid]
+    profit = np.array([t["profit_usd"] for t in trades], dtype=float)[valid]
+    exposure = np.array([t.get("position_value", 0) for t in trades], dtype=float)[valid] / before
+    # Доходность сделки без спреда: спред дальше подставляется свой в каждой симуляции
+    base = profit / before + exposure * (spread / 100) * 2
+
+    simulations = max(1, int(simulations or MONTE_CARLO_SIMULATIONS))
+    n = len(base)
+    rng = np.random.default_rng(seed)
+    total_return = np.empty(simulations)
+    max_drawdown = np.empty(simulations)
+    min_equity = np.empty(simulations)
+    # Симуляции идут пачками, чтобы матрица пачки не превышала MONTE_CARLO_BATCH_CELLS элементов
+    batch = max(1, MONTE_CARLO_BATCH_CELLS // n)
+    for lo in range(0, simulations, batch):
+        size = min(batch, simulations - lo)
+        if method == "shuffle":
+            order = rng.permuted(np.broadcast_to(np.arange(n), (size, n)), axis=1)
+        else:
+            order = rng.integers(0, n, size=(size, n))
+        sim_spread = np.clip(spread * (1 + spread_jitter * rng.standard_normal((size, 1))), 0, None)
+        slippage = np.abs(rng.standard_normal((size, n))) * slippage_pct
+        returns = base[order] - exposure[order] * (sim_spread + slippage) / 100 * 2
+
+        # log(E_k) = S_k + min(log(E_0), c - max S_j): капитал с потолком без цикла по сделкам
+        with np.errstate(divide="ignore"):
+            growth = np.cumsum(np.log(np.maximum(1 + returns, 0)), axis=1)
+        cap = np.log(capital * 11) - np.maximum.accumulate(growth, axis=1)
+        equity = np.exp(growth + np.minimum(np.log(capital), cap))
+
+        peak = np.maximum(np.maximum.accumulate(equity, axis=1), capital)
+        max_drawdown[lo:lo + size] = ((peak - equity) / peak).max(axis=1) * 100
+        total_return[lo:lo + size] = (equity[:, -1] / capital - 1) * 100
+        min_equity[lo:lo + size] = equity.min(axis=1)
+    ruined = min_equity <= capital * (1 - ruin_pct / 100)
+
+    return_pct = np.percentile(total_return, [5, 25, 50, 75, 95])
+    drawdown_pct = np.percentile(max_drawdown, [50, 95, 99])
+    return {
+        "simulations": simulations,
+        "method": method,
+        "trades": n,
+        "return_pct": {f"p{q}": round(float(v), 2) for q, v in zip((5, 25, 50, 75, 95), return_pct)},
+        "mean_return_pct": round(float(total_return.mean()), 2),
+        "max_drawdown_pct": {f"p{q}": round(float(v), 2) for q, v in zip((50, 95, 99), drawdown_pct)},
+        "prob_loss": round(float((total_return < 0).mean() * 100), 2),
+        "prob_ruin": round(float(ruined.mean() * 100), 2),
+        "ruin_pct": ruin_pct,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def backtest_strategy(df, strategy, trading_type, confirmation, capital=10000, risk=0.01, commission=0.001, spread=0.0,
+                      walk_forward=0, train_ratio=0.7, monte_carlo=None):
+    """
+    Бэктестинг стратегии на исторических данных.
+    
+    Параметры:
+    - df: DataFrame с историческими данными и индикаторами
+    - strategy: название стратегии
+    - trading_type: тип торговли
+    - confirmation: список подтверждений
+    - capital: начальный капитал
+    - risk: риск на сделку (%)
+    - commission: комиссия биржи (0.1% = 0.001)
+    - walk_forward: количество тестовых окон walk-forward (0 - один проход по всей истории);
+      метрики тогда считаются только по тестовым окнам (см. walk_forward_backtest)
+    - train_ratio: доля обучающего окна в паре "обучение + тест"
+    - monte_carlo: количество симуляций Монте-Карло по сделкам
+      (None/0 - не считать, True - MONTE_CARLO_SIMULATIONS)
+    
+    Возвращает:
+    - total_trades: общее количество сделок
+    - winning_trades: количество прибыльных
+    - losing_trades: количество убыточных
+    - win_rate: процент прибыльных сделок
+    - total_profit_pct: общая прибыль (%)
+    - max_drawdown: максимальная просадка (%)
+    - avg_rr: средний R:R
+    - equity_curve: список значений капитала (для графика)
+    - monte_carlo: распределения доходности и просадки (см. monte_carlo_trades) или None
+    """
+    try:
+        if df.empty or len(df) < 100:
+            return None
         
-        # Вычисляем метрики
-        total_trades = len(trades)
-        winning_trades = sum(1 for t in trades if t["success"])
-        losing_trades = total_trades - winning_trades
-        win_rate = (winning_trades / total_trades * 100) if total_trades > 0 else 0
-        
-        # Защита от аномального роста капитала перед расчетом прибыли
-        max_reasonable_capital = capital * 11  # Максимум 10x от начального капитала
-        if current_capital > max_reasonable_capital:
-            current_capital = max_reasonable_capital
+        strat = STRATEGIES.get(strategy, STRATEGIES["Сбалансированная"])
         
-        # Общая прибыль в процентах от начального капитала
-        if capital > 0 and current_capital > 0:
-            total_profit_pct = ((current_capital - capital) / capital) * 100
-        elif capital > 0:
-            # Если капитал стал 0 или отрицательным
-            total_profit_pct = -100.0
-        else:
-            total_profit_pct = 0.0  # Если начальный капитал был 0
-        
-        # Ограничиваем разумными пределами: от -100% до +1000% (10x)
-        if total_profit_pct < -100:
-            total_profit_pct = -100.0
-        if total_profit_pct > 1000:
-            total_profit_pct = 1000.0  # Ограничиваем максимум 1000% (вместо 10000%)
-        
-        # Максимальная просадка
-        max_drawdown = 0
-        peak = capital
-        for equity in equity_curve:
-            if equity > peak:
-                peak = equity
-            drawdown = ((peak - equity) / peak) * 100
-            if drawdown > max_drawdown:
-                max_drawdown = drawdown
-        
-        # Средний R:R
-        rr_values = []
-        for t in trades:
-            if t["success"]:
-                # Упрощённый расчёт R:R
-                entry = t["entry"]
-                exit = t["exit"]
-                profit = abs(exit - entry)
-                # Предполагаем, что риск был 1% от капитала
-                risk_amount = entry * 0.01
-                if risk_amount > 0:
-                    rr = profit / risk_amount
-                    rr_values.append(rr)
-        avg_rr = np.mean(rr_values) if rr_values else 0
+        # ✅ Добавляем VWMA и BB для использования в гибридном подходе
+        _add_backtest_columns(df)
         
-        return {
-            "total_trades": total_trades,
-            "winning_trades": winning_trades,
-            "losing_trades": losing_trades,
-            "win_rate": win_rate,
-            "total_profit_pct": round(total_profit_pct, 2),
-            "max_drawdown": round(max_drawdown, 2),
-            "avg_rr": round(avg_rr, 2),
-            "final_capital": round(max(current_capital, 0), 2),  # Не показываем отрицательный капитал
-            "equity_curve": equity_curve[-100:] if len(equity_curve) > 100 else equity_curve
-        }
+        user_selected = _parse_confirmation(confirmation)
+        simulations = MONTE_CARLO_SIMULATIONS if monte_carlo is True else int(monte_carlo or 0)
+
+        result = None
+        if walk_forward:
+            result = walk_forward_backtest(df, strat, user_selected, capital, risk, commission, spread,
+                                           folds=int(walk_forward), train_ratio=train_ratio,
+                                           return_trades=simulations > 0)
+            if result is None:
+                print("⚠️ Истории не хватает на окна walk-forward, бэктест по всей истории")
+        if result is None:
+            # Пропускаем первые 100 свечей для индикаторов
+            result = _run_backtest(_backtest_arrays(df), strat, user_selected, capital, risk, commission, spread,
+                                   start=100, stop=len(df) - 1, return_trades=simulations > 0)
+
+        trades = result.pop("trades", None)
+        if simulations > 0:
+            # Монте-Карло - по сделкам out-of-sample, если бэктест шел в режиме walk-forward
+            result["monte_carlo"] = monte_carlo_trades(trades, capital, spread, simulations=simulations)
+        return result
     
     except Exception as e:
         print(f"⚠️ Ошибка в backtest_strategy: {e}")
         traceback.print_exc()
         return None
 
-def forecast_risk_reward(df, latest, strategy, direction, similarity_threshold=0.15):
+class ForecastIndex:
+    """
+    Индекс исторических свечей для forecast_risk_reward.
+
+    Свечи разбиты на корзины по тренду и отсортированы по RSI, поэтому похожие
+    ситуации находятся бинарным поиском по диапазону RSI, а не полным перебором.
+    Для каждой свечи заранее посчитаны максимум High и минимум Low на горизонте
+    прогноза - по ним исход сделки определяется без просмотра будущих свечей.
+    """
+
+    horizon = 50  # Свеч после входа, в которых ищется TP/SL
+
+    def __init__(self, df):
+        self.n = len(df)
+        self.high = df["High"].to_numpy(dtype=float)
+        self.low = df["Low"].to_numpy(dtype=float)
+        self.close = df["Close"].to_numpy(dtype=float)
+        self.ema20 = _column_or(df, "EMA_20", np.nan)
+        self.ema50 = _column_or(df, "EMA_50", np.nan)
+        self.atr = _column_or(df, "ATR_14", np.nan)
+        self.rsi = _column_or(df, "RSI_14", 50)
+        self.adx = _column_or(df, "ADX", 0)
+        self.trend_up = (df["Trend"] == "Uptrend").to_numpy() if "Trend" in df.columns else np.zeros(self.n, dtype=bool)
+
+        # Кандидаты - свечи [50, n - 1), как в исходном переборе; NaN RSI никогда не похож
+        positions = np.arange(min(50, self.n), max(self.n - 1, 0))
+        positions = positions[~np.isnan(self.rsi[positions])]
+        self._buckets = {}
+        for trend_up in (True, False):
+            bucket = positions[self.trend_up[positions] == trend_up]
+            order = np.argsort(self.rsi[bucket], kind="stable")
+            self._buckets[trend_up] = (self.rsi[bucket][order], bucket[order])
+
+        # Максимум High / минимум Low в свечах [i + 1, i + horizon) (fmax/fmin пропускают NaN)
+        width = self.horizon - 1
+        pad = np.full(width + 1, np.nan)
+        high_windows = np.lib.stride_tricks.sliding_window_view(np.concatenate([self.high, pad])[1:], width)[:self.n]
+        low_windows = np.lib.stride_tricks.sliding_window_view(np.concatenate([self.low, pad])[1:], width)[:self.n]
+        self.fwd_max_high = np.fmax.reduce(high_windows, axis=1) if self.n else np.array([])
+        self.fwd_min_low = np.fmin.reduce(low_windows, axis=1) if self.n else np.array([])
+
+    def similar(self, current_rsi, current_adx, current_trend_up, similarity_threshold):
+        """Позиции похожих свечей (по возрастанию) - тот же критерий, что в исходном переборе."""
+        rsi_values, positions = self._buckets[bool(current_trend_up)]
+        rsi_scale = max(current_rsi, 1)
+        if len(positions) == 0 or pd.isna(rsi_scale):
+            return np.array([], dtype=np.int64)
+        # Диапазон RSI с запасом на округление; точная проверка - ниже
+        margin = similarity_threshold * rsi_scale * (1 + 1e-9) + 1e-9
+        lo = np.searchsorted(rsi_values, current_rsi - margin, side="left")
+        hi = np.searchsorted(rsi_values, current_rsi + margin, side="right")
+        candidates = positions[lo:hi]
+
+        rsi_diff = np.abs(self.rsi[candidates] - current_rsi) / rsi_scale
+        if current_adx > 0:
+            adx_diff = np.abs(self.adx[candidates] - current_adx) / max(current_adx, 1)
+        else:
+            adx_diff = np.ones(len(candidates))
+        matched = candidates[(rsi_diff <= similarity_threshold) & (adx_diff <= similarity_threshold)]
+        return np.sort(matched)
+
+    def outcomes(self, positions, strat, direction):
+        """
+        Результаты сделок по историческим уровням входа/SL/TP для найденных свечей.
+
+        Возвращает:
+        - (profits, successes) - прибыль в % от риска и флаги успеха
+        """
+        is_long = np.full(len(positions), direction == "long")
+        close = self.close[positions]
+        entry = _entry_prices(close, self.high[positions], self.low[positions],
+                              self.ema20[positions], self.ema50[positions], strat, is_long)
+        atr = self.atr[positions]
+        atr = np.where(np.isnan(atr) | (atr == 0) | (atr < close * 0.001), close * 0.001, atr)
+        if direction == "long":
+            stop_loss = entry - strat["atr_sl"] * atr
+            take_profit = entry + strat["atr_tp"] * atr
+        else:
+            stop_loss = entry + strat["atr_sl"] * atr
+            take_profit = entry - strat["atr_tp"] * atr
+        sl_dist = np.abs(entry - stop_loss)
+        tp_dist = np.abs(take_profit - entry)
+
+        width = self.horizon - 1
+        if direction == "long":
+            tp_any = self.fwd_max_high[positions] >= take_profit
+            sl_any = self.fwd_min_low[positions] <= stop_loss
+        else:
+            tp_any = self.fwd_min_low[positions] <= take_profit
+            sl_any = self.fwd_max_high[positions] >= stop_loss
+
+        # Если на горизонте достигнуты и TP, и SL - решает, что было раньше (TP проверяется первым)
+        hit_tp = tp_any & ~sl_any
+        hit_sl = sl_any & ~tp_any
+        both = np.flatnonzero(tp_any & sl_any)
+        if len(both):
+            first_bar = positions[both] + 1
+            if direction == "long":
+                tp_bar = _first_hit(self.high, first_bar, width, take_profit[both], above=True)
+                sl_bar = _first_hit(self.low, first_bar, width, stop_loss[both], above=False)
+            else:
+                tp_bar = _first_hit(self.low, first_bar, width, take_profit[both], above=False)
+                sl_bar = _first_hit(self.high, first_bar, width, stop_loss[both], above=True)
+            hit_tp[both] = tp_bar <= sl_bar
+            hit_sl[both] = tp_bar > sl_bar
+
+        valid_risk = sl_dist > 1e-9
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tp_profit = np.where(valid_risk, tp_dist / sl_dist * 100, 0.0)
+            final_price = self.close[np.minimum(positions + self.horizon, self.n - 1)]
+            price_move = np.abs(final_price - entry)
+            if direction == "long":
+                sign = np.where(final_price > entry, 1, -1)
+            else:
+                sign = np.where(final_price < entry, 1, -1)
+            time_profit = np.where(valid_risk, (price_move / sl_dist) * 100 * sign, 0.0)
+
+        profits = np.where(hit_tp, tp_profit, np.where(hit_sl, -100.0, time_profit))
+        successes = np.where(hit_tp, True, np.where(hit_sl, False, time_profit > 0))
+        return profits, successes
+
+
+def forecast_risk_reward(df, latest, strategy, direction, similarity_threshold=0.15, index=None):
     """
     Прогнозирует риск/доход на основе похожих ситуаций в истории.
     
@@ -2590,6 +3498,7 @@ def forecast_risk_reward(df, latest, strategy, direction, similarity_threshold=0
     - strategy: название стратегии (для получения параметров)
     - direction: "long" или "short"
     - similarity_threshold: порог схожести (15% отклонение по индикаторам)
+    - index: готовый ForecastIndex для df (для повторных прогнозов по тому же кадру)
     
     Возвращает:
     - expected_profit: ожидаемая прибыль (%)
@@ -2607,118 +3516,22 @@ def forecast_risk_reward(df, latest, strategy, direction, similarity_threshold=0
         # Нормализуем текущие значения индикаторов для сравнения
         current_rsi = latest.get("RSI_14", 50)
         current_adx = latest.get("ADX", 0)
-        current_trend = 1 if latest.get("Trend") == "Uptrend" else -1
-        current_ema20 = latest.get("EMA_20", 0)
-        current_ema50 = latest.get("EMA_50", 0)
         current_price = latest.get("Close", 0)
         
         if current_price == 0:
             return None, None, None, 0
         
         # Ищем похожие ситуации в истории
-        similar_trades = []
-        
-        for i in range(50, len(df) - 1):  # Пропускаем последние 50 свечей для валидности
-            row = df.iloc[i]
-            prev_row = df.iloc[i-1] if i > 0 else None
-            
-            # Вычисляем схожесть по индикаторам
-            rsi_diff = abs(row.get("RSI_14", 50) - current_rsi) / max(current_rsi, 1)
-            adx_diff = abs(row.get("ADX", 0) - current_adx) / max(current_adx, 1) if current_adx > 0 else 1
-            trend_match = 1 if (row.get("Trend") == "Uptrend") == (latest.get("Trend") == "Uptrend") else 0
-            
-            # Проверяем схожесть
-            if rsi_diff <= similarity_threshold and adx_diff <= similarity_threshold and trend_match:
-                # ✅ ПОДХОД 2: Пересчитываем entry, SL, TP для каждой исторической ситуации
-                # на основе исторических ATR и EMA для математической корректности
-                historical_entry = calculate_entry(row, strat, direction)
-                historical_atr = row.get("ATR_14", np.nan)
-                historical_price = row.get("Close", 0)
-                
-                # ✅ FALLBACK для ATR: если ATR нулевой или слишком мал, используем минимальный ATR
-                if pd.isna(historical_atr) or historical_atr == 0 or historical_atr < historical_price * 0.001:
-                    historical_atr = historical_price * 0.001  # Минимальный ATR = 0.1% от цены
-                
-                # Пересчитываем SL/TP на основе исторических данных
-                if direction == "long":
-                    historical_stop_loss = historical_entry - strat["atr_sl"] * historical_atr
-                    historical_take_profit = historical_entry + strat["atr_tp"] * historical_atr
-                else:  # short
-                    historical_stop_loss = historical_entry + strat["atr_sl"] * historical_atr
-                    historical_take_profit = historical_entry - strat["atr_tp"] * historical_atr
-                
-                # Вычисляем расстояние до SL и TP для расчета прибыли относительно риска
-                historical_sl_dist = abs(historical_entry - historical_stop_loss)
-                historical_tp_dist = abs(historical_take_profit - historical_entry)
-                
-                # Вычисляем результат сделки используя исторические SL/TP
-                if direction == "long":
-                    # Для лонга: цена должна вырасти до TP или упасть до SL
-                    # Проверяем, достигнут ли исторический TP или SL в следующих свечах
-                    for j in range(i + 1, min(i + 50, len(df))):  # Проверяем следующие 50 свечей
-                        future_row = df.iloc[j]
-                        high = future_row["High"]
-                        low = future_row["Low"]
-                        
-                        if high >= historical_take_profit:
-                            # Исторический TP достигнут - прибыль = R:R * 100% (от риска)
-                            if historical_sl_dist > 1e-9:
-                                rr_actual = historical_tp_dist / historical_sl_dist
-                                profit_pct = rr_actual * 100  # Прибыль в процентах от риска
-                            else:
-                                profit_pct = 0
-                            similar_trades.append({"profit": profit_pct, "success": True})
-                            break
-                        elif low <= historical_stop_loss:
-                            # Исторический SL достигнут - убыток = -100% от риска
-                            profit_pct = -100.0
-                            similar_trades.append({"profit": profit_pct, "success": False})
-                            break
-                    else:
-                        # Не достигнут ни TP, ни SL за 50 свечей - считаем пропорционально движению
-                        final_price = df.iloc[min(i + 50, len(df) - 1)]["Close"]
-                        price_move = abs(final_price - historical_entry)
-                        if historical_sl_dist > 1e-9:
-                            # Прибыль/убыток пропорциональны движению относительно исторического риска
-                            profit_pct = (price_move / historical_sl_dist) * 100 * (1 if final_price > historical_entry else -1)
-                        else:
-                            profit_pct = 0
-                        similar_trades.append({"profit": profit_pct, "success": profit_pct > 0})
-                else:  # short
-                    for j in range(i + 1, min(i + 50, len(df))):
-                        future_row = df.iloc[j]
-                        high = future_row["High"]
-                        low = future_row["Low"]
-                        
-                        if low <= historical_take_profit:
-                            # Исторический TP достигнут (для шорта цена упала) - прибыль = R:R * 100%
-                            if historical_sl_dist > 1e-9:
-                                rr_actual = historical_tp_dist / historical_sl_dist
-                                profit_pct = rr_actual * 100
-                            else:
-                                profit_pct = 0
-                            similar_trades.append({"profit": profit_pct, "success": True})
-                            break
-                        elif high >= historical_stop_loss:
-                            # Исторический SL достигнут - убыток = -100% от риска
-                            profit_pct = -100.0
-                            similar_trades.append({"profit": profit_pct, "success": False})
-                            break
-                    else:
-                        final_price = df.iloc[min(i + 50, len(df) - 1)]["Close"]
-                        price_move = abs(historical_entry - final_price)
-                        if historical_sl_dist > 1e-9:
-                            profit_pct = (price_move / historical_sl_dist) * 100 * (1 if final_price < historical_entry else -1)
-                        else:
-                            profit_pct = 0
-                        similar_trades.append({"profit": profit_pct, "success": profit_pct > 0})
-        
-        if not similar_trades:
+        if index is None:
+            index = ForecastIndex(df)
+        positions = index.similar(current_rsi, current_adx, latest.get("Trend") == "Uptrend", similarity_threshold)
+        if len(positions) == 0:
             return None, None, None, 0
+        profits_arr, successes_arr = index.outcomes(positions, strat, direction)
         
         # Вычисляем статистику
-        profits = [t["profit"] for t in similar_trades]
-        successes = [t["success"] for t in similar_trades]
+        profits = profits_arr.tolist()
+        successes = successes_arr.tolist()
         
         # Вероятность успеха: считаем только сделки, где success = True
         success_count = sum(1 for s in successes if s)
@@ -2748,20 +3561,212 @@ def forecast_risk_reward(df, latest, strategy, direction, similarity_threshold=0
         risk_min = min(profits)
         risk_max = max(profits)
         
-        return expected_profit, success_probability, (risk_min, risk_max), len(similar_trades)
+        return expected_profit, success_probability, (risk_min, risk_max), len(profits)
     
     except Exception as e:
         print(f"⚠️ Ошибка в forecast_risk_reward: {e}")
         traceback.print_exc()
         return None, None, None, 0
 
+def _confirmation_tokens(confirmation):
+    """Множество подтверждений из строки вида "EMA+RSI" (как в сравнении отчетов)."""
+    return set([c.strip().upper() for c in str(confirmation).split("+") if c.strip()])
+
+
+def _popcount(words):
+    """Количество установленных бит в каждой строке массива uint64 (n × W)."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    bits = np.unpackbits(np.ascontiguousarray(words).view(np.uint8).reshape(len(words), -1), axis=1)
+    return bits.sum(axis=1, dtype=np.int64)
+
+
+class ReportFeatureTable:
+    """
+    Числовая таблица признаков завершенных отчетов для predict_ml_success.
+
+    Категориальные поля (strategy, trading_type, direction, trend) хранятся кодами,
+    наборы подтверждений - битовыми масками, R:R - массивом float. Строки хранятся
+    по id отчета: add добавляет или заменяет строки, sync приводит таблицу к окну
+    последних max_rows завершенных отчетов. Массивы пересобираются только после изменений.
+    Таблица не потокобезопасна: общую таблицу меняют под блокировкой, а читают через snapshot().
+    """
+
+    CATEGORICAL = ("strategy", "trading_type", "direction", "trend")
+
+    def __init__(self, max_rows=1000):
+        self.max_rows = max_rows
+        self._vocab = {field: {} for field in self.CATEGORICAL}
+        self._conf_vocab = {}
+        # id отчета -> (коды категорий, битовая маска подтверждений, R:R, success)
+        self._rows = {}
+        self._anonymous = 0  # Ключи для отчетов без id (отрицательные - считаются самыми старыми)
+        self._arrays = None
+        self._snapshot = None
+
+    @classmethod
+    def from_reports(cls, reports, max_rows=None):
+        table = cls(max_rows=max_rows if max_rows is not None else max(len(reports), 1))
+        table.add(reports)
+        return table
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def full(self):
+        return len(self) >= self.max_rows
+
+    def clear(self):
+        self.__init__(self.max_rows)
+
+    def _code(self, field, value):
+        # Пустое значение никогда не совпадает (как "if report.strategy else False")
+        if not value:
+            return -1
+        vocab = self._vocab[field]
+        if value not in vocab:
+            vocab[value] = len(vocab)
+        return vocab[value]
+
+    def _encode(self, report):
+        codes = tuple(self._code(field, getattr(report, field)) for field in self.CATEGORICAL)
+        mask = 0
+        for token in _confirmation_tokens(report.confirmation or ""):
+            if token not in self._conf_vocab:
+                self._conf_vocab[token] = len(self._conf_vocab)
+            mask |= 1 << self._conf_vocab[token]
+        return codes, mask, report.rr_long or report.rr_short or 0, bool(report.success)
+
+    def add(self, reports):
+        """
+        Добавляет отчеты (ORM-объекты или строки запроса с теми же атрибутами);
+        отчет с уже известным id заменяет прежнюю строку. Отчеты без результата
+        (success is None) пропускаются. Сверх max_rows удаляются строки с наименьшим id.
+
+        Возвращает:
+        - количество добавленных или замененных строк
+        """
+        added = 0
+        for report in reports:
+            if report.success is None:
+                continue
+            report_id = getattr(report, "id", None)
+            if report_id is None:
+                self._anonymous -= 1
+                report_id = self._anonymous
+            self._rows[report_id] = self._encode(report)
+            added += 1
+        if len(self._rows) > self.max_rows:
+            for report_id in sorted(self._rows)[:len(self._rows) - self.max_rows]:
+                del self._rows[report_id]
+        if added:
+            self._arrays = None
+            self._snapshot = None
+        return added
+
+    def sync(self, resolved, load):
+        """
+        Приводит таблицу к окну завершенных отчетов.
+
+        Параметры:
+        - resolved: пары (id, success) последних max_rows завершенных отчетов
+        - load: load(ids) - строки отчетов с этими id (атрибуты как у add)
+
+        Загружаются только отчеты, которых нет в таблице или у которых изменился success;
+        отчеты, вышедшие из окна (или снова без результата), удаляются.
+
+        Возвращает:
+        - (добавлено/обновлено, удалено)
+        """
+        window = {report_id: bool(success) for report_id, success in resolved if success is not None}
+        stale = [report_id for report_id in self._rows if report_id not in window]
+        for report_id in stale:
+            del self._rows[report_id]
+        if stale:
+            self._arrays = None
+            self._snapshot = None
+        missing = [report_id for report_id, success in window.items()
+                   if report_id not in self._rows or self._rows[report_id][3] != success]
+        added = self.add(load(missing)) if missing else 0
+        return added, len(stale)
+
+    def snapshot(self):
+        """
+        Копия таблицы с уже собранными массивами для чтения без блокировки: ее не меняют
+        ни add, ни sync исходной таблицы. Пока таблица не менялась, возвращается та же копия.
+        """
+        if self._snapshot is None:
+            copy = ReportFeatureTable(self.max_rows)
+            copy._vocab = {field: dict(vocab) for field, vocab in self._vocab.items()}
+            copy._conf_vocab = dict(self._conf_vocab)
+            copy._rows = dict(self._rows)
+            copy._build()
+            self._snapshot = copy
+        return self._snapshot
+
+    def _mask_words(self, mask, n_words):
+        return [(mask >> (64 * w)) & 0xFFFFFFFFFFFFFFFF for w in range(n_words)]
+
+    def _build(self):
+        n_words = max(1, -(-len(self._conf_vocab) // 64))
+        rows = list(self._rows.values())
+        codes = np.array([row[0] for row in rows], dtype=np.int64).reshape(-1, len(self.CATEGORICAL))
+        self._arrays = {
+            "codes": {field: codes[:, k] for k, field in enumerate(self.CATEGORICAL)},
+            "conf": np.array([self._mask_words(row[1], n_words) for row in rows], dtype=np.uint64).reshape(-1, n_words),
+            "rr": np.array([row[2] for row in rows], dtype=float),
+            "success": np.array([row[3] for row in rows], dtype=bool),
+            "n_words": n_words,
+        }
+        return self._arrays
+
+    def similarity(self, current_params):
+        """Оценка схожести каждого отчета с текущими параметрами (массив float)."""
+        arrays = self._arrays or self._build()
+        n = len(self)
+
+        matches = np.zeros(n, dtype=np.int64)
+        for field in self.CATEGORICAL:
+            value = current_params.get(field, "")
+            code = self._vocab[field].get(value, -2) if value else -2
+            matches += arrays["codes"][field] == code
+
+        # Сравниваем R:R (с допуском)
+        current_rr = current_params.get("rr_long") or current_params.get("rr_short") or 0
+        if current_rr > 0:
+            rr_diff = np.abs(arrays["rr"] - current_rr) / max(current_rr, 0.1)
+        else:
+            rr_diff = np.ones(n)
+
+        # Сравниваем confirmation через битовые маски
+        current_tokens = _confirmation_tokens(current_params.get("confirmation", ""))
+        current_mask = 0
+        extra_tokens = 0  # Токены, которых нет ни в одном отчете - входят только в объединение
+        for token in current_tokens:
+            if token in self._conf_vocab:
+                current_mask |= 1 << self._conf_vocab[token]
+            else:
+                extra_tokens += 1
+        current_words = np.array(self._mask_words(current_mask, arrays["n_words"]), dtype=np.uint64)
+        intersection = _popcount(arrays["conf"] & current_words)
+        union = _popcount(arrays["conf"] | current_words) + extra_tokens
+        conf_similarity = intersection / np.maximum(union, 1)
+
+        return (matches / 4) * 0.6 + (1 - np.minimum(rr_diff, 1)) * 0.2 + conf_similarity * 0.2
+
+    def success_flags(self):
+        arrays = self._arrays or self._build()
+        return arrays["success"]
+
+
 def predict_ml_success(current_params, historical_reports, similarity_threshold=0.2):
     """
     ML-прогноз вероятности успеха на основе похожих паттернов из истории.
     
     Параметры:
     - current_params: dict с текущими параметрами (strategy, trading_type, direction, trend, rr_long, rr_short, confirmation)
-    - historical_reports: список объектов ReportV2 из БД
+    - historical_reports: ReportFeatureTable или список объектов ReportV2 из БД
     - similarity_threshold: порог схожести (20% отклонение)
     
     Возвращает:
@@ -2773,91 +3778,168 @@ def predict_ml_success(current_params, historical_reports, similarity_threshold=
         if not historical_reports or len(historical_reports) < 5:
             return None, 0, "low"
         
-        similar_reports = []
-        
-        # Извлекаем текущие параметры
-        current_strategy = current_params.get("strategy", "")
-        current_trading_type = current_params.get("trading_type", "")
-        current_direction = current_params.get("direction", "")
-        current_trend = current_params.get("trend", "")
-        current_rr = current_params.get("rr_long") or current_params.get("rr_short") or 0
-        current_confirmation = current_params.get("confirmation", "")
+        if isinstance(historical_reports, ReportFeatureTable):
+            table = historical_reports
+        else:
+            table = ReportFeatureTable.from_reports(historical_reports)
+        if not len(table):
+            return None, 0, "low"
         
-        # Нормализуем confirmation для сравнения
-        current_conf_set = set([c.strip().upper() for c in str(current_confirmation).split("+") if c.strip()])
+        # Схожесть всех отчетов сразу
+        similar = table.similarity(current_params) >= (1 - similarity_threshold)
+        similar_count = int(similar.sum())
         
-        # Ищем похожие случаи
-        for report in historical_reports:
-            if report.success is None:  # Пропускаем отчёты без результата
-                continue
-            
-            # Проверяем схожесть по параметрам
-            strategy_match = (report.strategy == current_strategy) if report.strategy else False
-            trading_type_match = (report.trading_type == current_trading_type) if report.trading_type else False
-            direction_match = (report.direction == current_direction) if report.direction else False
-            trend_match = (report.trend == current_trend) if report.trend else False
-            
-            # Сравниваем R:R (с допуском)
-            report_rr = report.rr_long or report.rr_short or 0
-            rr_diff = abs(report_rr - current_rr) / max(current_rr, 0.1) if current_rr > 0 else 1
-            
-            # Сравниваем confirmation
-            report_conf = set([c.strip().upper() for c in str(report.confirmation or "").split("+") if c.strip()])
-            conf_similarity = len(current_conf_set & report_conf) / max(len(current_conf_set | report_conf), 1)
-            
-            # Вычисляем общую схожесть
-            matches = sum([strategy_match, trading_type_match, direction_match, trend_match])
-            similarity_score = (matches / 4) * 0.6 + (1 - min(rr_diff, 1)) * 0.2 + conf_similarity * 0.2
-            
-            if similarity_score >= (1 - similarity_threshold):
-                similar_reports.append(report)
-        
-        if not similar_reports:
+        if not similar_count:
             return None, 0, "low"
         
         # Вычисляем вероятность успеха
-        successful = sum(1 for r in similar_reports if r.success)
+        successful = int(table.success_flags()[similar].sum())
         alpha = 1.0
         beta = 1.0
-        success_probability = ((successful + alpha) / (len(similar_reports) + alpha + beta)) * 100
+        success_probability = ((successful + alpha) / (similar_count + alpha + beta)) * 100
         
         # Определяем уровень уверенности (возвращаем ключи для перевода)
-        if len(similar_reports) >= 20:
+        if similar_count >= 20:
             confidence = "high"
-        elif len(similar_reports) >= 10:
+        elif similar_count >= 10:
             confidence = "medium"
         else:
             confidence = "low"
         
-        return success_probability, len(similar_reports), confidence
+        return success_probability, similar_count, confidence
     
     except Exception as e:
         print(f"⚠️ Ошибка в predict_ml_success: {e}")
         traceback.print_exc()
         return None, 0, "low"
 
+def calculate_levels(latest, strat, atr, current_price, enable_trailing=False, trailing_percent=0.5):
+    """
+    Уровни входа, стоп-лосса и тейк-профита для лонга и шорта по последней свече.
+    Общая часть run_analysis и сканера рынков (scan_markets).
+
+    Параметры:
+    - latest: последняя строка кадра с индикаторами
+    - strat: параметры стратегии из STRATEGIES
+    - atr: ATR с уже примененным минимальным значением
+    - current_price: цена закрытия последней свечи
+
+    Возвращает:
+    - dict: long_entry/long_sl/long_tp, short_entry/short_sl/short_tp и уровни трейлинга
+      long_trailing_sl_at_tp/short_trailing_sl_at_tp (None, если трейлинг выключен)
+    """
+    long_trailing_sl_at_tp = None
+    short_trailing_sl_at_tp = None
+
+    # ✅ Используем calculate_entry для согласованности с backtest
+    long_entry = calculate_entry(latest, strat, "long")
+    
+    # ✅ ИСПРАВЛЕНО: Проверяем long_entry сразу после вычисления
+    if pd.isna(long_entry) or long_entry is None or long_entry <= 0:
+        print(f"⚠️ Проблема с long_entry: {long_entry}, используем fallback на current_price={current_price}")
+        long_entry = current_price  # Fallback на текущую цену
+    
+    # ✅ ИСПРАВЛЕНО: Проверяем что long_entry не равен current_price (слишком близко)
+    if abs(long_entry - current_price) < current_price * 0.0001:
+        long_entry = current_price * 1.001  # Делаем немного выше текущей цены
+    
+    long_sl_base = long_entry - strat["atr_sl"] * atr
+    long_tp_base = long_entry + strat["atr_tp"] * atr
+    
+    short_entry = calculate_entry(latest, strat, "short")
+    
+    # ✅ ИСПРАВЛЕНО: Проверяем short_entry сразу после вычисления
+    if pd.isna(short_entry) or short_entry is None or short_entry <= 0:
+        short_entry = current_price
+    
+    short_sl_base = short_entry + strat["atr_sl"] * atr
+    short_tp_base = short_entry - strat["atr_tp"] * atr
+    
+    # ✅ Проверка минимального расстояния SL/TP (минимум 0.05% от цены для реализуемости)
+    min_distance = current_price * 0.0005
+    if abs(long_entry - long_sl_base) < min_distance:
+        long_sl_base = long_entry - min_distance
+    if abs(long_tp_base - long_entry) < min_distance:
+        long_tp_base = long_entry + min_distance
+    
+    # ✅ Проверка минимального расстояния SL/TP для шорта
+    if abs(short_sl_base - short_entry) < min_distance:
+        short_sl_base = short_entry + min_distance
+    if abs(short_entry - short_tp_base) < min_distance:
+        short_tp_base = short_entry - min_distance
+    
+    # Применяем трейлинг-логику, если включена
+    # ВАЖНО: Trailing stop показывает ПОТЕНЦИАЛЬНУЮ позицию стопа после достижения TP
+    # При входе в позицию стоп остается на базовом уровне (long_sl_base/short_sl_base)
+    # Стоп подтягивается только когда цена движется в нашу сторону
+    if enable_trailing:
+        # Для лонга: trailing показывает уровень стопа при достижении TP
+        # Это уровень, до которого стоп подтянется, если цена дойдет до TP
+        long_profit_distance = long_tp_base - long_entry
+        # Trailing SL при достижении TP будет на уровне: вход + (прибыль * trailing_percent)
+        # Но при входе стоп остается на базовом уровне (ниже входа!)
+        long_trailing_sl_at_tp = long_entry + (long_profit_distance * trailing_percent)
+        # Используем базовый стоп для входа (ниже цены входа)
+        long_sl = long_sl_base
+        
+        # Для шорта: аналогично, стоп подтягивается вниз при движении цены вниз
+        short_profit_distance = short_entry - short_tp_base
+        short_trailing_sl_at_tp = short_entry - (short_profit_distance * trailing_percent)
+        # Используем базовый стоп для входа (выше цены входа)
+        short_sl = short_sl_base
+    else:
+        long_sl = long_sl_base
+        short_sl = short_sl_base
+    
+    long_tp = long_tp_base
+    short_tp = short_tp_base
+
+    # ✅ Дополнительная проверка валидности значений перед использованием
+    if pd.isna(long_entry) or long_entry is None or long_entry <= 0:
+        long_entry = current_price
+    if pd.isna(long_sl) or long_sl is None or long_sl <= 0:
+        long_sl = long_entry * 0.99  # Fallback на 1% ниже входа
+    if pd.isna(long_tp) or long_tp is None or long_tp <= 0:
+        long_tp = long_entry * 1.02  # Fallback на 2% выше входа
+
+    # То же для шорта
+    if pd.isna(short_entry) or short_entry is None or short_entry <= 0:
+        short_entry = current_price
+    if pd.isna(short_sl) or short_sl is None or short_sl <= 0:
+        short_sl = short_entry * 1.01  # Для шорта SL выше входа
+    if pd.isna(short_tp) or short_tp is None or short_tp <= 0:
+        short_tp = short_entry * 0.98  # Для шорта TP ниже входа
+
+    return {
+        "long_entry": long_entry,
+        "long_sl": long_sl,
+        "long_tp": long_tp,
+        "short_entry": short_entry,
+        "short_sl": short_sl,
+        "short_tp": short_tp,
+        "long_trailing_sl_at_tp": long_trailing_sl_at_tp,
+        "short_trailing_sl_at_tp": short_trailing_sl_at_tp,
+    }
+
+
 def run_analysis(symbol, timeframe=None, strategy="Сбалансированная", trading_type="Дейтрейдинг",
                  capital=10000, risk=0.01, range_days=None, confirmation=None, min_reliability=50, 
                  enable_forecast=False, enable_backtest=False, backtest_days=None, enable_ml=False, 
-                 historical_reports=None, enable_trailing=False, trailing_percent=0.5, spread=0.0, language="ru"):
+                 historical_reports=None, enable_trailing=False, trailing_percent=0.5, spread=0.0, language="ru",
+                 market_df=None, walk_forward=0, chart_format="png", monte_carlo=0):
     try:
         report_text = ""  # ✅ Добавь эту строку прямо тут
-        if timeframe is None:
-            timeframe = DEFAULT_TIMEFRAMES.get(trading_type, "1d")
-        if range_days is None:
-            range_days = TRADING_HISTORY_DAYS.get(trading_type, 30)
+        timeframe, range_days = market_params(trading_type, timeframe, range_days)
 
-        df = fetch_ohlcv(symbol, timeframe, history_days=range_days)
-        if df.empty:
-            raise ValueError("Пустой DataFrame: нет исторических данных")
+        if market_df is not None:
+            # Кадр рынка уже подготовлен (prepare_market_frame) и общий для нескольких анализов
+            df = market_df.copy()
+        else:
+            df = fetch_ohlcv(symbol, timeframe, history_days=range_days)
+            if df.empty:
+                raise ValueError("Пустой DataFrame: нет исторических данных")
 
-        df = add_indicators(df)
-        df["VWMA_20"] = (df["Close"] * df["Volume"]).rolling(20).sum() / df["Volume"].rolling(20).sum()
-        df["BB_middle"] = df["Close"].rolling(20).mean()
-        df["BB_std"] = df["Close"].rolling(20).std()
-        df["BB_upper"] = df["BB_middle"] + 2 * df["BB_std"]
-        df["BB_lower"] = df["BB_middle"] - 2 * df["BB_std"]
-        df["ADX"] = compute_adx(df).fillna(0)
+            df = build_indicator_frame(df, symbol, timeframe)
 
         # Отбираем строки с валидными Close и ATR_14 (ATR требует минимум 14 строк данных)
         df_valid = df.dropna(subset=["Close", "ATR_14"])
@@ -2880,104 +3962,18 @@ def run_analysis(symbol, timeframe=None, strategy="Сбалансированн
         prev_row = df_valid.iloc[-2] if len(df_valid) > 1 else None
         
         # Обработка confirmation для user_selected (должно быть определено до использования)
-        conf = confirmation
-        user_selected = []
-        if isinstance(conf, str):
-            conf_str = conf.strip()
-            if conf_str.upper() in ("NONE", "", "N/A"):
-                user_selected = []
-            elif conf_str.upper() == "ALL":
-                user_selected = ["ALL"]
-            else:
-                user_selected = [s.strip().upper() for s in conf_str.split("+") if s.strip()]
-        elif isinstance(conf, (list, tuple)):
-            user_selected = [str(c).strip().upper() for c in conf if str(c).strip()]
-        elif conf is not None:
-            user_selected = [str(conf).strip().upper()]
+        user_selected = _parse_confirmation(confirmation)
+        # Условия подтверждений - из той же матрицы, что использует бэктест (последняя свеча и предыдущая)
+        latest_flags = confirmation_matrix(df_valid.iloc[-2:]).iloc[-1]
         
-        user_confirmation_result, passed_count, total_count, reliability_rating = check_confirmations(latest, user_selected, prev_row=prev_row, language=language)
+        user_confirmation_result, passed_count, total_count, reliability_rating = check_confirmations(latest, user_selected, prev_row=prev_row, language=language, flags=latest_flags)
         risk_adj = dynamic_risk(risk, latest["RSI_14"], latest["Trend"], adx=adx, reliability_rating=reliability_rating)
         if risk_adj is None:
             risk_adj = risk  # Fallback на базовый риск, если dynamic_risk вернул None
 
-        # ✅ Используем calculate_entry для согласованности с backtest
-        long_entry = calculate_entry(latest, strat, "long")
-        
-        # ✅ ИСПРАВЛЕНО: Проверяем long_entry сразу после вычисления
-        if pd.isna(long_entry) or long_entry is None or long_entry <= 0:
-            print(f"⚠️ Проблема с long_entry: {long_entry}, используем fallback на current_price={current_price}")
-            long_entry = current_price  # Fallback на текущую цену
-        
-        # ✅ ИСПРАВЛЕНО: Проверяем что long_entry не равен current_price (слишком близко)
-        if abs(long_entry - current_price) < current_price * 0.0001:
-            long_entry = current_price * 1.001  # Делаем немного выше текущей цены
-        
-        long_sl_base = long_entry - strat["atr_sl"] * atr
-        long_tp_base = long_entry + strat["atr_tp"] * atr
-        
-        short_entry = calculate_entry(latest, strat, "short")
-        
-        # ✅ ИСПРАВЛЕНО: Проверяем short_entry сразу после вычисления
-        if pd.isna(short_entry) or short_entry is None or short_entry <= 0:
-            short_entry = current_price
-        
-        short_sl_base = short_entry + strat["atr_sl"] * atr
-        short_tp_base = short_entry - strat["atr_tp"] * atr
-        
-        # ✅ Проверка минимального расстояния SL/TP (минимум 0.05% от цены для реализуемости)
-        min_distance = current_price * 0.0005
-        if abs(long_entry - long_sl_base) < min_distance:
-            long_sl_base = long_entry - min_distance
-        if abs(long_tp_base - long_entry) < min_distance:
-            long_tp_base = long_entry + min_distance
-        
-        # ✅ Проверка минимального расстояния SL/TP для шорта
-        if abs(short_sl_base - short_entry) < min_distance:
-            short_sl_base = short_entry + min_distance
-        if abs(short_entry - short_tp_base) < min_distance:
-            short_tp_base = short_entry - min_distance
-        
-        # Применяем трейлинг-логику, если включена
-        # ВАЖНО: Trailing stop показывает ПОТЕНЦИАЛЬНУЮ позицию стопа после достижения TP
-        # При входе в позицию стоп остается на базовом уровне (long_sl_base/short_sl_base)
-        # Стоп подтягивается только когда цена движется в нашу сторону
-        if enable_trailing:
-            # Для лонга: trailing показывает уровень стопа при достижении TP
-            # Это уровень, до которого стоп подтянется, если цена дойдет до TP
-            long_profit_distance = long_tp_base - long_entry
-            # Trailing SL при достижении TP будет на уровне: вход + (прибыль * trailing_percent)
-            # Но при входе стоп остается на базовом уровне (ниже входа!)
-            long_trailing_sl_at_tp = long_entry + (long_profit_distance * trailing_percent)
-            # Используем базовый стоп для входа (ниже цены входа)
-            long_sl = long_sl_base
-            
-            # Для шорта: аналогично, стоп подтягивается вниз при движении цены вниз
-            short_profit_distance = short_entry - short_tp_base
-            short_trailing_sl_at_tp = short_entry - (short_profit_distance * trailing_percent)
-            # Используем базовый стоп для входа (выше цены входа)
-            short_sl = short_sl_base
-        else:
-            long_sl = long_sl_base
-            short_sl = short_sl_base
-        
-        long_tp = long_tp_base
-        short_tp = short_tp_base
-
-        # ✅ Дополнительная проверка валидности значений перед использованием
-        if pd.isna(long_entry) or long_entry is None or long_entry <= 0:
-            long_entry = current_price
-        if pd.isna(long_sl) or long_sl is None or long_sl <= 0:
-            long_sl = long_entry * 0.99  # Fallback на 1% ниже входа
-        if pd.isna(long_tp) or long_tp is None or long_tp <= 0:
-            long_tp = long_entry * 1.02  # Fallback на 2% выше входа
-
-        # То же для шорта
-        if pd.isna(short_entry) or short_entry is None or short_entry <= 0:
-            short_entry = current_price
-        if pd.isna(short_sl) or short_sl is None or short_sl <= 0:
-            short_sl = short_entry * 1.01  # Для шорта SL выше входа
-        if pd.isna(short_tp) or short_tp is None or short_tp <= 0:
-            short_tp = short_entry * 0.98  # Для шорта TP ниже входа
+        levels = calculate_levels(latest, strat, atr, current_price, enable_trailing, trailing_percent)
+        long_entry, long_sl, long_tp = levels["long_entry"], levels["long_sl"], levels["long_tp"]
+        short_entry, short_sl, short_tp = levels["short_entry"], levels["short_sl"], levels["short_tp"]
 
         long_units, long_dollars = position_size(capital, risk_adj, long_entry, long_sl)
         short_units, short_dollars = position_size(capital, risk_adj, short_entry, short_sl)
@@ -3252,51 +4248,65 @@ def run_analysis(symbol, timeframe=None, strategy="Сбалансированн
 
 """
 
-                # --- График с уровнями входа/выхода ---
+        # --- График с уровнями входа/выхода ---
+        # Спецификация графика строится здесь, PNG рисует пул процессов CHART_RENDERER (с кэшем);
+        # chart_format="json" - вместо PNG вернуть саму спецификацию для отрисовки на клиенте
         df_plot = df.tail(120)
-        fig, ax = plt.subplots(figsize=(10, 5))
-        ax.plot(df_plot.index, df_plot["Close"], label="Close", lw=1.5)
-        ax.plot(df_plot.index, df_plot["EMA_20"], label="EMA20", alpha=0.7)
-        ax.plot(df_plot.index, df_plot["EMA_50"], label="EMA50", alpha=0.7)
-        ax.plot(df_plot.index, df_plot["EMA_200"], label="EMA200", alpha=0.7)
 
         # ✅ Используем переводы для меток графика
         t_chart = lambda key: get_report_translation(key, language, default=key)
-        ax.axhline(latest["Close"], color="cyan", lw=1, linestyle="--", label=t_chart("current_price"))
 
         preferred_side = "LONG" if trend == "Uptrend" else "SHORT"
         preferred_side_text = t_chart("long") if preferred_side == "LONG" else t_chart("short")
 
+        chart_levels = [(latest["Close"], "cyan", 1, "--", t_chart("current_price"))]
         if preferred_side == "LONG":
-            ax.axhline(long_entry, color="lime", lw=1.5, linestyle="--", label=t_chart("chart_entry"))
-            ax.axhline(long_tp, color="gold", lw=1.5, linestyle="--", label=t_chart("chart_take_profit"))
-            ax.axhline(long_sl, color="red", lw=1.5, linestyle="--", label=t_chart("chart_stop_loss"))
+            chart_levels += [
+                (long_entry, "lime", 1.5, "--", t_chart("chart_entry")),
+                (long_tp, "gold", 1.5, "--", t_chart("chart_take_profit")),
+                (long_sl, "red", 1.5, "--", t_chart("chart_stop_loss")),
+            ]
         else:
-            ax.axhline(short_entry, color="orange", lw=1.5, linestyle="--", label=t_chart("chart_entry"))
-            ax.axhline(short_tp, color="gold", lw=1.5, linestyle="--", label=t_chart("chart_take_profit"))
-            ax.axhline(short_sl, color="red", lw=1.5, linestyle="--", label=t_chart("chart_stop_loss"))
+            chart_levels += [
+                (short_entry, "orange", 1.5, "--", t_chart("chart_entry")),
+                (short_tp, "gold", 1.5, "--", t_chart("chart_take_profit")),
+                (short_sl, "red", 1.5, "--", t_chart("chart_stop_loss")),
+            ]
 
-        ax.legend(loc="upper left", fontsize=8)
-        ax.grid(True, alpha=0.3)
         # ✅ Переводим стратегию и тип торговли для заголовка
         strategy_translated = get_report_translation("strategy_" + STRATEGY_MAP.get(strategy, strategy.lower().replace(' ', '_')), language, default=strategy)
         trading_type_translated = get_report_translation("trading_type_" + TRADING_TYPE_MAP.get(trading_type, trading_type.lower().replace(' ', '_')), language, default=trading_type)
-        ax.set_title(f"{symbol} — {strategy_translated} ({trading_type_translated}) [{preferred_side_text}]")
+        chart_title = f"{symbol} — {strategy_translated} ({trading_type_translated}) [{preferred_side_text}]"
 
-        buf_chart = io.BytesIO()
-        plt.tight_layout()
-        plt.savefig(buf_chart, format="png", bbox_inches="tight", dpi=90)
-        buf_chart.seek(0)
-        plt.close(fig)
+        chart = chart_spec(
+            df_plot.index,
+            [
+                ("Close", df_plot["Close"], {"lw": 1.5}),
+                ("EMA20", df_plot["EMA_20"], {"alpha": 0.7}),
+                ("EMA50", df_plot["EMA_50"], {"alpha": 0.7}),
+                ("EMA200", df_plot["EMA_200"], {"alpha": 0.7}),
+            ],
+            chart_levels,
+            chart_title,
+        )
+        if chart_format == "json":
+            buf_chart = chart
+        else:
+            # Ключ кэша: рынок, последняя свеча, уровни (в них и текущая цена) и язык;
+            # заголовок - на случай разных стратегий с одинаковыми уровнями
+            chart_key = (
+                symbol, timeframe, int(df_plot.index[-1].value), language, chart_title,
+                tuple(round(float(level[0]), 10) for level in chart_levels),
+            )
+            buf_chart = CHART_RENDERER.render(chart, key=chart_key)
 
 
 
-        # --- Excel ---
-        df_excel = df.copy()
-        df_excel.index = df_excel.index.tz_localize(None)
-        buf_excel = io.BytesIO()
-        df_excel.to_excel(buf_excel)
-        buf_excel.seek(0)
+        # --- Данные для Excel / CSV / Parquet ---
+        # Файл не собирается здесь: кадр возвращается как есть, экспорт - по запросу
+        # (core.frame_export.write_export из кадра в памяти). Поверхностная копия без копирования
+        # данных: колонки, которые ниже добавляет бэктест, в экспорт не попадают, как и раньше
+        indicator_frame = df.copy(deep=False)
 
         # Определяем направление и цены для новой таблицы
         # Используем реальные TP/SL из стратегии, а не пересчитываем из R:R
@@ -3346,24 +4356,37 @@ def run_analysis(symbol, timeframe=None, strategy="Сбалансированн
                 # Загружаем дополнительные данные для бэктеста
                 df_backtest = fetch_ohlcv(symbol, timeframe, history_days=backtest_range)
                 if not df_backtest.empty and len(df_backtest) > 100:
-                    df_backtest = add_indicators(df_backtest)
-                    df_backtest["VWMA_20"] = (df_backtest["Close"] * df_backtest["Volume"]).rolling(20).sum() / df_backtest["Volume"].rolling(20).sum()
-                    df_backtest["BB_middle"] = df_backtest["Close"].rolling(20).mean()
-                    df_backtest["BB_std"] = df_backtest["Close"].rolling(20).std()
-                    df_backtest["BB_upper"] = df_backtest["BB_middle"] + 2 * df_backtest["BB_std"]
-                    df_backtest["BB_lower"] = df_backtest["BB_middle"] - 2 * df_backtest["BB_std"]
-                    df_backtest["ADX"] = compute_adx(df_backtest).fillna(0)
+                    df_backtest = build_indicator_frame(df_backtest, symbol, timeframe)
                     df_backtest["Trend"] = np.where(df_backtest["EMA_50"] > df_backtest["EMA_200"], "Uptrend", "Downtrend")
                 else:
                     df_backtest = df  # Используем текущие данные
             else:
                 df_backtest = df
             
-            backtest_result = backtest_strategy(df_backtest, strategy, trading_type, confirmation, capital, risk, spread=spread)
+            backtest_result = backtest_strategy(df_backtest, strategy, trading_type, confirmation, capital, risk, spread=spread,
+                                                walk_forward=walk_forward, monte_carlo=monte_carlo)
             if backtest_result:
                 t_bt = lambda key: get_report_translation(key, language)
+                backtest_period = t_bt('backtest_last_days').format(days=backtest_range)
+                in_sample_row = ""
+                if backtest_result.get("mode") == "walk_forward":
+                    # Метрики только по тестовым окнам; win rate обучения - для сравнения с ними
+                    backtest_period += f", {t_bt('backtest_walk_forward').format(windows=len(backtest_result['windows']))}"
+                    in_sample_row = f"| {t_bt('backtest_in_sample_win_rate')} | {backtest_result['in_sample']['win_rate']:.1f}% |\n"
+                monte_carlo_rows = ""
+                mc = backtest_result.get("monte_carlo")
+                if mc:
+                    # Разброс результата при другом порядке сделок и других издержках исполнения
+                    monte_carlo_rows = (
+                        f"| {t_bt('backtest_mc_return_range').format(simulations=mc['simulations'])} | "
+                        f"{mc['return_pct']['p5']:+.2f}% … {mc['return_pct']['p95']:+.2f}% |\n"
+                        f"| {t_bt('backtest_mc_median_return')} | {mc['return_pct']['p50']:+.2f}% |\n"
+                        f"| {t_bt('backtest_mc_drawdown_p95')} | {mc['max_drawdown_pct']['p95']:.2f}% |\n"
+                        f"| {t_bt('backtest_mc_prob_loss')} | {mc['prob_loss']:.1f}% |\n"
+                        f"| {t_bt('backtest_mc_prob_ruin').format(ruin=mc['ruin_pct'])} | {mc['prob_ruin']:.1f}% |\n"
+                    )
                 backtest_text = (
-                    f"\n### 📈 {t_bt('backtest_results_title')} ({t_bt('backtest_last_days').format(days=backtest_range)})\n"
+                    f"\n### 📈 {t_bt('backtest_results_title')} ({backtest_period})\n"
                     f"[DIVIDER]\n"
                     f"| {t_bt('indicator')} | {t_bt('value')} |\n"
                     f"|------------|----------|\n"
@@ -3371,10 +4394,12 @@ def run_analysis(symbol, timeframe=None, strategy="Сбалансированн
                     f"| {t_bt('backtest_winning_trades')} | {backtest_result['winning_trades']} |\n"
                     f"| {t_bt('backtest_losing_trades')} | {backtest_result['losing_trades']} |\n"
                     f"| {t_bt('backtest_win_rate')} | {backtest_result['win_rate']:.1f}% |\n"
+                    f"{in_sample_row}"
                     f"| {t_bt('backtest_total_profit')} | {backtest_result['total_profit_pct']:+.2f}% |\n"
                     f"| {t_bt('backtest_max_drawdown')} | {backtest_result['max_drawdown']:.2f}% |\n"
                     f"| {t_bt('backtest_avg_rr')} | {backtest_result['avg_rr']:.2f} |\n"
                     f"| {t_bt('backtest_final_capital')} | ${backtest_result['final_capital']:,.2f} |\n"
+                    f"{monte_carlo_rows}"
                     f"[BACKTEST_EXPLANATION]\n"
                 )
         
@@ -3443,25 +4468,20 @@ def run_analysis(symbol, timeframe=None, strategy="Сбалансированн
         # Это позволяет перегенерировать отчет на другом языке без повторного анализа
         full_report_with_keys = full_report  # Сохраняем сырой markdown с ключами {{key}}
         
-        # ✅ НОВОЕ: Генерируем отчеты на всех трех языках сразу для мгновенного переключения
-        reports_by_language = {
-            "ru": translate_markdown(full_report_with_keys, "ru"),
-            "en": translate_markdown(full_report_with_keys, "en"),
-            "uk": translate_markdown(full_report_with_keys, "uk")
-        }
-        
         # ✅ ГАРАНТИРОВАННАЯ ЗАМЕНА ВСЕХ КЛЮЧЕЙ НА ПЕРЕВОДЫ НА СЕРВЕРЕ
-        # Это гарантирует 100% перевод всех {{key}} перед отправкой на клиент
-        full_report = translate_markdown(full_report, language)
+        # Отрисовываем только запрошенный язык; остальные - по запросу через render_report
+        report_language = language if language in REPORT_TRANSLATIONS else "ru"
+        full_report = translate_markdown(full_report_with_keys, report_language)
+        reports_by_language = {report_language: full_report}
         
         # ✅ ФАЗА 2: Добавляем RSI в возврат для использования в app.py
         rsi_value = latest.get("RSI_14", 50.0)  # Fallback на 50, если RSI не вычислен
         
         return (
-            reports_by_language,      # ✅ Словарь с отчетами на всех языках {"ru": "...", "en": "...", "uk": "..."}
-            full_report_with_keys,    # Сырой markdown с ключами для перегенерации (для совместимости)
-            buf_chart,
-            buf_excel,
+            reports_by_language,      # ✅ Отчет на запрошенном языке {"en": "..."}
+            full_report_with_keys,    # Сырой markdown с ключами для перегенерации (store_report / render_report)
+            buf_chart,                # PNG (BytesIO) или, при chart_format="json", спецификация графика (dict)
+            indicator_frame,          # Кадр индикаторов для экспорта по запросу (вместо готового xlsx)
             symbol,
             rr_long,
             rr_short,
@@ -3486,3 +4506,155 @@ def run_analysis(symbol, timeframe=None, strategy="Сбалансированн
         print(tb)
         raise
 
+
+
+# === Сканер рынков: тот же конвейер индикаторов и подтверждений без отчета, графика и Excel ===
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "8"))
+SCAN_MAX_SYMBOLS = int(os.getenv("SCAN_MAX_SYMBOLS", "300"))
+
+
+def top_symbols_by_volume(limit=50, quote="USDT", client=None):
+    """
+    Самые ликвидные спотовые пары по объему торгов за 24 часа (в валюте котировки).
+
+    Возвращает:
+    - Список символов ["BTC/USDT", ...], отсортированный по убыванию объема
+    """
+    if client is None:
+        client = exchange
+    tickers = client.fetch_tickers()
+    suffix = f"/{quote.upper()}"
+    volumes = [
+        (symbol, float(ticker.get("quoteVolume") or 0.0))
+        for symbol, ticker in tickers.items()
+        if symbol.endswith(suffix) and ":" not in symbol
+    ]
+    volumes.sort(key=lambda item: item[1], reverse=True)
+    return [symbol for symbol, _ in volumes[:max(0, int(limit))]]
+
+
+def _scan_number(value, digits=None):
+    """float для JSON: NaN/None -> None."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if value != value:
+        return None
+    return round(value, digits) if digits is not None else value
+
+
+def scan_symbol(symbol, strategy="Сбалансированная", trading_type="Дейтрейдинг", timeframe=None,
+                range_days=None, confirmation="ALL", market_df=None):
+    """
+    Сигнал по одному рынку: индикаторы, check_confirmations и уровни calculate_levels,
+    как в run_analysis, но без отчета, графика, Excel и внешних метрик.
+
+    Возвращает:
+    - dict строки сканера
+    """
+    timeframe, range_days = market_params(trading_type, timeframe, range_days)
+    if market_df is not None:
+        df = market_df
+    else:
+        df = fetch_ohlcv(symbol, timeframe, history_days=range_days)
+        if df.empty:
+            raise ValueError("Пустой DataFrame: нет исторических данных")
+        df = build_indicator_frame(df, symbol, timeframe)
+
+    df_valid = df.dropna(subset=["Close", "ATR_14"])
+    if df_valid.empty:
+        raise ValueError(f"Недостаточно данных для расчёта ATR: {len(df)} строк")
+
+    latest = df_valid.iloc[-1]
+    strat = STRATEGIES.get(strategy, STRATEGIES["Сбалансированная"])
+    current_price = latest.get("Close", 0)
+    atr = latest.get("ATR_14", np.nan)
+    if pd.isna(atr) or atr == 0 or atr < current_price * 0.001:
+        atr = current_price * 0.001
+
+    prev_row = df_valid.iloc[-2] if len(df_valid) > 1 else None
+    latest_flags = confirmation_matrix(df_valid.iloc[-2:]).iloc[-1]
+    _, passed_count, total_count, reliability_rating = check_confirmations(
+        latest, _parse_confirmation(confirmation), prev_row=prev_row, flags=latest_flags
+    )
+
+    levels = calculate_levels(latest, strat, atr, current_price)
+    rr_long = calculate_rr(levels["long_entry"], levels["long_sl"], levels["long_tp"])
+    rr_short = calculate_rr(levels["short_entry"], levels["short_sl"], levels["short_tp"])
+
+    trend = latest.get("Trend", "N/A")
+    direction = "long" if trend == "Uptrend" else "short"
+    return {
+        "symbol": symbol,
+        "timeframe": timeframe,
+        "candle_time": str(df_valid.index[-1]),
+        "price": _scan_number(current_price),
+        "trend": trend,
+        "direction": direction,
+        "entry": _scan_number(levels[f"{direction}_entry"]),
+        "stop_loss": _scan_number(levels[f"{direction}_sl"]),
+        "take_profit": _scan_number(levels[f"{direction}_tp"]),
+        "rr": _scan_number(rr_long if direction == "long" else rr_short, 2),
+        "rr_long": _scan_number(rr_long, 2),
+        "rr_short": _scan_number(rr_short, 2),
+        "reliability_rating": _scan_number(reliability_rating, 1),
+        "passed_count": passed_count,
+        "total_count": total_count,
+        "rsi": _scan_number(latest.get("RSI_14"), 2),
+        "adx": _scan_number(latest.get("ADX"), 2),
+    }
+
+
+def scan_markets(symbols, strategy="Сбалансированная", trading_type="Дейтрейдинг", timeframe=None,
+                 range_days=None, confirmation="ALL", min_reliability=0, max_workers=None):
+    """
+    Параллельный скан списка рынков.
+
+    Параметры:
+    - symbols: список символов (дубликаты отбрасываются, не больше SCAN_MAX_SYMBOLS)
+    - min_reliability: строки с меньшим рейтингом надежности не попадают в результат
+    - max_workers: потоков загрузки/расчета (по умолчанию SCAN_WORKERS)
+
+    Возвращает:
+    - dict: results - строки по убыванию reliability_rating, затем R:R; errors - {symbol: текст ошибки}
+    """
+    started = time.monotonic()
+    timeframe, range_days = market_params(trading_type, timeframe, range_days)
+    unique = []
+    for symbol in symbols or []:
+        symbol = str(symbol).strip().upper()
+        if symbol and symbol not in unique:
+            unique.append(symbol)
+    unique = unique[:SCAN_MAX_SYMBOLS]
+
+    results = []
+    errors = {}
+    workers = max(1, min(int(max_workers or SCAN_WORKERS), len(unique) or 1))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as pool:
+        futures = {
+            pool.submit(scan_symbol, symbol, strategy, trading_type, timeframe, range_days, confirmation): symbol
+            for symbol in unique
+        }
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                errors[symbol] = str(e) or type(e).__name__
+                continue
+            if (row["reliability_rating"] or 0) >= (min_reliability or 0):
+                results.append(row)
+
+    # Потоки завершаются в случайном порядке: при равных рейтинге и R:R порядок - по символу
+    results.sort(key=lambda row: row["symbol"])
+    results.sort(key=lambda row: (row["reliability_rating"] or 0, row["rr"] or 0), reverse=True)
+    return {
+        "strategy": strategy,
+        "trading_type": trading_type,
+        "timeframe": timeframe,
+        "scanned": len(unique),
+        "results": results,
+        "errors": errors,
+        "elapsed": round(time.monotonic() - started, 3),
+    }